@@ -0,0 +1,23 @@
+"""
+What the benchmark scripts share. Kept free of heavy imports so that
+startup_bench.py doesn't load Playwright by importing scrape_bench.py.
+"""
+
+import subprocess
+
+RESULTS_DIR = "bench_results"
+
+
+def git_commit():
+    """
+    The short hash of HEAD, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
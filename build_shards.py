@@ -0,0 +1,166 @@
+"""
+Static search shards for deployments without the search API.
+
+Splits the published events into tiles by geohash prefix (SHARD_PRECISION
+characters, cells of ~156 x 156 km), each written as gzipped JSON named after
+its content hash, plus a manifest listing them:
+
+    shards/manifest.json                  {"precision": 3, "tiles": {"drt": {...}}}
+    shards/tiles/drt.3f9c1a0b2e4d.json.gz
+
+search_page.html fetches the manifest (revalidated on every visit), then only
+the tiles that intersect the search radius. A tile's file name changes exactly
+when its events change, so tiles can be cached forever and an unchanged tile
+is never downloaded twice. Events without coordinates can't be in a radius
+search and are left out.
+
+    python build_shards.py                          # from audubon_events.json
+    python build_shards.py events.snapshot shards
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+
+from dedup import geohash
+from event_store import EVENTS_JSON_PATH, EventSnapshot, load_events
+
+SHARDS_DIR = "shards"
+SHARD_PRECISION = 3
+MANIFEST_NAME = "manifest.json"
+HASH_CHARS = 12  # Of the sha256, in tile file names
+# What the page needs to filter and render an event
+TILE_FIELDS = (
+    "title",
+    "date",
+    "ages",
+    "location",
+    "latitude",
+    "longitude",
+    "url",
+    "description",
+    "start",
+    "end",
+    "age_min",
+    "age_max",
+    "sources",
+)
+
+
+def _coordinates(event):
+    try:
+        return float(event["latitude"]), float(event["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def shard_events(events, precision=SHARD_PRECISION):
+    """
+    {geohash prefix: [events]}, each event trimmed to TILE_FIELDS, plus the
+    number of events left out for having no coordinates.
+    """
+    tiles = defaultdict(list)
+    skipped = 0
+    for event in events:
+        point = _coordinates(event)
+        if point is None:
+            skipped += 1
+            continue
+        tiles[geohash(*point, precision)].append(
+            {field: event.get(field) for field in TILE_FIELDS if field in event}
+        )
+    return tiles, skipped
+
+
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_shards(events_path=EVENTS_JSON_PATH, out_dir=SHARDS_DIR):
+    """
+    Writes changed tiles and the new manifest, then deletes tiles that
+    neither it nor the previous manifest uses (pages that loaded the previous
+    manifest can still fetch their tiles). Returns the manifest.
+    """
+    started = time.perf_counter()
+    events = load_events(events_path)
+    if isinstance(events, EventSnapshot):
+        events = [events.event(i) for i in range(len(events))]
+    tiles, skipped = shard_events(events)
+
+    tiles_dir = os.path.join(out_dir, "tiles")
+    os.makedirs(tiles_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    previous = _read_manifest(manifest_path) or {"tiles": {}}
+
+    manifest_tiles = {}
+    written = 0
+    for prefix in sorted(tiles):
+        payload = json.dumps(
+            tiles[prefix], ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        # mtime=0 so the same events always give the same bytes (and hash)
+        compressed = gzip.compress(payload, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(compressed).hexdigest()
+        name = f"{prefix}.{digest[:HASH_CHARS]}.json.gz"
+        path = os.path.join(tiles_dir, name)
+        if not os.path.exists(path):
+            _write_atomic(path, compressed)
+            written += 1
+        manifest_tiles[prefix] = {
+            "file": f"tiles/{name}",
+            "sha256": digest,
+            "count": len(tiles[prefix]),
+            "bytes": len(compressed),
+        }
+
+    manifest = {
+        "precision": SHARD_PRECISION,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "events": sum(tile["count"] for tile in manifest_tiles.values()),
+        "tiles": manifest_tiles,
+    }
+    _write_atomic(
+        manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8")
+    )
+
+    in_use = {
+        os.path.basename(tile["file"])
+        for tile in list(manifest_tiles.values()) + list(previous["tiles"].values())
+    }
+    removed = 0
+    for name in os.listdir(tiles_dir):
+        if name not in in_use:
+            os.remove(os.path.join(tiles_dir, name))
+            removed += 1
+
+    print(
+        f"[DEBUG] Sharded {manifest['events']} events into {len(manifest_tiles)} "
+        f"tiles ({written} written, {removed} removed, {skipped} events without "
+        f"coordinates) in {(time.perf_counter() - started) * 1000:.0f} ms; "
+        f"{sum(t['bytes'] for t in manifest_tiles.values()) / 1024:.1f} KiB total"
+    )
+    return manifest
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 3:
+        print("usage: python build_shards.py [EVENTS_PATH] [OUT_DIR]")
+    else:
+        build_shards(*sys.argv[1:])
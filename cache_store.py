@@ -0,0 +1,102 @@
+"""
+Small persistent key/value cache on top of SQLite.
+
+Used to remember results of slow or rate-limited lookups (geocoding, etc.)
+between runs of the scrapers. Values are stored as JSON, each entry has its own
+expiry time, and the table is trimmed back to `max_entries` by evicting the
+least recently used rows.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MISSING = object()  # Returned by get() when there is no usable entry
+
+
+class SqliteCache:
+    def __init__(self, path, table="cache", max_entries=5000):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_last_used"
+                f" ON {self.table} (last_used)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or MISSING if it is absent or expired.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return MISSING
+            value, expires_at = row
+            if expires_at < now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                conn.commit()
+                return MISSING
+            conn.execute(
+                f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key)
+            )
+            conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_used)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+        (count,) = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def __len__(self):
+        with self._lock:
+            (count,) = (
+                self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+            )
+        return count
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,227 @@
+"""
+One entry point for the ingestion jobs, e.g. for running them from cron or
+another scheduler:
+
+    python cli.py scrape [--incremental] [--page-budget N]
+    python cli.py gmail [--max-results N]
+    python cli.py imap [--host HOST] [--from SENDER] [--idle]
+    python cli.py build-index [--shards DIR]
+    python cli.py serve [--port 8000]
+    python cli.py daemon [--job NAME] [--interval NAME=MINUTES]
+
+Every command imports what it needs inside its handler, so a job only pays
+for its own dependencies: `serve` and `build-index` never load Playwright or
+the Google client libraries, `imap` never loads Playwright, and so on. Keep
+heavy imports out of the top of this module (and out of the top of the
+modules the commands import); startup_bench.py tracks the startup time of
+every command with --startup-only, which parses the arguments and does the
+imports, then exits before the job starts.
+"""
+
+import argparse
+import math
+import sys
+
+COMMANDS = ("scrape", "gmail", "imap", "build-index", "serve", "daemon")
+
+
+def _scrape(args):
+    from scrape_runner import run_scrape
+
+    options = {"incremental": args.incremental}
+    if args.page_budget is not None:
+        options["page_budget"] = args.page_budget
+    return lambda: run_scrape(**options)
+
+
+def _gmail(args):
+    from quickstart import main
+
+    return lambda: main(max_results=args.max_results)
+
+
+def _imap_criteria(args):
+    return f'FROM "{args.sender}"' if args.sender else None
+
+
+def _imap(args):
+    import imap
+
+    def job():
+        if args.user:
+            user, password = args.user, args.password
+        else:
+            user, password = imap.load_credentials(args.credentials)
+        conn = imap.connect(user, password, args.host, args.port, ssl=not args.no_ssl)
+        try:
+            imap.run(conn, args.mailbox, idle=args.idle, criteria=_imap_criteria(args))
+        finally:
+            conn.logout()
+
+    return job
+
+
+def _build_index(args):
+    import os
+
+    from build_shards import build_shards
+    from event_store import EVENTS_JSON_PATH, EventStore
+
+    def job():
+        # Like publish_events(): an empty store mustn't replace an export
+        # that still holds the only copy of the events
+        store = EventStore(args.store)
+        if store.sources() or not os.path.exists(EVENTS_JSON_PATH):
+            events = store.publish()
+            print(f"[DEBUG] Published {len(events)} events")
+        store.close()
+        build_shards(EVENTS_JSON_PATH, args.shards)
+
+    return job
+
+
+def _serve(args):
+    from event_service import serve
+
+    return lambda: serve(args.port, args.events)
+
+
+def _daemon(args):
+    intervals = {}
+    for value in args.interval or ():
+        name, _, minutes = value.rpartition("=")
+        try:
+            minutes = float(minutes)
+        except ValueError:
+            minutes = None
+        if not name or minutes is None or not 0 < minutes < math.inf:
+            args.parser.error(
+                f"argument --interval: expected NAME=MINUTES, got {value!r}"
+            )
+        intervals[name] = minutes
+
+    from daemon import run_daemon
+
+    options = {
+        "job_names": args.job,
+        "intervals": intervals,
+        "incremental": not args.full,
+        "gmail_max_results": args.max_results,
+        "imap_options": {
+            "credentials": args.credentials,
+            "user": args.user,
+            "password": args.password,
+            "host": args.host,
+            "port": args.port,
+            "ssl": not args.no_ssl,
+            "mailbox": args.mailbox,
+            "criteria": _imap_criteria(args),
+        },
+    }
+    if args.recycle_after is not None:
+        options["recycle_after"] = args.recycle_after
+    if args.page_budget is not None:
+        options["page_budget"] = args.page_budget
+    return lambda: run_daemon(**options)
+
+
+def _add_imap_arguments(parser):
+    parser.add_argument("--host", default="imap.gmail.com", help="IMAP server")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--no-ssl", action="store_true", help="for local test servers")
+    parser.add_argument("--mailbox", default="INBOX")
+    parser.add_argument("--from", dest="sender", help="only mail from this sender")
+    parser.add_argument("--credentials", default="credentials.yml")
+    parser.add_argument("--user", help="instead of the credentials file")
+    parser.add_argument("--password", default="")
+
+
+def build_parser():
+    # Defaults of the job modules are written out here (and None means "the
+    # module's default") so building the parser doesn't import them
+    parser = argparse.ArgumentParser(description="Family event ingestion jobs.")
+    parser.add_argument(
+        "--startup-only",
+        action="store_true",
+        help="import what the command needs and exit (see startup_bench.py)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scrape = commands.add_parser("scrape", help="scrape the event websites")
+    scrape.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only crawl until pages with already-known events are reached",
+    )
+    scrape.add_argument(
+        "--page-budget", type=int, help="max pages per paginated source in one run"
+    )
+    scrape.set_defaults(handler=_scrape)
+
+    gmail = commands.add_parser("gmail", help="extract events from Gmail newsletters")
+    gmail.add_argument("--max-results", type=int, default=10)
+    gmail.set_defaults(handler=_gmail)
+
+    imap = commands.add_parser("imap", help="extract events from an IMAP mailbox")
+    _add_imap_arguments(imap)
+    imap.add_argument("--idle", action="store_true", help="keep waiting for new mail")
+    imap.set_defaults(handler=_imap)
+
+    index = commands.add_parser(
+        "build-index", help="publish the event store and build the search shards"
+    )
+    index.add_argument("--store", default="events.sqlite3")
+    index.add_argument("--shards", default="shards")
+    index.set_defaults(handler=_build_index)
+
+    serve = commands.add_parser("serve", help="run the event search API")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument(
+        "--events", help="events.snapshot or a JSON export (default: snapshot if built)"
+    )
+    serve.set_defaults(handler=_serve)
+
+    daemon = commands.add_parser(
+        "daemon", help="keep ingesting every source on its own schedule"
+    )
+    daemon.add_argument(
+        "--job",
+        action="append",
+        help='a source name, "gmail" or "imap" (repeatable; default: the '
+        "scrapers and gmail)",
+    )
+    daemon.add_argument(
+        "--interval",
+        action="append",
+        metavar="NAME=MINUTES",
+        help="minutes between runs of a job (repeatable)",
+    )
+    daemon.add_argument(
+        "--recycle-after", type=int, help="relaunch the browser after this many pages"
+    )
+    daemon.add_argument(
+        "--full", action="store_true", help="crawl every page, not incrementally"
+    )
+    daemon.add_argument(
+        "--page-budget", type=int, help="max pages per paginated source in one run"
+    )
+    daemon.add_argument("--max-results", type=int, default=50, help="for gmail")
+    _add_imap_arguments(daemon)
+    daemon.set_defaults(handler=_daemon, parser=daemon)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    job = args.handler(args)
+    if args.startup_only:
+        return 0
+    try:
+        job()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""
+Long-running ingestion: every source refreshed on its own schedule, without
+the cold start of a new process (and a new Chromium, and a new OAuth login)
+per run.
+
+    python cli.py daemon                                  # scrapers and Gmail
+    python cli.py daemon --job imap --job "YMCA Boston" --interval imap=10
+
+Every job - one per scraped source, plus "gmail" and "imap" - runs about
+every SCHEDULES minutes, give or take JITTER, so the jobs drift apart instead
+of firing together and the sites don't see us at the same minute every day.
+A job's next run is only scheduled once its current run has finished, so a
+job never overlaps itself however long a run takes, and daemon.lock keeps a
+second daemon from starting.
+
+Kept warm between runs:
+
+    - one Chromium, with a browser context per source (HTTP cache, cookies),
+      launched again once it has opened RECYCLE_AFTER_PAGES pages, which
+      bounds the memory Chromium piles up
+    - the Gmail API client and its OAuth credentials (token.json is read
+      once, the access token is refreshed in memory)
+    - the logged-in IMAP connection
+    - the genai client and the event store
+
+A job that fails drops its client or connection, so its next run starts
+from fresh credentials. With EVENT_METRICS set (see metrics.py) the metrics
+file is rewritten after every run instead of only at exit.
+"""
+
+import asyncio
+import contextlib
+import imaplib
+import os
+import random
+import signal
+import time
+
+from playwright.async_api import async_playwright
+
+import imap
+from event_store import EVENT_STORE_PATH, EventStore
+from gmail_fetch import authorized_http_factory
+from metrics import METRICS_ENV, count, span, write_metrics
+from page_profile import CONTEXT_OPTIONS, LAUNCH_ARGS
+from quickstart import load_credentials, process_mailbox, publish_events
+from scrape_runner import (
+    DEFAULT_PAGE_BUDGET,
+    SOURCES,
+    host_limits_for,
+    scrape_source,
+    store_source,
+)
+from scrape_state import SCRAPE_STATE_PATH, load_scrape_state, save_scrape_state
+
+# Minutes between runs of each job
+SCHEDULES = {
+    "Mass Audubon": 6 * 60,
+    "National Audubon": 12 * 60,  # Slow: geocoding is held to 1 request/second
+    "YMCA Boston": 3 * 60,
+    "gmail": 30,
+    "imap": 30,
+}
+# IMAP usually reads the same mailbox as the Gmail API, so it's opt-in
+DEFAULT_JOBS = [source["name"] for source in SOURCES] + ["gmail"]
+JITTER = 0.1  # Runs are interval * uniform(1 - JITTER, 1 + JITTER) apart
+STARTUP_SPREAD = 60  # seconds over which the first runs are spread
+RECYCLE_AFTER_PAGES = 200
+GMAIL_MAX_RESULTS = 50
+DAEMON_LOCK_PATH = "daemon.lock"
+
+
+class BrowserPool:
+    """
+    A Chromium shared by the scrape jobs, with one long-lived context per
+    source. Pages opened in any of the contexts count towards recycle_after;
+    once it is reached, new leases wait until the running ones are done, then
+    the browser is closed and launched again.
+    """
+
+    def __init__(self, recycle_after=RECYCLE_AFTER_PAGES):
+        self.recycle_after = recycle_after
+        self.pages = 0  # Opened since the browser was launched
+        self._playwright = None
+        self._browser = None
+        self._contexts = {}  # source name -> context
+        self._leases = 0
+        self._changed = asyncio.Condition()
+
+    def _due(self):
+        return self._browser is not None and self.pages >= self.recycle_after
+
+    def _on_page(self, page):
+        self.pages += 1
+
+    async def _launch(self):
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(
+            headless=True, args=LAUNCH_ARGS
+        )
+        self.pages = 0
+        count("daemon.browser_launches")
+
+    async def _close_browser(self):
+        browser, self._browser = self._browser, None
+        self._contexts.clear()
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception as e:
+                print(f"[WARN] Closing the browser failed: {e}")
+
+    @contextlib.asynccontextmanager
+    async def context(self, source_name):
+        async with self._changed:
+            await self._changed.wait_for(lambda: not self._due() or not self._leases)
+            if self._due():
+                print(f"[DEBUG] Recycling the browser after {self.pages} pages.")
+                count("daemon.browser_recycles")
+                await self._close_browser()
+            elif self._browser is not None and not self._browser.is_connected():
+                print("[WARN] The browser is gone, launching it again.")
+                await self._close_browser()
+            if self._browser is None:
+                await self._launch()
+            context = self._contexts.get(source_name)
+            if context is None:
+                context = await self._browser.new_context(**CONTEXT_OPTIONS)
+                context.on("page", self._on_page)
+                self._contexts[source_name] = context
+            self._leases += 1
+        failed = True
+        try:
+            yield context
+            failed = False
+        finally:
+            async with self._changed:
+                self._leases -= 1
+                # A context in an unknown state isn't handed out again
+                if failed and self._contexts.get(source_name) is context:
+                    del self._contexts[source_name]
+                    with contextlib.suppress(Exception):
+                        await context.close()
+                self._changed.notify_all()
+
+    async def close(self):
+        await self._close_browser()
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+class GmailClient:
+    """
+    The Gmail API service, built on first use and kept between runs.
+    """
+
+    def __init__(self, max_results=GMAIL_MAX_RESULTS, store_path=EVENT_STORE_PATH):
+        self.max_results = max_results
+        self.store_path = store_path
+        self._service = None
+        self._http_factory = None
+
+    def sync(self):
+        if self._service is None:
+            from googleapiclient.discovery import build
+
+            creds = load_credentials()
+            self._service = build("gmail", "v1", credentials=creds)
+            self._http_factory = authorized_http_factory(creds)
+        try:
+            process_mailbox(
+                self._service,
+                max_results=self.max_results,
+                http_factory=self._http_factory,
+                store_path=self.store_path,
+            )
+        except Exception:
+            self._service = None
+            raise
+
+
+class ImapClient:
+    """
+    A logged-in IMAP connection kept between runs, and checked with a NOOP
+    before each one (servers drop idle connections after ~30 minutes).
+    """
+
+    def __init__(
+        self,
+        event_store,
+        credentials="credentials.yml",
+        user=None,
+        password="",
+        host=imap.IMAP_URL,
+        port=None,
+        ssl=True,
+        mailbox=imap.MAILBOX,
+        criteria=None,
+    ):
+        self.event_store = event_store
+        self.credentials = credentials
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.mailbox = mailbox
+        self.criteria = criteria
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.noop()
+            except (imaplib.IMAP4.error, OSError):
+                print("[WARN] IMAP connection lost, logging in again.")
+                self.close()
+        if self._conn is None:
+            if self.user:
+                user, password = self.user, self.password
+            else:
+                user, password = imap.load_credentials(self.credentials)
+            self._conn = imap.connect(user, password, self.host, self.port, self.ssl)
+        return self._conn
+
+    def sync(self):
+        conn = self._connection()
+        try:
+            results = imap.sync_mailbox(
+                conn,
+                imap.load_imap_state(),
+                self.event_store,
+                self.mailbox,
+                self.criteria,
+            )
+        except Exception:
+            self.close()
+            raise
+        if results:
+            publish_events(self.event_store)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            with contextlib.suppress(Exception):
+                conn.logout()
+
+
+class Job:
+    def __init__(self, name, run, interval, jitter=JITTER):
+        self.name = name
+        self.run = run  # Coroutine function
+        self.interval = interval  # seconds
+        self.jitter = jitter
+        self.runs = 0
+        self.failures = 0
+
+    def next_delay(self):
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class Daemon:
+    def __init__(
+        self,
+        job_names=None,
+        intervals=None,
+        recycle_after=RECYCLE_AFTER_PAGES,
+        incremental=True,
+        page_budget=DEFAULT_PAGE_BUDGET,
+        gmail_max_results=GMAIL_MAX_RESULTS,
+        imap_options=None,
+        store_path=EVENT_STORE_PATH,
+        scrape_state_path=SCRAPE_STATE_PATH,
+    ):
+        """
+        `intervals` overrides SCHEDULES ({job name: minutes}); `imap_options`
+        are ImapClient's keyword arguments.
+        """
+        self.incremental = incremental
+        self.page_budget = page_budget
+        self.scrape_state_path = scrape_state_path
+        # Loaded once and shared: each scrape job only touches its own source
+        self.scrape_state = load_scrape_state(scrape_state_path)
+        self.store = EventStore(store_path)
+        self.pool = BrowserPool(recycle_after)
+        self.gmail = GmailClient(gmail_max_results, store_path)
+        self.imap = ImapClient(self.store, **(imap_options or {}))
+
+        schedules = {**SCHEDULES, **(intervals or {})}
+        runs = {source["name"]: self._scrape_job(source) for source in SOURCES}
+        runs["gmail"] = lambda: asyncio.to_thread(self.gmail.sync)
+        runs["imap"] = lambda: asyncio.to_thread(self.imap.sync)
+        job_names = job_names or DEFAULT_JOBS
+        unknown = [name for name in job_names if name not in runs]
+        if unknown:
+            raise ValueError(
+                f"Unknown job(s) {', '.join(unknown)}; jobs are {', '.join(runs)}"
+            )
+        self.jobs = [Job(name, runs[name], schedules[name] * 60) for name in job_names]
+
+    def _scrape_job(self, source):
+        async def run():
+            async with self.pool.context(source["name"]) as context:
+                events, complete = await scrape_source(
+                    context,
+                    source,
+                    host_limits_for([source]),
+                    self.scrape_state,
+                    self.incremental,
+                    self.page_budget,
+                )
+            await asyncio.to_thread(self._store, source, events, complete)
+            save_scrape_state(self.scrape_state, self.scrape_state_path)
+
+        return run
+
+    def _store(self, source, events, complete):
+        stats = store_source(self.store, source, events, complete)
+        if stats["new"] or stats["changed"] or stats["removed"]:
+            self.store.publish()
+
+    async def _run(self, job):
+        started = time.monotonic()
+        print(f"[DEBUG] {job.name}: run {job.runs + 1} started.")
+        try:
+            with span("daemon.job", job=job.name):
+                await job.run()
+        except Exception as e:
+            job.failures += 1
+            count("daemon.job_failures", job=job.name)
+            print(f"[ERROR] {job.name} failed: {e}")
+        job.runs += 1
+        print(
+            f"[DEBUG] {job.name}: run {job.runs} finished in "
+            f"{time.monotonic() - started:.1f}s ({job.failures} failed so far)."
+        )
+        if os.environ.get(METRICS_ENV):
+            write_metrics(os.environ[METRICS_ENV])
+
+    async def _schedule(self, job, first_delay):
+        await asyncio.sleep(first_delay)
+        while True:
+            await self._run(job)
+            delay = job.next_delay()
+            print(f"[DEBUG] {job.name}: next run in {delay / 60:.0f} min.")
+            await asyncio.sleep(delay)
+
+    async def run(self):
+        """
+        Runs the jobs until cancelled (Ctrl+C or SIGTERM).
+        """
+        print(
+            f"[DEBUG] Daemon started with jobs: {', '.join(j.name for j in self.jobs)}"
+        )
+        tasks = [
+            asyncio.create_task(self._schedule(job, random.uniform(0, STARTUP_SPREAD)))
+            for job in self.jobs
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.pool.close()
+            self.imap.close()
+            self.store.close()
+
+
+def _lock_daemon(path=DAEMON_LOCK_PATH):
+    """
+    Holds an exclusive lock on `path` for as long as the returned file is
+    open, or exits if another daemon holds it.
+    """
+    import fcntl
+
+    lock_file = open(path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise SystemExit(f"[ERROR] Another daemon is running ({path} is locked).")
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+def run_daemon(lock_path=DAEMON_LOCK_PATH, **options):
+    """
+    Daemon(**options).run() until Ctrl+C or SIGTERM.
+    """
+    lock_file = _lock_daemon(lock_path)
+
+    async def main():
+        task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        await Daemon(**options).run()
+
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("[DEBUG] Daemon stopped.")
+    finally:
+        lock_file.close()
@@ -0,0 +1,276 @@
+"""
+Merges the same program reported by several sources (Mass Audubon, National
+Audubon, YMCA, newsletters) into one event.
+
+Comparing every event with every other one is O(N^2), so events are first
+grouped into blocks by (day, geohash cell) and only compared inside a block.
+Inside a block, titles are compared by MinHash signatures over character
+shingles, with locality-sensitive hashing picking the candidate pairs. Events
+whose canonical URLs are equal are merged regardless of block. Matches are
+joined with union-find, and every merged event lists where it came from in
+"sources".
+"""
+
+import re
+import zlib
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+from normalize import to_minutes
+
+GEOHASH_PRECISION = 4  # Cells of ~39 x 20 km
+SHINGLE_SIZE = 3
+NUM_HASHES = 32
+LSH_BANDS = 8  # 8 bands of 4 rows: pairs above ~0.6 similarity almost always meet
+TITLE_SIMILARITY = 0.6  # Estimated Jaccard of title shingles to call it a match
+MAX_START_DIFFERENCE = 60  # Minutes; "same day, 10am vs 2pm" are two events
+
+_TRACKING_PARAMS = re.compile(r"^(utm_.*|fbclid|gclid|mc_cid|mc_eid)$")
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+_PRIME = np.uint64((1 << 31) - 1)  # a * x stays below 2^62, no uint64 overflow
+_rng = np.random.default_rng(20250721)
+_HASH_A = _rng.integers(1, _PRIME, NUM_HASHES, dtype=np.uint64)
+_HASH_B = _rng.integers(0, _PRIME, NUM_HASHES, dtype=np.uint64)
+
+
+def canonical_url(url):
+    """
+    Lowercased scheme/host without "www.", no fragment, no tracking params,
+    no trailing slash: the same page linked from different places compares equal.
+    """
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = [
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not _TRACKING_PARAMS.match(k.lower())
+    ]
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
+
+
+def geohash(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits = bit_count = 0
+    return "".join(chars)
+
+
+def _normalize_title(title):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (title or "").lower()).split())
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    text = f" {text} "
+    return {text[i : i + size] for i in range(max(1, len(text) - size + 1))}
+
+
+def minhash(shingle_set):
+    """
+    NUM_HASHES minimums of (a * x + b) mod p over the shingles' CRC32s.
+    """
+    x = np.array([zlib.crc32(s.encode("utf-8")) for s in shingle_set], dtype=np.uint64)
+    x = (x % _PRIME)[:, None]
+    return ((_HASH_A[None, :] * x + _HASH_B[None, :]) % _PRIME).min(axis=0)
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self._members = {i: [i] for i in range(n)}  # root -> its group
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def members(self, i):
+        return self._members[self.find(i)]
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            root, child = min(i, j), max(i, j)
+            self.parent[child] = root
+            self._members[root].extend(self._members.pop(child))
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _block_key(event):
+    lat, lon = _float(event.get("latitude")), _float(event.get("longitude"))
+    cell = geohash(lat, lon) if lat is not None and lon is not None else None
+    day = (event.get("start") or "")[:10] or None
+    if cell is None and day is None:
+        return None  # Nothing to block on; only the URL can match it
+    return day, cell
+
+
+def _is_all_day(event):
+    return (event.get("start") or "").endswith("T00:00") and (
+        event.get("end") or ""
+    ).endswith("T23:59")
+
+
+def _times_compatible(a, b):
+    if not a.get("start") or not b.get("start") or _is_all_day(a) or _is_all_day(b):
+        return True
+    return abs(to_minutes(a["start"]) - to_minutes(b["start"])) <= MAX_START_DIFFERENCE
+
+
+def _has_time(event):
+    return bool(event.get("start")) and not _is_all_day(event)
+
+
+def _fuzzy_compatible(a, b):
+    """
+    Whether two events may end up in one group through a title match. Rows
+    of one source are separate sessions ("Swim Lessons Level 1" at 9 and at
+    11), and an undated or all-day event is only a match for an identical
+    title, since its time can't tell sessions apart.
+    """
+    if a.get("source") == b.get("source"):
+        return False
+    if not _has_time(a) or not _has_time(b):
+        return _normalize_title(a.get("title")) == _normalize_title(b.get("title"))
+    return _times_compatible(a, b)
+
+
+def _match_block(members, events, signatures, uf):
+    """
+    LSH inside one block: events sharing any band of their signature are
+    candidates, confirmed by the estimated similarity. Two groups are only
+    joined if every pair across them is _fuzzy_compatible(), so matches
+    can't chain across sources' sessions or through the day.
+    """
+    rows = NUM_HASHES // LSH_BANDS
+    candidates = set()
+    for band in range(LSH_BANDS):
+        buckets = defaultdict(list)
+        for i in members:
+            buckets[signatures[i][band * rows : (band + 1) * rows].tobytes()].append(i)
+        for bucket in buckets.values():
+            for x in range(len(bucket)):
+                for y in range(x + 1, len(bucket)):
+                    candidates.add((bucket[x], bucket[y]))
+    scored = []
+    for i, j in candidates:
+        similarity = float(np.mean(signatures[i] == signatures[j]))
+        if similarity >= TITLE_SIMILARITY:
+            scored.append((-similarity, i, j))
+    for _, i, j in sorted(scored):  # Best matches first
+        group_i, group_j = uf.members(i), uf.members(j)
+        if group_i is group_j:
+            continue
+        if all(
+            _fuzzy_compatible(events[a], events[b]) for a in group_i for b in group_j
+        ):
+            uf.union(i, j)
+
+
+def _merge(group, events):
+    """
+    The most complete member is kept; missing fields are filled in from the
+    others, and every member is listed in "sources".
+    """
+    ranked = sorted(
+        group,
+        key=lambda i: (
+            _float(events[i].get("latitude")) is None,
+            not events[i].get("start"),
+            i,
+        ),
+    )
+    merged = {k: v for k, v in events[ranked[0]].items() if k != "source"}
+    for i in ranked[1:]:
+        for field, value in events[i].items():
+            if field != "source" and merged.get(field) in (None, "") and value:
+                merged[field] = value
+    merged["sources"] = [
+        {
+            "source": events[i].get("source"),
+            "title": events[i].get("title"),
+            "url": events[i].get("url"),
+        }
+        for i in sorted(group)
+    ]
+    return merged
+
+
+def dedupe_events(events):
+    """
+    `events` carry a "source" field. Returns the merged events (in the order
+    of their first member), each with a "sources" list instead.
+    """
+    uf = _UnionFind(len(events))
+
+    # 1. Same canonical URL. A URL shared by several events of one source is a
+    # listing/registration page (every YMCA row), not an identity.
+    by_source_url = defaultdict(list)
+    for i, event in enumerate(events):
+        url = canonical_url(event.get("url"))
+        if url:
+            by_source_url[(event.get("source"), url)].append(i)
+    first_by_url = {}
+    for (source, url), members in by_source_url.items():
+        if len(members) != 1:
+            continue
+        i = members[0]
+        if url in first_by_url:
+            if _times_compatible(events[first_by_url[url]], events[i]):
+                uf.union(first_by_url[url], i)
+        else:
+            first_by_url[url] = i
+
+    # 2. Similar titles in the same (day, geohash cell) block
+    blocks = defaultdict(list)
+    for i, event in enumerate(events):
+        key = _block_key(event)
+        if key is not None:
+            blocks[key].append(i)
+    signatures = {}
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        for i in members:
+            signatures[i] = minhash(shingles(_normalize_title(events[i].get("title"))))
+        _match_block(members, events, signatures, uf)
+
+    groups = defaultdict(list)
+    for i in range(len(events)):
+        groups[uf.find(i)].append(i)
+    merged = [_merge(groups[root], events) for root in sorted(groups)]
+    print(
+        f"[DEBUG] Dedup: {len(events)} records -> {len(merged)} events "
+        f"({len(events) - len(merged)} duplicates merged, {len(blocks)} blocks)"
+    )
+    return merged
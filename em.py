@@ -8,6 +8,13 @@ import base64
 import email
 from bs4 import BeautifulSoup
 
+from gmail_fetch import (
+    FULL_FIELDS,
+    authorized_http_factory,
+    batch_get_messages,
+    list_message_ids,
+)
+
 # Define the SCOPES. If modifying it, delete the token.pickle file.
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
@@ -39,19 +46,26 @@ def getEmails():
     # Connect to the Gmail API
     service = build("gmail", "v1", credentials=creds)
 
-    # request a list of all the messages
-    result = service.users().messages().list(userId="me").execute()
+    # request a list of all the messages (follows nextPageToken through the whole mailbox)
+    message_ids = list_message_ids(service)
 
-    # We can also pass maxResults to get any number of emails. Like this:
-    # result = service.users().messages().list(maxResults=200, userId='me').execute()
-    messages = result.get("messages")
+    # We can also pass max_results to get any number of emails. Like this:
+    # message_ids = list_message_ids(service, max_results=200)
 
-    # messages is a list of dictionaries where each dictionary contains a message id.
+    # Fetch the messages in batches of up to 100 instead of one request per message
+    messages = batch_get_messages(
+        service,
+        message_ids,
+        fmt="full",
+        fields=FULL_FIELDS,
+        http_factory=authorized_http_factory(creds),
+    )
 
     # iterate through all the messages
-    for msg in messages:
-        # Get the message from its id
-        txt = service.users().messages().get(userId="me", id=msg["id"]).execute()
+    for msg_id in message_ids:
+        txt = messages.get(msg_id)
+        if txt is None:
+            continue
 
         # Use try-except to avoid any Errors
         try:
@@ -87,4 +101,5 @@ def getEmails():
             pass
 
 
-getEmails()
+if __name__ == "__main__":
+    getEmails()
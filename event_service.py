@@ -0,0 +1,579 @@
+"""
+Search API over the scraped events.
+
+Loads the events (the memory-mapped events.snapshot written by event_store.py,
+or audubon_events.json when there is no snapshot) into a grid spatial index (NumPy arrays sorted by
+lat/lon cell) so a radius search only looks at the cells overlapping the
+search's bounding box, then runs an exact, vectorized haversine on those
+candidates. Only the requested page of results is sent back.
+
+Date and age filters use the start/end/age_min/age_max fields written by
+normalize.py: events are kept sorted by start time and by minimum age, so a
+date window or a child's age is a searchsorted range instead of a scan.
+Keywords (`q`) go through the BM25 index in text_index.py, which is kept in
+sync across reloads instead of being rebuilt.
+
+    python event_service.py                 # serve on http://localhost:8000
+    python event_service.py --bench 100000  # time queries on random events
+
+Endpoints (the static pages in this folder are served too):
+
+    GET /api/events?lat=42.36&lon=-71.06&radius=25&sort=distance&page=1&page_size=20
+    GET /api/events?date_from=2025-07-21&date_to=2025-07-27&age=5   # location optional
+    GET /api/events?q=bird walk&lat=42.36&lon=-71.06&radius=25     # sort=relevance
+    GET /api/geocode?q=Concord, MA    # town or ZIP -> lat/lon (see geocoding.py)
+    GET /metrics                      # Prometheus text, with EVENT_METRICS set (metrics.py)
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import metrics
+from geocoding import geocode_query
+from event_store import (
+    EVENTS_JSON_PATH,
+    NO_AGE,
+    NO_TIME,
+    SNAPSHOT_PATH,
+    EventSnapshot,
+    event_columns,
+    load_events,
+)
+from normalize import MAX_AGE, normalize_event, to_minutes
+from text_index import TextIndex, document_id
+
+EARTH_RADIUS_MILES = 3959  # Same as the haversine in search_page.html
+MILES_PER_DEGREE_LAT = 69.0
+CELL_DEGREES = 0.5  # Grid cell size; a cell is ~35 miles tall
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def _to_float(value):
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return None
+    return result if math.isfinite(result) else None
+
+
+class EventIndex:
+    def __init__(self, events, cell_degrees=CELL_DEGREES):
+        """
+        `events` is a list of event dicts (a JSON export) or an EventSnapshot,
+        whose memory-mapped columns are used as they are.
+        """
+        self.cell_degrees = cell_degrees
+        self.n_cols = int(math.ceil(360 / cell_degrees))
+        self.stored_doc_ids = None
+        if isinstance(events, EventSnapshot):
+            columns = events.columns()
+            self._event = events.event
+            self.stored_doc_ids = events.doc_ids()
+        else:
+            for event in events:
+                if "start" not in event:  # Written before normalize.py existed
+                    normalize_event(event)
+            columns = event_columns(events)
+            self._event = lambda position: dict(events[position])
+        self.n_events = len(events)
+
+        lat = columns["latitude"]
+        lon = columns["longitude"]
+        positions = np.flatnonzero(
+            np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90)
+        )
+        lat = np.asarray(lat[positions], dtype=np.float64)
+        lon = np.asarray(lon[positions], dtype=np.float64)
+        keys = self._cell_row(lat) * self.n_cols + self._cell_col(lon)
+
+        # Everything is stored sorted by cell key, so a cell (and a run of
+        # neighbouring cells in the same row) is one contiguous slice.
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.positions = positions[order]  # original index = export order
+        self.lat = lat[order]
+        self.lon = lon[order]
+        self.lat_rad = np.radians(self.lat)
+        self.lon_rad = np.radians(self.lon)
+        self._build_attribute_indexes(columns)
+        self.text_index = None
+        self.doc_ids = []
+        self.doc_positions = {}
+
+    def attach_text_index(self, text_index, doc_ids):
+        """
+        Uses `text_index` (already synced with these events) for keyword
+        queries. doc_ids[i] is the document id of event i.
+        """
+        self.text_index = text_index
+        self.doc_ids = doc_ids
+        self.doc_positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+
+    def event(self, position):
+        return self._event(position)
+
+    __getitem__ = event
+
+    def _build_attribute_indexes(self, columns):
+        """
+        Per-event start/end/age arrays (by original index) plus orderings by
+        start time and by minimum age for the range filters.
+        """
+        start = np.asarray(columns["start"])
+        end = np.asarray(columns["end"])
+        # Unknown ages ("Varies") match every age rather than none
+        unknown_age = np.asarray(columns["age_min"]) == NO_AGE
+        age_min = np.where(unknown_age, 0, columns["age_min"]).astype(np.int16)
+        age_max = np.where(unknown_age, MAX_AGE, columns["age_max"]).astype(np.int16)
+
+        self.start = start
+        self.end = end
+        self.by_start = np.argsort(start, kind="stable")
+        self.start_sorted = start[self.by_start]
+        known = start != NO_TIME
+        self.max_duration = int((end[known] - start[known]).max()) if known.any() else 0
+        # Position of each event in date order, for sort="date"
+        self.date_rank = np.empty(self.n_events, dtype=np.int64)
+        self.date_rank[self.by_start] = np.arange(self.n_events)
+
+        self.age_max = age_max
+        self.by_age_min = np.argsort(age_min, kind="stable")
+        self.age_min_sorted = age_min[self.by_age_min]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cell_row(self, lat):
+        return np.floor((np.asarray(lat) + 90) / self.cell_degrees).astype(np.int64)
+
+    def _cell_col(self, lon):
+        col = np.floor((np.asarray(lon) + 180) / self.cell_degrees).astype(np.int64)
+        return np.mod(col, self.n_cols)
+
+    def _candidates(self, lat, lon, radius):
+        """
+        Indices (into the sorted arrays) of events in cells overlapping the
+        bounding box of the search circle.
+        """
+        d_lat = radius / MILES_PER_DEGREE_LAT
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + d_lat, 89.9))), 1e-6)
+        d_lon = radius / (MILES_PER_DEGREE_LAT * cos_lat)
+
+        row_lo = int(self._cell_row(max(lat - d_lat, -90)))
+        row_hi = int(self._cell_row(min(lat + d_lat, 89.999999)))
+        if d_lon >= 180:
+            col_ranges = [(0, self.n_cols - 1)]
+        else:
+            col_lo = int(self._cell_col(lon - d_lon))
+            col_hi = int(self._cell_col(lon + d_lon))
+            if col_lo <= col_hi:
+                col_ranges = [(col_lo, col_hi)]
+            else:  # Box crosses the antimeridian
+                col_ranges = [(col_lo, self.n_cols - 1), (0, col_hi)]
+
+        starts = []
+        ends = []
+        for row in range(row_lo, row_hi + 1):
+            for col_lo, col_hi in col_ranges:
+                starts.append(row * self.n_cols + col_lo)
+                ends.append(row * self.n_cols + col_hi)
+        lo = np.searchsorted(self.keys, starts, side="left")
+        hi = np.searchsorted(self.keys, ends, side="right")
+        slices = [np.arange(a, b) for a, b in zip(lo, hi) if b > a]
+        if not slices:
+            return np.empty(0, dtype=np.int64), d_lat, d_lon
+        return np.concatenate(slices), d_lat, d_lon
+
+    def _within(self, lat, lon, radius):
+        """
+        Original indices of the events within `radius` miles, and their distances.
+        """
+        idx, d_lat, d_lon = self._candidates(lat, lon, radius)
+
+        # Cheap bounding-box filter before the exact distance
+        if len(idx) and d_lon < 180:
+            d = np.abs(self.lon[idx] - lon)
+            d = np.minimum(d, 360 - d)
+            idx = idx[(np.abs(self.lat[idx] - lat) <= d_lat) & (d <= d_lon)]
+
+        lat1 = math.radians(lat)
+        lat2 = self.lat_rad[idx]
+        a = (
+            np.sin((lat2 - lat1) / 2) ** 2
+            + math.cos(lat1)
+            * np.cos(lat2)
+            * np.sin((self.lon_rad[idx] - math.radians(lon)) / 2) ** 2
+        )
+        distance = EARTH_RADIUS_MILES * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        inside = distance <= radius
+        return self.positions[idx[inside]], distance[inside]
+
+    def _in_date_window(self, date_from, date_to):
+        """
+        Original indices of events overlapping [date_from, date_to] (minutes).
+        Events are sorted by start, and none lasts longer than max_duration, so
+        only starts in [date_from - max_duration, date_to] can overlap.
+        """
+        lo_key = -NO_TIME if date_from is None else date_from - self.max_duration
+        hi_key = NO_TIME - 1 if date_to is None else date_to
+        lo = np.searchsorted(self.start_sorted, lo_key, side="left")
+        hi = np.searchsorted(self.start_sorted, hi_key, side="right")
+        selected = self.by_start[lo:hi]
+        if date_from is not None:
+            selected = selected[self.end[selected] >= date_from]
+        return selected
+
+    def _for_age(self, age):
+        hi = np.searchsorted(self.age_min_sorted, age, side="right")
+        selected = self.by_age_min[:hi]
+        return selected[self.age_max[selected] >= age]
+
+    def _text_scores(self, q, positions=None):
+        """
+        BM25 score of every event (0 = no match) for keyword query `q`, only
+        looking at `positions` if given.
+        """
+        scores = np.zeros(self.n_events)
+        doc_ids = None
+        if positions is not None:
+            doc_ids = [self.doc_ids[i] for i in positions]
+        matches = self.text_index.search(q, doc_ids=doc_ids) if self.text_index else {}
+        for doc_id, score in matches.items():
+            position = self.doc_positions.get(doc_id)
+            if position is not None:
+                scores[position] = score
+        return scores
+
+    def _filter_mask(self, date_from, date_to, age, text_scores=None):
+        """
+        Boolean mask over original indices, or None when nothing is filtered.
+        """
+        mask = None if text_scores is None else text_scores > 0
+        selections = []
+        if date_from is not None or date_to is not None:
+            selections.append(self._in_date_window(date_from, date_to))
+        if age is not None:
+            selections.append(self._for_age(age))
+        for selected in selections:
+            allowed = np.zeros(self.n_events, dtype=bool)
+            allowed[selected] = True
+            mask = allowed if mask is None else mask & allowed
+        return mask
+
+    def search(
+        self,
+        lat=None,
+        lon=None,
+        radius=None,
+        sort="date",
+        page=1,
+        page_size=DEFAULT_PAGE_SIZE,
+        date_from=None,
+        date_to=None,
+        age=None,
+        q=None,
+    ):
+        """
+        Events within `radius` miles of (lat, lon) (or anywhere, without a
+        location), starting in the date window, open to `age` and matching
+        the keywords `q`. Sorted by "date" (start time, soonest first),
+        "distance" or "relevance" (with q). Returns one page.
+        date_from/date_to are minutes since 1970 (see normalize.to_minutes).
+        """
+        text_scores = None
+        if lat is not None:
+            positions, distance = self._within(lat, lon, radius)
+            if q:
+                text_scores = self._text_scores(q, positions)
+            mask = self._filter_mask(date_from, date_to, age, text_scores)
+            if mask is not None:
+                keep = mask[positions]
+                positions, distance = positions[keep], distance[keep]
+        else:
+            text_scores = self._text_scores(q) if q else None
+            mask = self._filter_mask(date_from, date_to, age, text_scores)
+            positions = (
+                np.flatnonzero(mask) if mask is not None else np.arange(self.n_events)
+            )
+            distance = None
+
+        if sort == "distance" and distance is not None:
+            order = np.argsort(distance, kind="stable")
+        elif sort == "relevance" and text_scores is not None:
+            order = np.argsort(-text_scores[positions], kind="stable")
+        else:
+            order = np.argsort(self.date_rank[positions], kind="stable")
+
+        total = len(order)
+        start = (page - 1) * page_size
+        results = []
+        for i in order[start : start + page_size]:
+            event = self._event(int(positions[i]))
+            if distance is not None:
+                event["distance"] = round(float(distance[i]), 2)
+            if text_scores is not None:
+                event["score"] = round(float(text_scores[positions[i]]), 3)
+            results.append(event)
+        return {
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "results": results,
+        }
+
+
+class _IndexHolder:
+    """
+    Keeps the index for the events file and rebuilds it when the file changes
+    (both the snapshot and the JSON export are replaced atomically).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._index = None
+        self._text_index = TextIndex()  # Outlives reloads; see _sync_text
+        self._lock = threading.Lock()
+
+    def _sync_text(self, index):
+        """
+        Brings the keyword index up to date with the reloaded events. The
+        snapshot stores every event's document id, so only new or changed
+        events are decoded and tokenized; a JSON export is parsed in full
+        anyway and gets its ids computed.
+        """
+        doc_ids = index.stored_doc_ids
+        if doc_ids is None:
+            doc_ids = [document_id(index.event(i)) for i in range(index.n_events)]
+        added, removed = self._text_index.sync(doc_ids, index)
+        index.attach_text_index(self._text_index, doc_ids)
+        return added, removed
+
+    def get(self):
+        mtime = os.stat(self.path).st_mtime
+        with self._lock:
+            if self._index is None or mtime != self._mtime:
+                started = time.perf_counter()
+                events = load_events(self.path)
+                index = EventIndex(events)
+                added, removed = self._sync_text(index)
+                self._index = index
+                self._mtime = mtime
+                print(
+                    f"[DEBUG] Indexed {len(self._index)} events in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms "
+                    f"(keywords: {added} added, {removed} removed)"
+                )
+            return self._index
+
+
+class EventRequestHandler(SimpleHTTPRequestHandler):
+    index_holder = None  # Set by serve()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/events":
+            with metrics.span("api.events"):
+                return self._handle_events(parse_qs(url.query))
+        if url.path == "/api/geocode":
+            with metrics.span("api.geocode"):
+                return self._handle_geocode(parse_qs(url.query))
+        if url.path == "/metrics" and metrics.enabled():
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            return self.wfile.write(body)
+        return super().do_GET()
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_events(self, params):
+        def param(name, default=None):
+            return params.get(name, [default])[0]
+
+        lat = _to_float(param("lat"))
+        lon = _to_float(param("lon"))
+        radius = _to_float(param("radius"))
+        location = [param("lat"), param("lon"), param("radius")]
+        if any(location) and (
+            lat is None or lon is None or radius is None or radius < 0
+        ):
+            return self._send_json(
+                400, {"error": "lat, lon and radius must be given together"}
+            )
+        try:
+            page = max(1, int(param("page", 1)))
+            page_size = min(
+                MAX_PAGE_SIZE, max(1, int(param("page_size", DEFAULT_PAGE_SIZE)))
+            )
+            age = int(param("age")) if param("age") else None
+        except ValueError:
+            return self._send_json(
+                400, {"error": "page, page_size and age must be integers"}
+            )
+        try:
+            date_from = to_minutes(param("date_from")) if param("date_from") else None
+            # date_to is inclusive: the whole day counts
+            date_to = (
+                to_minutes(param("date_to")) + 24 * 60 - 1 if param("date_to") else None
+            )
+        except ValueError:
+            return self._send_json(
+                400, {"error": "date_from and date_to must be YYYY-MM-DD"}
+            )
+
+        q = (param("q") or "").strip() or None
+        started = time.perf_counter()
+        result = self.index_holder.get().search(
+            lat,
+            lon,
+            radius,
+            param("sort", "relevance" if q else "date"),
+            page,
+            page_size,
+            date_from,
+            date_to,
+            age,
+            q,
+        )
+        result["took_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return self._send_json(200, result)
+
+    def _handle_geocode(self, params):
+        query = params.get("q", [""])[0].strip()
+        if not query:
+            return self._send_json(400, {"error": "q is required"})
+        started = time.perf_counter()
+        place = geocode_query(query)
+        took_ms = round((time.perf_counter() - started) * 1000, 3)
+        if place is None:
+            return self._send_json(
+                404, {"error": f"Location not found: {query}", "took_ms": took_ms}
+            )
+        return self._send_json(200, {**place, "took_ms": took_ms})
+
+
+def default_events_path():
+    return SNAPSHOT_PATH if os.path.exists(SNAPSHOT_PATH) else EVENTS_JSON_PATH
+
+
+def serve(port=8000, events_path=None):
+    events_path = events_path or default_events_path()
+    EventRequestHandler.index_holder = _IndexHolder(events_path)
+    server = ThreadingHTTPServer(("", port), EventRequestHandler)
+    print(f"[DEBUG] Serving events on http://localhost:{port}/search_page.html")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _benchmark(n_events, n_queries=1000, radius=25):
+    rng = np.random.default_rng(0)
+    # Roughly the continental US, over the next 90 days
+    lats = rng.uniform(25, 49, n_events)
+    lons = rng.uniform(-124, -67, n_events)
+    starts = rng.integers(0, 90 * 24 * 60, n_events)
+    ages = rng.integers(0, 14, n_events)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = ["".join(rng.choice(letters, rng.integers(4, 10))) for _ in range(2000)]
+    title_words = rng.zipf(1.3, (n_events, 4)) % len(words)
+    first_day = datetime(2025, 7, 1)
+    events = []
+    for i in range(n_events):
+        start = first_day + timedelta(minutes=int(starts[i]))
+        events.append(
+            {
+                "title": " ".join(words[w] for w in title_words[i]),
+                "latitude": str(lats[i]),
+                "longitude": str(lons[i]),
+                "start": start.strftime("%Y-%m-%dT%H:%M"),
+                "end": (start + timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M"),
+                "age_min": int(ages[i]),
+                "age_max": int(ages[i]) + 4,
+            }
+        )
+    started = time.perf_counter()
+    index = EventIndex(events)
+    build_ms = (time.perf_counter() - started) * 1000
+    text_index = TextIndex()
+    doc_ids = [document_id(event) for event in events]
+    started = time.perf_counter()
+    text_index.sync(doc_ids, events)
+    text_ms = (time.perf_counter() - started) * 1000
+    index.attach_text_index(text_index, doc_ids)
+
+    def percentiles(timings):
+        timings.sort()
+        return (
+            f"p50 {timings[len(timings) // 2]:.3f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99)]:.3f} ms"
+        )
+
+    radius_timings = []
+    filter_timings = []
+    text_timings = []
+    week = 7 * 24 * 60
+    epoch_start = to_minutes(first_day.isoformat())
+    for la, lo in zip(
+        rng.uniform(25, 49, n_queries), rng.uniform(-124, -67, n_queries)
+    ):
+        started = time.perf_counter()
+        index.search(la, lo, radius, sort="distance")
+        radius_timings.append((time.perf_counter() - started) * 1000)
+
+        date_from = epoch_start + int(rng.integers(0, 83 * 24 * 60))
+        started = time.perf_counter()
+        index.search(date_from=date_from, date_to=date_from + week, age=6)
+        filter_timings.append((time.perf_counter() - started) * 1000)
+
+        # Typing the start of a word near the user: prefix match + radius
+        word = words[int(rng.zipf(1.3)) % len(words)]
+        started = time.perf_counter()
+        index.search(la, lo, radius, sort="relevance", q=word[:3])
+        text_timings.append((time.perf_counter() - started) * 1000)
+    print(
+        f"[BENCH] {n_events} events, index built in {build_ms:.0f} ms "
+        f"(+{text_ms:.0f} ms keywords); "
+        f"{radius}-mile search: {percentiles(radius_timings)}; "
+        f"one-week + age filter: {percentiles(filter_timings)}; "
+        f"keyword prefix + radius: {percentiles(text_timings)}"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Event search API.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--events", help="events.snapshot or a JSON export (default: snapshot if built)"
+    )
+    parser.add_argument(
+        "--bench", type=int, metavar="N", help="benchmark with N events"
+    )
+    args = parser.parse_args()
+
+    if args.bench:
+        _benchmark(args.bench)
+    else:
+        serve(args.port, args.events)
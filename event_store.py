@@ -0,0 +1,347 @@
+"""
+Every event from every source (scrapers, Gmail newsletters) in one SQLite
+table, upserted by a canonical key instead of rewriting a JSON file each run.
+
+    events.sqlite3       the store; each batch is written in one transaction,
+                         and only new or changed rows are touched
+    events.snapshot      packed columnar copy for readers: numeric columns, the
+                         keyword index's document ids, plus one UTF-8 blob per
+                         text field, memory-mapped by EventSnapshot (the
+                         search API) instead of parsed
+    audubon_events.json  still exported for the static search page
+
+Both exports are deduplicated across sources (see dedup.py); the store keeps
+every source's own record.
+
+The canonical key is "<source>|<source's event key>", e.g.
+"YMCA Boston|<url>#<title>#<date>" (see SOURCES in scrape_runner.py).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from dedup import dedupe_events
+from normalize import from_minutes, normalize_events, to_minutes
+from text_index import document_id
+
+EVENT_STORE_PATH = "events.sqlite3"
+SNAPSHOT_PATH = "events.snapshot"
+EVENTS_JSON_PATH = "audubon_events.json"
+
+NO_TIME = np.iinfo(np.int64).max  # start/end of events without a date
+NO_AGE = -1
+# Text fields packed into the snapshot, in the order events are exported
+TEXT_FIELDS = (
+    "title",
+    "date",
+    "ages",
+    "location",
+    "latitude",
+    "longitude",
+    "url",
+    "description",
+)
+# Packed as JSON text
+JSON_FIELDS = ("sources",)
+
+_MAGIC = b"EVS1"
+_ALIGN = 8
+
+
+def canonical_key(source_name, key):
+    return f"{source_name}|{key}"
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_publish_lock = threading.Lock()
+
+
+class EventStore:
+    def __init__(self, path=EVENT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                " key TEXT PRIMARY KEY,"
+                " source TEXT NOT NULL,"
+                " event TEXT NOT NULL,"
+                " start TEXT,"
+                " age_min INTEGER,"
+                " age_max INTEGER,"
+                " latitude REAL,"
+                " longitude REAL,"
+                " first_seen REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            for column in ("source", "start", "latitude"):
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS events_{column} ON events ({column})"
+                )
+            self._conn.commit()
+        return self._conn
+
+    def upsert(self, source_name, events, event_key, remove_missing=False):
+        """
+        Inserts new events and rewrites changed ones; unchanged rows aren't
+        touched. With remove_missing, the source's stored events that aren't
+        in `events` are deleted (the list is the source's complete set).
+        Returns {"new", "changed", "unchanged", "removed"} counts.
+        """
+        # Events carried over from earlier runs keep the dates they were
+        # normalized with; only new or re-scraped ones are parsed
+        normalize_events([event for event in events if "start" not in event])
+        now = time.time()
+        rows = {}
+        for event in events:
+            key = canonical_key(source_name, event_key(event))
+            rows[key] = (
+                key,
+                source_name,
+                json.dumps(event, ensure_ascii=False),
+                event.get("start"),
+                event.get("age_min"),
+                event.get("age_max"),
+                _to_float(event.get("latitude")),
+                _to_float(event.get("longitude")),
+                now,
+                now,
+            )
+
+        stats = {"new": 0, "changed": 0, "unchanged": 0, "removed": 0}
+        with self._lock:
+            conn = self._connect()
+            stored = dict(
+                conn.execute(
+                    "SELECT key, event FROM events WHERE source = ?", (source_name,)
+                )
+            )
+            writes = []
+            for key, row in rows.items():
+                if key not in stored:
+                    stats["new"] += 1
+                elif stored[key] != row[2]:
+                    stats["changed"] += 1
+                else:
+                    stats["unchanged"] += 1
+                    continue
+                writes.append(row)
+            removed = [(key,) for key in stored if key not in rows]
+
+            with conn:  # One transaction: all of it is written or none of it
+                conn.executemany(
+                    "INSERT INTO events (key, source, event, start, age_min,"
+                    " age_max, latitude, longitude, first_seen, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET"
+                    " event = excluded.event, start = excluded.start,"
+                    " age_min = excluded.age_min, age_max = excluded.age_max,"
+                    " latitude = excluded.latitude, longitude = excluded.longitude,"
+                    " updated_at = excluded.updated_at",
+                    writes,
+                )
+                if remove_missing and removed:
+                    conn.executemany("DELETE FROM events WHERE key = ?", removed)
+                    stats["removed"] = len(removed)
+        return stats
+
+    def events(self):
+        """
+        All stored events, soonest first (undated ones last, in insert order),
+        each with a "source" field.
+        """
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT source, event FROM events"
+                    " ORDER BY start IS NULL, start, rowid"
+                )
+                .fetchall()
+            )
+        return [{**json.loads(event), "source": source} for source, event in rows]
+
+    def sources(self):
+        with self._lock:
+            rows = self._connect().execute("SELECT DISTINCT source FROM events")
+            return {source for (source,) in rows}
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._connect().execute("SELECT COUNT(*) FROM events").fetchone()
+        return count
+
+    def publish(self, json_path=EVENTS_JSON_PATH, snapshot_path=SNAPSHOT_PATH):
+        """
+        Writes the deduplicated JSON export and columnar snapshot. Returns the
+        exported events.
+        """
+        # Jobs of the daemon (daemon.py) publish from several threads, each
+        # with its own store; they would share the .tmp files
+        with _publish_lock:
+            events = dedupe_events(self.events())
+            tmp_path = json_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(events, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, json_path)
+            write_snapshot(events, snapshot_path)
+        return events
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def event_columns(events):
+    """
+    The numeric columns the search index needs, one entry per event:
+    latitude/longitude (NaN if unknown), start/end in minutes (NO_TIME),
+    age_min/age_max (NO_AGE).
+    """
+    n = len(events)
+    columns = {
+        "latitude": np.full(n, np.nan),
+        "longitude": np.full(n, np.nan),
+        "start": np.full(n, NO_TIME, dtype=np.int64),
+        "end": np.full(n, NO_TIME, dtype=np.int64),
+        "age_min": np.full(n, NO_AGE, dtype=np.int16),
+        "age_max": np.full(n, NO_AGE, dtype=np.int16),
+    }
+    for i, event in enumerate(events):
+        for field in ("latitude", "longitude"):
+            value = _to_float(event.get(field))
+            if value is not None:
+                columns[field][i] = value
+        if event.get("start"):
+            columns["start"][i] = to_minutes(event["start"])
+            columns["end"][i] = to_minutes(event["end"])
+        if event.get("age_min") is not None:
+            columns["age_min"][i] = event["age_min"]
+            columns["age_max"][i] = event["age_max"]
+    return columns
+
+
+def write_snapshot(events, path=SNAPSHOT_PATH):
+    """
+    File layout: magic, header length (uint32), JSON header describing every
+    array ({name: [dtype, offset, length]}), then the arrays, 8-byte aligned.
+    """
+    arrays = event_columns(events)
+    # Lets a reloading reader see which events changed without decoding them
+    arrays["doc_id"] = np.array([document_id(event) for event in events], dtype="S40")
+    for field in TEXT_FIELDS + JSON_FIELDS:
+        encoded = [
+            (
+                json.dumps(event.get(field), ensure_ascii=False)
+                if field in JSON_FIELDS
+                else "" if event.get(field) is None else str(event[field])
+            ).encode("utf-8")
+            for event in events
+        ]
+        offsets = np.zeros(len(events) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        arrays[f"{field}.offsets"] = offsets
+        arrays[f"{field}.data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    header = json.dumps({"count": len(events), "arrays": layout}).encode("utf-8")
+    header += b" " * (-(len(_MAGIC) + 4 + len(header)) % _ALIGN)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(np.uint32(len(header)).tobytes())
+        f.write(header)
+        for array in arrays.values():
+            data = array.tobytes()
+            f.write(data)
+            f.write(b"\0" * (-len(data) % _ALIGN))
+    os.replace(tmp_path, path)
+
+
+class EventSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot. Columns are NumPy arrays
+    backed by the file; event(i) decodes one event on demand.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        raw = np.memmap(path, dtype=np.uint8, mode="r")
+        if raw[:4].tobytes() != _MAGIC:
+            raise ValueError(f"{path} is not an event snapshot")
+        header_len = int(raw[4:8].view(np.uint32)[0])
+        header = json.loads(raw[8 : 8 + header_len].tobytes())
+        base = 8 + header_len
+        self.count = header["count"]
+        self.arrays = {}
+        for name, (dtype, offset, length) in header["arrays"].items():
+            dtype = np.dtype(dtype)
+            start = base + offset
+            self.arrays[name] = raw[start : start + length * dtype.itemsize].view(dtype)
+
+    def __len__(self):
+        return self.count
+
+    def columns(self):
+        return {
+            name: self.arrays[name]
+            for name in ("latitude", "longitude", "start", "end", "age_min", "age_max")
+        }
+
+    def doc_ids(self):
+        """
+        document_id() of every event, or None for a snapshot written without
+        them.
+        """
+        ids = self.arrays.get("doc_id")
+        return None if ids is None else ids.astype(str).tolist()
+
+    def text(self, field, i):
+        offsets = self.arrays[f"{field}.offsets"]
+        data = self.arrays[f"{field}.data"][offsets[i] : offsets[i + 1]]
+        return data.tobytes().decode("utf-8")
+
+    def event(self, i):
+        event = {field: self.text(field, i) or None for field in TEXT_FIELDS}
+        for field in JSON_FIELDS:
+            event[field] = json.loads(self.text(field, i))
+        for field in ("title", "date", "ages", "location", "url"):
+            event[field] = event[field] or ""
+        start = self.arrays["start"][i]
+        event["start"] = None if start == NO_TIME else from_minutes(start)
+        event["end"] = None if start == NO_TIME else from_minutes(self.arrays["end"][i])
+        age_min = int(self.arrays["age_min"][i])
+        event["age_min"] = None if age_min == NO_AGE else age_min
+        event["age_max"] = None if age_min == NO_AGE else int(self.arrays["age_max"][i])
+        return event
+
+
+def load_events(path):
+    """
+    A snapshot (memory-mapped) or a JSON export, whichever `path` is.
+    """
+    if path.endswith(".snapshot"):
+        return EventSnapshot(path)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
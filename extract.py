@@ -0,0 +1,76 @@
+"""
+Bulk card extraction for the Playwright scrapers.
+
+Each source describes the fields it wants from a card as a small schema:
+
+    {
+        "title": {"selector": ".card-title", "required": True},
+        "href": {"selector": "a", "attr": "href"},
+        "tags": {"selector": ".tag", "all": True},
+    }
+
+- "selector": CSS selector relative to the card (omit to use the card itself)
+- "attr":     read this attribute instead of the element's innerText
+- "all":      return a list with the value for every match
+- "nth":      which match to use (default 0, the first one)
+- "required": the card is reported as an error if the element is missing
+
+All cards matched by a locator are read with a single evaluate_all() call, so a
+page costs one browser round-trip instead of one per card per field. Every row
+that could not be read comes back as {"__error": "..."} so callers can keep
+reporting per-card problems.
+"""
+
+_EXTRACT_CARDS_JS = """
+(cards, schema) => cards.map((card) => {
+  const row = {};
+  try {
+    for (const [name, field] of Object.entries(schema)) {
+      const els = field.selector
+        ? Array.from(card.querySelectorAll(field.selector))
+        : [card];
+      const read = (el) => (field.attr ? el.getAttribute(field.attr) : el.innerText);
+      if (field.all) {
+        row[name] = els.map(read);
+        continue;
+      }
+      const el = els[field.nth || 0];
+      if (!el) {
+        if (field.required) {
+          throw new Error(`missing '${name}' (${field.selector})`);
+        }
+        row[name] = null;
+        continue;
+      }
+      row[name] = read(el);
+    }
+  } catch (e) {
+    return { __error: String((e && e.message) || e) };
+  }
+  return row;
+})
+"""
+
+
+def extract_cards(locator, schema):
+    """
+    Returns one dict per element matched by `locator`, keyed by schema field.
+    """
+    return locator.evaluate_all(_EXTRACT_CARDS_JS, schema)
+
+
+async def async_extract_cards(locator, schema):
+    """
+    Async version of extract_cards() for playwright.async_api locators.
+    """
+    return await locator.evaluate_all(_EXTRACT_CARDS_JS, schema)
+
+
+def check_row(row):
+    """
+    Raises for a row the browser side could not read, so it goes through the
+    caller's normal per-card error handling. Returns the row otherwise.
+    """
+    if "__error" in row:
+        raise ValueError(row["__error"])
+    return row
@@ -0,0 +1,285 @@
+"""
+In-memory stand-in for the Gmail API service object.
+
+Implements just enough of `build("gmail", "v1", ...)` for the ingestion code
+(messages().list/get and batch requests) so it can be run and timed offline:
+
+    service = FakeGmailService.with_sample_mailbox(500)
+    quickstart.process_mailbox(service)
+    print(service.calls)
+
+New mail can be added with add_message(); it shows up in history().list()
+like it would on Gmail, and expire_history() simulates Gmail dropping old
+history records (history().list() then fails with a 404).
+
+`latency` adds a fake round-trip delay (seconds) to every HTTP request, so a
+batch of 100 gets costs one round-trip instead of 100.
+"""
+
+import base64
+import random
+import time
+
+
+def make_message(msg_id, subject, sender, body, extra_headers=None):
+    headers = [
+        {"name": "Subject", "value": subject},
+        {"name": "From", "value": sender},
+    ]
+    for name, value in (extra_headers or {}).items():
+        headers.append({"name": name, "value": value})
+    data = base64.urlsafe_b64encode(body.encode("utf-8")).decode("ascii")
+    return {
+        "id": msg_id,
+        "threadId": msg_id,
+        "labelIds": ["INBOX"],
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": headers,
+            "parts": [
+                {
+                    "mimeType": "text/plain",
+                    "headers": [],
+                    "body": {"size": len(body), "data": data},
+                }
+            ],
+        },
+    }
+
+
+SAMPLE_SUBJECTS = [
+    ("Weekly Family Programs Newsletter", True),
+    ("Your Monthly Digest of Kids Events", True),
+    ("Summer Camp Highlights", True),
+    ("Your receipt from the hardware store", False),
+    ("Re: dinner on Friday?", False),
+    ("Security alert for your account", False),
+]
+
+SAMPLE_NEWSLETTER = """Hello families!
+
+Join us for Tide Pool Explorers #{n} on Saturday at Felix Neck Wildlife Sanctuary.
+Ages 4-10. Register: <https://example.org/track?u=abc123&id=tide-pools-{n}>
+
+Story Time #{n} at the Cambridge Public Library, Tuesdays at 10am, ages 0-5.
+<https://example.org/track?u=abc123&id=story-time-{n}>
+
+You are receiving this email because you signed up on our website.
+Unsubscribe <https://example.org/unsubscribe?u=abc123>
+"""
+
+
+class _Request:
+    def __init__(self, service, fn):
+        self._service = service
+        self._fn = fn
+
+    def execute(self, http=None):
+        self._service._round_trip()
+        return self._fn()
+
+
+class _Batch:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        request_id = request_id or str(len(self._requests))
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self, http=None):
+        self._service.calls["batch"] += 1
+        self._service._round_trip()
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._fn(), None
+            except Exception as e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class _Messages:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, userId, maxResults=100, pageToken=None, q=None, **kwargs):
+        service = self._service
+        service.calls["list"] += 1
+
+        def run():
+            start = int(pageToken or 0)
+            ids = service.order[start : start + maxResults]
+            result = {
+                "messages": [{"id": i, "threadId": i} for i in ids],
+                "resultSizeEstimate": len(service.order),
+            }
+            if start + maxResults < len(service.order):
+                result["nextPageToken"] = str(start + maxResults)
+            return result
+
+        return _Request(service, run)
+
+    def get(self, userId, id, format="full", metadataHeaders=None, fields=None):
+        service = self._service
+        service.calls["get"] += 1
+
+        def run():
+            if id not in service.messages:
+                raise KeyError(f"Requested entity was not found: {id}")
+            msg = service.messages[id]
+            if format == "metadata":
+                wanted = {h.lower() for h in (metadataHeaders or [])}
+                headers = [
+                    h
+                    for h in msg["payload"]["headers"]
+                    if not wanted or h["name"].lower() in wanted
+                ]
+                return {
+                    "id": msg["id"],
+                    "threadId": msg["threadId"],
+                    "payload": {"headers": headers},
+                }
+            return msg
+
+        return _Request(service, run)
+
+
+class FakeHttpError(Exception):
+    """
+    Looks enough like googleapiclient.errors.HttpError (status in .resp).
+    """
+
+    class _Resp(dict):
+        def __init__(self, status, headers=None):
+            super().__init__(headers or {})
+            self.status = status
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(f"<HttpError {status}: {message}>")
+        self.resp = self._Resp(status, headers)
+
+
+class _History:
+    def __init__(self, service):
+        self._service = service
+
+    def list(
+        self,
+        userId,
+        startHistoryId,
+        historyTypes=None,
+        labelId=None,
+        maxResults=100,
+        pageToken=None,
+    ):
+        service = self._service
+        service.calls["history"] += 1
+
+        def run():
+            start = int(startHistoryId)
+            if start < service.oldest_history_id:
+                raise FakeHttpError(404, "Requested entity was not found.")
+            records = [
+                {
+                    "id": str(hid),
+                    "messagesAdded": [
+                        {"message": {"id": msg_id, "labelIds": ["INBOX"]}}
+                    ],
+                }
+                for hid, msg_id in service.history
+                if hid > start
+            ]
+            offset = int(pageToken or 0)
+            result = {
+                "history": records[offset : offset + maxResults],
+                "historyId": str(service.history_id),
+            }
+            if offset + maxResults < len(records):
+                result["nextPageToken"] = str(offset + maxResults)
+            return result
+
+        return _Request(service, run)
+
+
+class _Users:
+    def __init__(self, service):
+        self._service = service
+        self._messages = _Messages(service)
+        self._history = _History(service)
+
+    def messages(self):
+        return self._messages
+
+    def history(self):
+        return self._history
+
+    def getProfile(self, userId):
+        service = self._service
+        return _Request(
+            service,
+            lambda: {
+                "emailAddress": "me@example.com",
+                "messagesTotal": len(service.messages),
+                "historyId": str(service.history_id),
+            },
+        )
+
+
+class FakeGmailService:
+    def __init__(self, messages=(), latency=0.0):
+        self.messages = {}
+        self.order = []  # newest first, like the real API
+        self.latency = latency
+        self.calls = {"list": 0, "get": 0, "batch": 0, "history": 0, "http": 0}
+        self.history_id = 1000
+        self.history = []  # (historyId, message id), oldest first
+        self.oldest_history_id = 0
+        for msg in messages:
+            self.add_message(msg)
+
+    @classmethod
+    def with_sample_mailbox(cls, count, latency=0.0, seed=0):
+        rng = random.Random(seed)
+        service = cls(latency=latency)
+        for n in range(count):
+            subject, newsletter = rng.choice(SAMPLE_SUBJECTS)
+            if newsletter:
+                msg = make_message(
+                    f"m{n:06d}",
+                    subject,
+                    "Programs <news@example.org>",
+                    SAMPLE_NEWSLETTER.format(n=n),
+                    {"List-Unsubscribe": "<https://example.org/unsubscribe>"},
+                )
+            else:
+                msg = make_message(
+                    f"m{n:06d}", subject, "friend@example.com", "See you then!"
+                )
+            service.add_message(msg)
+        return service
+
+    def add_message(self, msg):
+        self.messages[msg["id"]] = msg
+        self.order.insert(0, msg["id"])
+        self.history_id += 1
+        self.history.append((self.history_id, msg["id"]))
+
+    def expire_history(self):
+        """
+        Forget all history so far; older historyIds now get a 404.
+        """
+        self.history = []
+        self.oldest_history_id = self.history_id
+
+    def _round_trip(self):
+        self.calls["http"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def users(self):
+        return _Users(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
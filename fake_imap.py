@@ -0,0 +1,444 @@
+"""
+Local stand-in for an IMAP server (like imap.gmail.com), for running and
+timing imap.py offline.
+
+Speaks plain-text IMAP4rev1 with just the commands imap.py uses: CAPABILITY,
+LOGIN (any user/password), SELECT/EXAMINE, (UID) SEARCH (UID sets, FROM,
+SUBJECT, ALL), (UID) FETCH (UID, FLAGS, RFC822, RFC822.SIZE, BODYSTRUCTURE and
+BODY[...] / BODY.PEEK[...] sections), IDLE/DONE, NOOP and LOGOUT.
+
+    server = FakeImapServer.with_sample_mailbox(500)
+    server.start()                      # background thread, on server.port
+    conn = imap.connect("me", "pw", "localhost", server.port, ssl=False)
+    server.add_message(make_message("Weekly Newsletter", "a@b.org", "..."))
+    print(server.stats)                 # commands received and bytes sent
+
+add_message() notifies clients in IDLE right away, like a real server.
+Fetching without .PEEK (or RFC822) sets \\Seen, so tests can check that
+triage leaves mail unread.
+
+    python fake_imap.py --messages 500 --port 1143
+"""
+
+import email
+import random
+import re
+import socketserver
+import threading
+from collections import Counter
+from email.message import EmailMessage
+from email.policy import SMTP
+
+from fake_gmail import SAMPLE_NEWSLETTER, SAMPLE_SUBJECTS
+
+UIDVALIDITY = 1
+ATTACHMENT_BYTES = 200 * 1024  # Size of the PDF attached to sample newsletters
+
+_FETCH_ITEM_RE = re.compile(
+    r"BODY(?:\.PEEK)?\[[^\]]*\](?:<[\d.]+>)?|[A-Z0-9.]+", re.IGNORECASE
+)
+_SEARCH_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\S+')
+
+
+def make_message(subject, sender, body, extra_headers=None, html=None, attachment=None):
+    """
+    The raw bytes (CRLF line endings) of a message with a text/plain body,
+    optionally an HTML alternative and an attachment (name, bytes).
+    """
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = "me@example.com"
+    for name, value in (extra_headers or {}).items():
+        msg[name] = value
+    msg.set_content(body)
+    if html is not None:
+        msg.add_alternative(html, subtype="html")
+    if attachment is not None:
+        name, data = attachment
+        msg.add_attachment(data, maintype="application", subtype="pdf", filename=name)
+    return msg.as_bytes(policy=SMTP)
+
+
+def _quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _params(pairs):
+    if not pairs:
+        return "NIL"
+    return "(" + " ".join(f"{_quote(k)} {_quote(v)}" for k, v in pairs) + ")"
+
+
+def _split_raw(raw):
+    """
+    (header, body) of a raw message; the header keeps its blank line.
+    """
+    end = raw.find(b"\r\n\r\n")
+    if end < 0:
+        return raw, b""
+    return raw[: end + 4], raw[end + 4 :]
+
+
+def _payload_bytes(part):
+    payload = part.get_payload()
+    if isinstance(payload, list):
+        return b""
+    return payload.encode("utf-8", "surrogateescape")
+
+
+def _bodystructure(part):
+    if part.is_multipart():
+        children = "".join(_bodystructure(p) for p in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())})"
+    body = _payload_bytes(part)
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        _params(part.get_params()[1:] if part.get_params() else None),
+        "NIL",
+        "NIL",
+        _quote(part.get("Content-Transfer-Encoding", "7bit").upper()),
+        str(len(body)),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(body.count(b"\n")))
+    disposition = part.get_content_disposition()
+    if disposition:
+        dparams = [("filename", part.get_filename())] if part.get_filename() else []
+        fields += ["NIL", f"({_quote(disposition.upper())} {_params(dparams)})"]
+    return "(" + " ".join(fields) + ")"
+
+
+def _section(raw, parsed, section):
+    """
+    The bytes of a BODY[section]: HEADER, HEADER.FIELDS (...), TEXT, a part
+    number like 1.2, or the whole message for an empty section.
+    """
+    header, body = _split_raw(raw)
+    upper = section.upper()
+    if not section:
+        return raw
+    if upper == "HEADER":
+        return header
+    if upper == "TEXT":
+        return body
+    if upper.startswith("HEADER.FIELDS"):
+        wanted = re.search(r"\(([^)]*)\)", upper).group(1).split()
+        lines = [
+            f"{name}: {value}\r\n".encode("utf-8")
+            for name, value in parsed.items()
+            if name.upper() in wanted
+        ]
+        return b"".join(lines) + b"\r\n"
+    part = parsed
+    for n in section.split("."):
+        if part.is_multipart():
+            children = part.get_payload()
+            if not n.isdigit() or not 0 < int(n) <= len(children):
+                return b""
+            part = children[int(n) - 1]
+        elif n != "1":
+            return b""
+    return _payload_bytes(part)
+
+
+class _Message:
+    def __init__(self, uid, raw):
+        self.uid = uid
+        self.raw = raw
+        self.parsed = email.message_from_bytes(raw)
+        self.flags = set()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.selected = False
+        self.known_exists = 0
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+        self.server.fake.record_sent(len(data))
+
+    def handle(self):
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE] fake_imap ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                sub, _, args = args.partition(" ")
+                command = f"UID {sub.upper()}"
+            self.server.fake.record_command(command)
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command {command}\r\n")
+                continue
+            if handler(tag, args) is False:
+                return
+
+    def do_CAPABILITY(self, tag, args):
+        self.send(f"* CAPABILITY IMAP4rev1 IDLE\r\n{tag} OK CAPABILITY completed\r\n")
+
+    def do_LOGIN(self, tag, args):
+        self.send(f"{tag} OK LOGIN completed\r\n")
+
+    def do_SELECT(self, tag, args, read_only=False):
+        fake = self.server.fake
+        with fake.lock:
+            exists = len(fake.messages)
+            uidnext = fake.next_uid
+        self.selected = True
+        self.known_exists = exists
+        mode = "READ-ONLY" if read_only else "READ-WRITE"
+        self.send(
+            f"* {exists} EXISTS\r\n* 0 RECENT\r\n* FLAGS (\\Seen)\r\n"
+            f"* OK [UIDVALIDITY {fake.uidvalidity}] UIDs valid\r\n"
+            f"* OK [UIDNEXT {uidnext}] Predicted next UID\r\n"
+            f"{tag} OK [{mode}] SELECT completed\r\n"
+        )
+
+    def do_EXAMINE(self, tag, args):
+        self.do_SELECT(tag, args, read_only=True)
+
+    def do_NOOP(self, tag, args):
+        self._report_exists()
+        self.send(f"{tag} OK NOOP completed\r\n")
+
+    def do_LOGOUT(self, tag, args):
+        self.send(f"* BYE fake_imap logging out\r\n{tag} OK LOGOUT completed\r\n")
+        return False
+
+    def _report_exists(self):
+        with self.server.fake.lock:
+            exists = len(self.server.fake.messages)
+        if self.selected and exists != self.known_exists:
+            self.known_exists = exists
+            self.send(f"* {exists} EXISTS\r\n")
+
+    def notify_exists(self, exists):
+        # Called from add_message() while this client is idling
+        self.known_exists = exists
+        self.send(f"* {exists} EXISTS\r\n")
+
+    def do_IDLE(self, tag, args):
+        fake = self.server.fake
+        self.send("+ idling\r\n")
+        with fake.lock:
+            fake.idlers.add(self)
+        try:
+            self._report_exists()
+            line = self.rfile.readline()
+        finally:
+            with fake.lock:
+                fake.idlers.discard(self)
+        if not line:
+            return False
+        if line.strip().upper() != b"DONE":
+            self.send(f"{tag} BAD expected DONE\r\n")
+        else:
+            self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def do_SEARCH(self, tag, args, by_uid=False):
+        tokens = _SEARCH_TOKEN_RE.findall(args)
+        fake = self.server.fake
+        with fake.lock:
+            messages = list(fake.messages)
+        matches = []
+        for seq, msg in enumerate(messages, start=1):
+            if fake.matches(msg, tokens, messages):
+                matches.append(str(msg.uid if by_uid else seq))
+        self.send(f"* SEARCH {' '.join(matches)}\r\n{tag} OK SEARCH completed\r\n")
+
+    def do_UID_SEARCH(self, tag, args):
+        self.do_SEARCH(tag, args, by_uid=True)
+
+    def do_FETCH(self, tag, args, by_uid=False):
+        number_set, _, items = args.partition(" ")
+        items = _FETCH_ITEM_RE.findall(items)
+        fake = self.server.fake
+        with fake.lock:
+            messages = list(fake.messages)
+        wanted = fake.message_set(number_set, messages, by_uid)
+        for seq, msg in enumerate(messages, start=1):
+            if msg.uid not in wanted:
+                continue
+            out = [f"* {seq} FETCH (UID {msg.uid}".encode("ascii")]
+            for item in items:
+                upper = item.upper()
+                if upper == "UID":
+                    continue
+                if upper == "FLAGS":
+                    out.append(f" FLAGS ({' '.join(sorted(msg.flags))})".encode())
+                elif upper == "RFC822.SIZE":
+                    out.append(f" RFC822.SIZE {len(msg.raw)}".encode())
+                elif upper == "BODYSTRUCTURE":
+                    out.append(b" BODYSTRUCTURE " + _bodystructure(msg.parsed).encode())
+                elif upper == "RFC822" or upper.startswith("BODY"):
+                    if upper == "RFC822":
+                        name, data = "RFC822", msg.raw
+                    else:
+                        section = item[item.index("[") + 1 : item.index("]")]
+                        name, data = f"BODY[{section}]", _section(
+                            msg.raw, msg.parsed, section
+                        )
+                    if not upper.startswith("BODY.PEEK"):
+                        msg.flags.add("\\Seen")
+                    out.append(f" {name} {{{len(data)}}}\r\n".encode() + data)
+            out.append(b")\r\n")
+            self.send(b"".join(out))
+        self.send(f"{tag} OK FETCH completed\r\n")
+
+    def do_UID_FETCH(self, tag, args):
+        self.do_FETCH(tag, args, by_uid=True)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeImapServer:
+    def __init__(self, host="127.0.0.1", port=0, uidvalidity=UIDVALIDITY):
+        self.messages = []
+        self.next_uid = 1
+        self.uidvalidity = uidvalidity
+        self.lock = threading.Lock()
+        self.idlers = set()
+        self.stats = {"commands": Counter(), "bytes_sent": 0}
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self.host, self.port = self._server.server_address
+        self._thread = None
+
+    @classmethod
+    def with_sample_mailbox(cls, count, seed=0, **kwargs):
+        """
+        A mailbox like fake_gmail's sample one; newsletters also come with an
+        HTML alternative and a PDF attachment.
+        """
+        rng = random.Random(seed)
+        attachment = ("programs.pdf", rng.randbytes(ATTACHMENT_BYTES))
+        server = cls(**kwargs)
+        for n in range(count):
+            subject, newsletter = rng.choice(SAMPLE_SUBJECTS)
+            if newsletter:
+                body = SAMPLE_NEWSLETTER.format(n=n)
+                raw = make_message(
+                    subject,
+                    "Programs <news@example.org>",
+                    body,
+                    {"List-Unsubscribe": "<https://example.org/unsubscribe>"},
+                    html=f"<html><body><pre>{body}</pre></body></html>",
+                    attachment=attachment,
+                )
+            else:
+                raw = make_message(subject, "friend@example.com", "See you then!")
+            server.add_message(raw)
+        return server
+
+    def add_message(self, raw):
+        """
+        Appends a message (raw bytes) and tells idling clients. Returns its UID.
+        """
+        with self.lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages.append(_Message(uid, raw))
+            exists = len(self.messages)
+            idlers = list(self.idlers)
+        for handler in idlers:
+            handler.notify_exists(exists)
+        return uid
+
+    def expunge(self, uid):
+        with self.lock:
+            self.messages = [msg for msg in self.messages if msg.uid != uid]
+
+    def reset_uidvalidity(self, uidvalidity):
+        # Like a mailbox being recreated: every UID a client saved is void
+        with self.lock:
+            self.uidvalidity = uidvalidity
+
+    def record_command(self, command):
+        with self.lock:
+            self.stats["commands"][command] += 1
+
+    def record_sent(self, n):
+        with self.lock:
+            self.stats["bytes_sent"] += n
+
+    def message_set(self, text, messages, by_uid=True):
+        """
+        The UIDs of the messages a set like "1:5,9,20:*" covers, as UIDs or
+        sequence numbers. "*" is the highest one in the mailbox, so "n:*"
+        always includes the newest message (RFC 3501).
+        """
+        numbers = {
+            (msg.uid if by_uid else seq): msg.uid
+            for seq, msg in enumerate(messages, start=1)
+        }
+        highest = max(numbers, default=0)
+        wanted = set()
+        for piece in text.split(","):
+            first, _, last = piece.partition(":")
+            first = highest if first == "*" else int(first)
+            last = first if not last else highest if last == "*" else int(last)
+            low, high = sorted((first, last))
+            wanted.update(uid for n, uid in numbers.items() if low <= n <= high)
+        return wanted
+
+    def matches(self, msg, tokens, messages):
+        tokens = iter(tokens)
+        for token in tokens:
+            key = token.upper()
+            if key == "ALL":
+                continue
+            if key == "UID":
+                if msg.uid not in self.message_set(next(tokens), messages):
+                    return False
+            elif key in ("FROM", "SUBJECT"):
+                value = next(tokens).strip('"').lower()
+                if value not in str(msg.parsed.get(key, "")).lower():
+                    return False
+        return True
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local IMAP stand-in server.")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--port", type=int, default=1143)
+    args = parser.parse_args()
+
+    server = FakeImapServer.with_sample_mailbox(args.messages, port=args.port)
+    print(
+        f"[DEBUG] Fake IMAP server with {args.messages} messages on port {server.port}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,225 @@
+"""
+Offline gazetteer for US towns and ZIP codes.
+
+Built once from the GeoNames postal code dump (US.txt from
+https://download.geonames.org/export/zip/US.zip) into a small binary file of
+fixed-width records sorted by a normalized key, which is memory-mapped at
+startup instead of parsed. Each place can be found as "02134", "boston ma" or
+just "boston" (the biggest town of that name wins). Lookups try an exact key,
+then a prefix ("bost" -> Boston, MA), then a fuzzy match for typos, and the
+last LOOKUP_CACHE_SIZE queries are kept in an LRU.
+
+    python gazetteer.py build US.txt     # writes gazetteer.bin
+    python gazetteer.py "Concord, MA"    # look a place up
+"""
+
+import difflib
+import os
+import re
+from functools import lru_cache
+
+import numpy as np
+
+GAZETTEER_PATH = "gazetteer.bin"
+LOOKUP_CACHE_SIZE = 4096
+KEY_BYTES = 40
+NAME_BYTES = 40
+FUZZY_CUTOFF = 0.85
+MAX_FUZZY_BLOCK = 5000  # Don't run difflib over more keys than this
+
+_MAGIC = b"GAZ1"
+_HEADER = np.dtype([("magic", "S4"), ("count", "<u4")])
+# Each column is stored contiguously, in this order, after the header
+_COLUMNS = [
+    ("key", f"S{KEY_BYTES}"),
+    ("name", f"S{NAME_BYTES}"),
+    ("lat", "<f4"),
+    ("lon", "<f4"),
+    ("weight", "<u2"),  # Number of ZIP codes in the town, used to rank matches
+]
+
+US_STATES = {
+    "alabama": "al", "alaska": "ak", "arizona": "az", "arkansas": "ar",
+    "california": "ca", "colorado": "co", "connecticut": "ct", "delaware": "de",
+    "district of columbia": "dc", "florida": "fl", "georgia": "ga", "hawaii": "hi",
+    "idaho": "id", "illinois": "il", "indiana": "in", "iowa": "ia",
+    "kansas": "ks", "kentucky": "ky", "louisiana": "la", "maine": "me",
+    "maryland": "md", "massachusetts": "ma", "michigan": "mi", "minnesota": "mn",
+    "mississippi": "ms", "missouri": "mo", "montana": "mt", "nebraska": "ne",
+    "nevada": "nv", "new hampshire": "nh", "new jersey": "nj", "new mexico": "nm",
+    "new york": "ny", "north carolina": "nc", "north dakota": "nd", "ohio": "oh",
+    "oklahoma": "ok", "oregon": "or", "pennsylvania": "pa", "rhode island": "ri",
+    "south carolina": "sc", "south dakota": "sd", "tennessee": "tn", "texas": "tx",
+    "utah": "ut", "vermont": "vt", "virginia": "va", "washington": "wa",
+    "west virginia": "wv", "wisconsin": "wi", "wyoming": "wy",
+}  # fmt: skip
+# Longest names first so "west virginia" wins over "virginia"
+_STATE_NAMES = sorted(US_STATES, key=len, reverse=True)
+_ZIP_RE = re.compile(r"^\s*(\d{5})(?:-\d{4})?\s*$")
+_COUNTRY_SUFFIX_RE = re.compile(r"\s+(usa|us|united states( of america)?)$")
+
+
+def normalize_place(text):
+    """
+    "Concord, Massachusetts 01742" -> "concord ma"; "02134-1234" -> "02134".
+    """
+    zip_match = _ZIP_RE.match(text or "")
+    if zip_match:
+        return zip_match.group(1)
+    text = (text or "").lower().replace(".", "").replace("'", "")
+    text = " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+    text = _COUNTRY_SUFFIX_RE.sub("", text)
+    text = re.sub(r"\s+\d{5}$", "", text)  # Drop a trailing ZIP after the town
+    for state in _STATE_NAMES:
+        if text.endswith(" " + state):
+            return text[: -len(state)] + US_STATES[state]
+    return text
+
+
+def _read_geonames_postal(path):
+    """
+    Yields (zip, place, state_code, lat, lon) from a GeoNames postal code file.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 11 or not cols[9] or not cols[10]:
+                continue
+            yield cols[1], cols[2], cols[4], float(cols[9]), float(cols[10])
+
+
+def build_gazetteer(source_path, out_path=GAZETTEER_PATH):
+    towns = {}  # (place, state) -> [lat_sum, lon_sum, count]
+    records = {}  # key -> (name, lat, lon, weight)
+    for zip_code, place, state, lat, lon in _read_geonames_postal(source_path):
+        records[zip_code] = (f"{place}, {state}", lat, lon, 1)
+        town = towns.setdefault((place, state), [0.0, 0.0, 0])
+        town[0] += lat
+        town[1] += lon
+        town[2] += 1
+
+    for (place, state), (lat_sum, lon_sum, count) in towns.items():
+        record = (f"{place}, {state}", lat_sum / count, lon_sum / count, count)
+        records[normalize_place(f"{place} {state}")] = record
+        bare = normalize_place(place)
+        if bare not in records or records[bare][3] < count:
+            records[bare] = record
+
+    keys = sorted(k for k in records if len(k.encode("utf-8")) <= KEY_BYTES)
+    columns = {
+        "key": np.array([k.encode("utf-8") for k in keys], dtype=f"S{KEY_BYTES}"),
+        "name": np.array(
+            [records[k][0].encode("utf-8")[:NAME_BYTES] for k in keys],
+            dtype=f"S{NAME_BYTES}",
+        ),
+        "lat": np.array([records[k][1] for k in keys], dtype="<f4"),
+        "lon": np.array([records[k][2] for k in keys], dtype="<f4"),
+        "weight": np.array([min(records[k][3], 65535) for k in keys], dtype="<u2"),
+    }
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.array([(_MAGIC, len(keys))], dtype=_HEADER).tofile(f)
+        for name, _ in _COLUMNS:
+            columns[name].tofile(f)
+    os.replace(tmp_path, out_path)
+    print(f"[DEBUG] Gazetteer: {len(keys)} keys from {len(towns)} towns -> {out_path}")
+    return len(keys)
+
+
+class Gazetteer:
+    def __init__(self, path=GAZETTEER_PATH, cache_size=LOOKUP_CACHE_SIZE):
+        header = np.fromfile(path, dtype=_HEADER, count=1)
+        if len(header) != 1 or header[0]["magic"] != _MAGIC:
+            raise ValueError(f"{path} is not a gazetteer file")
+        count = int(header[0]["count"])
+
+        offset = _HEADER.itemsize
+        for name, dtype in _COLUMNS:
+            column = np.memmap(
+                path, dtype=dtype, mode="r", offset=offset, shape=(count,)
+            )
+            setattr(self, "_" + name, column)
+            offset += column.nbytes
+        self._find = lru_cache(maxsize=cache_size)(self._find_uncached)
+
+    def __len__(self):
+        return len(self._key)
+
+    def _prefix_range(self, prefix):
+        prefix = prefix.encode("utf-8")
+        lo = int(np.searchsorted(self._key, prefix, side="left"))
+        hi = int(np.searchsorted(self._key, prefix + b"\xff", side="left"))
+        return lo, hi
+
+    def _find_uncached(self, key):
+        """
+        (row, match type) for a normalized key, or (None, None).
+        """
+        if not key:
+            return None, None
+        lo, hi = self._prefix_range(key)
+        if hi > lo and self._key[lo] == key.encode("utf-8"):
+            return lo, "exact"
+        if hi > lo and len(key) >= 3 and not key.isdigit():
+            return lo + int(np.argmax(self._weight[lo:hi])), "prefix"
+
+        # Fuzzy: compare against keys sharing the first two letters
+        lo, hi = self._prefix_range(key[:2])
+        if len(key) < 4 or key.isdigit() or hi <= lo or hi - lo > MAX_FUZZY_BLOCK:
+            return None, None
+        block = [k.decode("utf-8") for k in self._key[lo:hi]]
+        close = difflib.get_close_matches(key, block, n=1, cutoff=FUZZY_CUTOFF)
+        if not close:
+            return None, None
+        return lo + block.index(close[0]), "fuzzy"
+
+    def lookup(self, query):
+        """
+        {"name", "latitude", "longitude", "match"} for a town or ZIP code,
+        or None if the gazetteer doesn't know it.
+        """
+        row, match = self._find(normalize_place(query))
+        if row is None:
+            return None
+        return {
+            "name": self._name[row].decode("utf-8"),
+            "latitude": round(float(self._lat[row]), 6),
+            "longitude": round(float(self._lon[row]), 6),
+            "match": match,
+        }
+
+    def cache_info(self):
+        return self._find.cache_info()
+
+
+_gazetteer = None
+_gazetteer_missing = False
+
+
+def get_gazetteer(path=GAZETTEER_PATH):
+    """
+    The shared Gazetteer, or None if gazetteer.bin hasn't been built.
+    """
+    global _gazetteer, _gazetteer_missing
+    if _gazetteer is None and not _gazetteer_missing:
+        if os.path.exists(path):
+            _gazetteer = Gazetteer(path)
+        else:
+            _gazetteer_missing = True
+            print(
+                f"[DEBUG] No gazetteer at {path}; run 'python gazetteer.py build US.txt'"
+            )
+    return _gazetteer
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 3 and sys.argv[1] == "build":
+        build_gazetteer(sys.argv[2])
+    elif len(sys.argv) == 2:
+        gazetteer = get_gazetteer()
+        print(gazetteer.lookup(sys.argv[1]) if gazetteer else None)
+    else:
+        print("usage: python gazetteer.py build US.txt | python gazetteer.py PLACE")
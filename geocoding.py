@@ -0,0 +1,173 @@
+"""
+Geocoding shared by the scrapers (scr.py) and the search API (event_service.py).
+
+Towns and ZIP codes are answered from the offline gazetteer (gazetteer.py);
+anything else goes to Nominatim, with the answers cached on disk. Nominatim
+calls go through the shared rate limiter (rate_limit.py), which holds them to
+1 request/second across all threads.
+"""
+
+import re
+
+from cache_store import MISSING, SqliteCache
+from metrics import count, span
+from rate_limit import NOMINATIM_HOST, call
+
+# IMPORTANT: Provide a unique user_agent with an identifiable string (e.g., your email or project name)
+# This is crucial for Nominatim's usage policy.
+NOMINATIM_USER_AGENT = "YourAudubonEventScraper/1.0 (ondrasek_hanna@wheatoncollege.edu)"
+
+_geolocator = None
+
+
+def get_geolocator():
+    """
+    The Nominatim client, created on first use. Importing geopy and setting
+    up its SSL context takes ~100 ms, which commands that never miss the
+    gazetteer and the cache (e.g. serving searches) shouldn't pay at startup.
+    """
+    global _geolocator
+    if _geolocator is None:
+        from geopy.geocoders import Nominatim
+
+        _geolocator = Nominatim(user_agent=NOMINATIM_USER_AGENT)
+    return _geolocator
+
+
+# --- Persistent geocode cache ---
+# Every location the gazetteer can't place goes through Nominatim (rate limited),
+# so results are remembered on disk between runs. Failed lookups ("no results")
+# are cached too, but for a shorter time, so we don't keep re-asking for
+# locations Nominatim doesn't know. Errors/timeouts are never cached.
+GEOCODE_CACHE_PATH = "geocode_cache.sqlite3"
+GEOCODE_CACHE_TTL = 60 * 60 * 24 * 90  # 90 days for successful lookups
+GEOCODE_NEGATIVE_TTL = 60 * 60 * 24 * 7  # 7 days for "no results"
+GEOCODE_CACHE_MAX_ENTRIES = 5000
+
+GEOCODE_ATTEMPTS = 3
+
+geocode_cache = SqliteCache(
+    GEOCODE_CACHE_PATH, table="geocode", max_entries=GEOCODE_CACHE_MAX_ENTRIES
+)
+
+
+def _geocode_cache_key(location_str):
+    """
+    Normalizes a location string so trivial differences (case, extra spaces,
+    trailing punctuation) share the same cache entry.
+    """
+    key = re.sub(r"\s+", " ", location_str).strip().strip(",.").strip()
+    return key.lower()
+
+
+def geocode_location(location_str, attempt_type="original"):
+    """
+    Helper function to geocode a location string with Nominatim and handle delays/retries.
+    Successful lookups and "no results" answers are written to the geocode cache.
+    """
+    from geopy.exc import (
+        GeocoderRateLimited,
+        GeocoderTimedOut,
+        GeocoderServiceError,
+        GeocoderUnavailable,
+    )  # Import specific exceptions
+
+    geolocator = get_geolocator()
+    print(f"   [GEOCoding] Attempting geocoding '{attempt_type}' for: '{location_str}'")
+    try:
+        # Waits only if another lookup used this second's request; timeouts
+        # and rate limiting (429, with its Retry-After) are retried
+        with span("geocode.nominatim"):
+            loc = call(
+                NOMINATIM_HOST,
+                lambda: geolocator.geocode(location_str, timeout=10),
+                f"Geocoding '{location_str}'",
+                attempts=GEOCODE_ATTEMPTS,
+                retry_if=lambda e: isinstance(
+                    e, (GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable)
+                ),
+            )
+        if loc:
+            print(
+                f"   [GEOCoding] Success for '{location_str}': {loc.latitude}, {loc.longitude}"
+            )
+            lat, lon = str(loc.latitude), str(loc.longitude)
+            geocode_cache.set(
+                _geocode_cache_key(location_str), [lat, lon], GEOCODE_CACHE_TTL
+            )
+            return lat, lon
+        else:
+            print(f"   [GEOCoding] No results from Nominatim for: '{location_str}'")
+            count("geocode.no_results")
+            geocode_cache.set(
+                _geocode_cache_key(location_str), None, GEOCODE_NEGATIVE_TTL
+            )
+            return None, None
+    except (GeocoderTimedOut, GeocoderServiceError) as e:
+        print(
+            f"   [GEOCoding ERROR] Nominatim service error or timeout for '{location_str}': {e}"
+        )
+        count("geocode.errors")
+        return None, None
+    except Exception as e:
+        print(f"   [GEOCoding ERROR] Unexpected error geocoding '{location_str}': {e}")
+        count("geocode.errors")
+        return None, None
+
+
+def cached_geocode(location_str, attempt_type="original"):
+    """
+    Looks the location up in the geocode cache first and only falls back to
+    Nominatim on a miss. A cached "no results" returns (None, None) without
+    any network call.
+    """
+    cached = geocode_cache.get(_geocode_cache_key(location_str))
+    if cached is not MISSING:
+        count("geocode.cache_hits")
+        if cached is None:
+            print(f"   [GEOCoding] Cached miss for '{attempt_type}': '{location_str}'")
+            return None, None
+        print(f"   [GEOCoding] Cache hit for '{attempt_type}': '{location_str}'")
+        return tuple(cached)
+    count("geocode.cache_misses")
+    return geocode_location(location_str, attempt_type)
+
+
+def gazetteer_geocode(location_str):
+    """
+    (lat, lon) strings from the offline gazetteer, or (None, None). Never
+    touches the network.
+    """
+    from gazetteer import get_gazetteer  # Imported here: it pulls in NumPy
+
+    gazetteer = get_gazetteer()
+    place = gazetteer.lookup(location_str) if gazetteer else None
+    if place is None:
+        count("geocode.gazetteer_misses")
+        return None, None
+    count("geocode.gazetteer_hits")
+    return str(place["latitude"]), str(place["longitude"])
+
+
+def geocode_query(query):
+    """
+    Resolves a user's search text (a town or ZIP code) for the search API.
+    Returns {"name", "latitude", "longitude", "source"} or None.
+    """
+    from gazetteer import get_gazetteer
+
+    gazetteer = get_gazetteer()
+    place = gazetteer.lookup(query) if gazetteer else None
+    if place is not None:
+        return {**place, "source": "gazetteer"}
+
+    # Bias Nominatim towards the US, like the search page used to
+    lat, lon = cached_geocode(f"{query}, USA", "search query")
+    if lat is None:
+        return None
+    return {
+        "name": query,
+        "latitude": float(lat),
+        "longitude": float(lon),
+        "source": "nominatim",
+    }
@@ -0,0 +1,229 @@
+"""
+Batched Gmail message fetching.
+
+Instead of one messages().get() round-trip per message, message IDs are paged
+out of messages().list() with nextPageToken and then fetched with Gmail batch
+HTTP requests (up to 100 per batch), with a few batches in flight at once.
+
+Fetching happens in two passes: first only the headers needed for triage
+(format="metadata"), then the full payload only for the messages that look
+like newsletters.
+
+All requests go through the Gmail rate limiter (rate_limit.py). Messages that
+fail with a transient error (429 rate limit, 5xx) are fetched again in a
+later batch instead of being dropped.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import count, span
+from rate_limit import (
+    GMAIL_HOST,
+    MAX_ATTEMPTS,
+    acquire,
+    backoff_delay,
+    call,
+    is_transient,
+    limiter,
+    retry_after,
+)
+
+BATCH_SIZE = 100  # Gmail's limit for one batch request
+MAX_CONCURRENT_BATCHES = 4
+LIST_PAGE_SIZE = 500  # Max allowed by messages().list()
+
+TRIAGE_HEADERS = ["Subject", "From", "List-Id", "List-Unsubscribe"]
+METADATA_FIELDS = "id,threadId,payload/headers"
+FULL_FIELDS = "id,threadId,payload"
+
+
+def list_message_ids(service, max_results=None, query=None):
+    """
+    Returns message IDs (newest first), following nextPageToken until
+    max_results IDs were collected or the mailbox is exhausted.
+    """
+    ids = []
+    page_token = None
+    while True:
+        page_size = LIST_PAGE_SIZE
+        if max_results is not None:
+            page_size = min(page_size, max_results - len(ids))
+        kwargs = {"userId": "me", "maxResults": page_size}
+        if query:
+            kwargs["q"] = query
+        if page_token:
+            kwargs["pageToken"] = page_token
+        with span("gmail.list"):
+            result = call(
+                GMAIL_HOST,
+                service.users().messages().list(**kwargs).execute,
+                "Gmail messages.list",
+            )
+
+        ids.extend(m["id"] for m in result.get("messages", []))
+        page_token = result.get("nextPageToken")
+        if not page_token or (max_results is not None and len(ids) >= max_results):
+            return ids
+
+
+def authorized_http_factory(creds):
+    """
+    Returns a function that creates a new authorized HTTP object. httplib2 is
+    not thread-safe, so every worker thread needs its own.
+    """
+    import google_auth_httplib2
+    import httplib2
+
+    def make_http():
+        return google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+
+    return make_http
+
+
+def batch_get_messages(
+    service,
+    message_ids,
+    fmt="full",
+    metadata_headers=None,
+    fields=None,
+    http_factory=None,
+    max_workers=MAX_CONCURRENT_BATCHES,
+):
+    """
+    Fetches messages with batch requests. Returns {message id: message} for
+    every message that came back. Transient failures are retried up to
+    MAX_ATTEMPTS times; other failures are reported and skipped.
+
+    Without an `http_factory` the batches run one at a time on the service's
+    own HTTP object.
+    """
+    messages = {}
+    retry = {}  # message id -> transient error, for the next round
+    lock = threading.Lock()
+    local = threading.local()
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            if is_transient(exception):
+                with lock:
+                    retry[request_id] = exception
+                return
+            print(f"[WARN] Could not fetch message {request_id}: {exception}")
+            count("gmail.message_failures", format=fmt)
+            return
+        with lock:
+            messages[request_id] = response
+
+    def run_batch(chunk):
+        batch = service.new_batch_http_request(callback=callback)
+        for msg_id in chunk:
+            kwargs = {"userId": "me", "id": msg_id, "format": fmt}
+            if metadata_headers:
+                kwargs["metadataHeaders"] = metadata_headers
+            if fields:
+                kwargs["fields"] = fields
+            batch.add(service.users().messages().get(**kwargs), request_id=msg_id)
+        if http_factory is not None and not hasattr(local, "http"):
+            local.http = http_factory()
+        acquire(GMAIL_HOST, len(chunk))
+        with span("gmail.batch_get", format=fmt):
+            if http_factory is None:
+                batch.execute()
+            else:
+                batch.execute(http=local.http)
+
+    def run_round(ids):
+        chunks = [ids[i : i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+        workers = 1 if http_factory is None else max(1, min(max_workers, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_batch, chunk): chunk for chunk in chunks}
+            for future, chunk in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    count("gmail.batch_failures", format=fmt)
+                    if is_transient(e):
+                        with lock:
+                            retry.update((msg_id, e) for msg_id in chunk)
+                    else:
+                        print(f"[WARN] Gmail batch request failed: {e}")
+
+    pending = list(message_ids)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        run_round(pending)
+        if not retry:
+            break
+        pending = [msg_id for msg_id in pending if msg_id in retry]
+        errors = list(retry.values())
+        retry.clear()
+        if attempt == MAX_ATTEMPTS:
+            for msg_id in pending:
+                print(f"[WARN] Could not fetch message {msg_id}: {errors[0]}")
+            count("gmail.message_failures", len(pending), format=fmt)
+            break
+        delays = [d for d in map(retry_after, errors) if d is not None]
+        if delays:
+            delay = max(delays)
+            limiter(GMAIL_HOST).pause(delay)
+        else:
+            delay = backoff_delay(attempt)
+        count("rate_limit.retries", len(pending), host=GMAIL_HOST)
+        print(
+            f"[WARN] {len(pending)} Gmail message(s) failed ({errors[0]}), "
+            f"retry {attempt}/{MAX_ATTEMPTS - 1} in {delay:.1f}s"
+        )
+        time.sleep(delay)
+    count("gmail.messages_fetched", len(messages), format=fmt)
+    return messages
+
+
+def get_header(msg, name, default=None):
+    for header in msg.get("payload", {}).get("headers", []):
+        if header["name"].lower() == name.lower():
+            return header["value"]
+    return default
+
+
+def triage_headers(msg):
+    """
+    {header name: value} of the TRIAGE_HEADERS, for triage.py.
+    """
+    return {name: get_header(msg, name, "") for name in TRIAGE_HEADERS}
+
+
+def fetch_newsletters(service, message_ids, is_newsletter, http_factory=None):
+    """
+    Triage on headers first, then download full bodies for newsletters only.
+    `is_newsletter(headers_msg)` decides from the metadata-only message.
+
+    Returns a list of full messages, in the order of message_ids.
+    """
+    headers = batch_get_messages(
+        service,
+        message_ids,
+        fmt="metadata",
+        metadata_headers=TRIAGE_HEADERS,
+        fields=METADATA_FIELDS,
+        http_factory=http_factory,
+    )
+    newsletter_ids = [
+        msg_id
+        for msg_id in message_ids
+        if msg_id in headers and is_newsletter(headers[msg_id])
+    ]
+    print(
+        f"[DEBUG] {len(newsletter_ids)} of {len(message_ids)} messages look like newsletters."
+    )
+    if not newsletter_ids:
+        return []
+
+    full = batch_get_messages(
+        service,
+        newsletter_ids,
+        fmt="full",
+        fields=FULL_FIELDS,
+        http_factory=http_factory,
+    )
+    return [full[msg_id] for msg_id in newsletter_ids if msg_id in full]
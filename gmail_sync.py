@@ -0,0 +1,189 @@
+"""
+Incremental Gmail sync based on the mailbox history.
+
+The last seen historyId and the IDs of already processed messages are kept in
+a small JSON state file. Each run asks users().history().list() for messages
+added to the inbox since that historyId, so a poll with no new mail costs a
+single cheap request. If there is no saved historyId yet, or Gmail says it is
+too old (HTTP 404), we fall back to a full resync: every message since the
+last sync (up to RESYNC_MAX_MESSAGES), or the latest max_results messages on
+a first run. The processed-ID list keeps that from re-running newsletters we
+already handled.
+
+Messages the pipeline couldn't finish (a failed fetch, extraction or store)
+aren't marked processed; they are kept under "retry" and offered again on
+the next runs, up to MAX_RETRIES times.
+"""
+
+import json
+import os
+import time
+
+from gmail_fetch import list_message_ids
+from metrics import count, span
+from rate_limit import GMAIL_HOST, call, count_failure
+
+GMAIL_STATE_PATH = "gmail_state.json"
+MAX_PROCESSED_IDS = 5000  # Oldest processed IDs are forgotten beyond this
+HISTORY_PAGE_SIZE = 500
+MAX_RETRIES = 5  # Runs a failed message is offered again before giving up
+RESYNC_MAX_MESSAGES = 2000
+RESYNC_MARGIN = 60 * 60 * 24  # seconds; Gmail's after: search is day-granular
+
+
+def _empty_state():
+    return {"historyId": None, "synced_at": None, "processed": [], "retry": {}}
+
+
+def load_gmail_state(path=GMAIL_STATE_PATH):
+    if not os.path.exists(path):
+        return _empty_state()
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Could not read {path}, doing a full resync: {e}")
+        return _empty_state()
+    for key, value in _empty_state().items():
+        state.setdefault(key, value)
+    return state
+
+
+def save_gmail_state(state, path=GMAIL_STATE_PATH):
+    state["processed"] = state["processed"][-MAX_PROCESSED_IDS:]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def mark_processed(state, message_ids):
+    processed = set(state["processed"])
+    for msg_id in message_ids:
+        state["retry"].pop(msg_id, None)
+        if msg_id not in processed:
+            processed.add(msg_id)
+            state["processed"].append(msg_id)
+
+
+def keep_for_retry(state, message_ids):
+    """
+    Offers unfinished messages again on the next run; after MAX_RETRIES
+    tries a message is given up on (and marked processed).
+    """
+    given_up = count_failure(state["retry"], message_ids, MAX_RETRIES)
+    if given_up:
+        print(
+            f"[WARN] Giving up on {len(given_up)} message(s) after "
+            f"{MAX_RETRIES} tries: {', '.join(given_up)}"
+        )
+        count("gmail.given_up", len(given_up))
+        mark_processed(state, given_up)
+
+
+def _is_history_expired(error):
+    # googleapiclient.errors.HttpError keeps the HTTP response in .resp
+    return getattr(getattr(error, "resp", None), "status", None) == 404
+
+
+def _history_message_ids(service, start_history_id):
+    """
+    Returns (IDs of messages added to the inbox since start_history_id, the
+    mailbox's current historyId).
+    """
+    ids = []
+    seen = set()
+    page_token = None
+    latest_history_id = start_history_id
+    while True:
+        kwargs = {
+            "userId": "me",
+            "startHistoryId": start_history_id,
+            "historyTypes": ["messageAdded"],
+            "labelId": "INBOX",
+            "maxResults": HISTORY_PAGE_SIZE,
+        }
+        if page_token:
+            kwargs["pageToken"] = page_token
+        with span("gmail.history"):
+            result = call(
+                GMAIL_HOST,
+                service.users().history().list(**kwargs).execute,
+                "Gmail history.list",
+            )
+
+        for record in result.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg_id = added["message"]["id"]
+                if msg_id not in seen:
+                    seen.add(msg_id)
+                    ids.append(msg_id)
+        latest_history_id = result.get("historyId", latest_history_id)
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            # history is oldest first; the rest of the code expects newest first
+            return ids[::-1], latest_history_id
+
+
+def _full_resync(service, max_results, since=None):
+    """
+    Lists the messages since the `since` timestamp (the last sync), or the
+    latest max_results ones without it.
+    """
+    count("gmail.full_resyncs")
+    # Read the historyId *before* listing so nothing that arrives in between is missed
+    profile = call(
+        GMAIL_HOST,
+        service.users().getProfile(userId="me").execute,
+        "Gmail getProfile",
+    )
+    history_id = profile["historyId"]
+    if since is None:
+        return list_message_ids(service, max_results=max_results), history_id
+
+    after = int(since - RESYNC_MARGIN)
+    ids = list_message_ids(
+        service, max_results=RESYNC_MAX_MESSAGES, query=f"after:{after}"
+    )
+    print(f"[DEBUG] {len(ids)} message(s) since the last sync.")
+    if len(ids) >= RESYNC_MAX_MESSAGES:
+        print(
+            f"[WARN] More than {RESYNC_MAX_MESSAGES} messages since the last sync; "
+            "older ones are skipped."
+        )
+        count("gmail.resync_truncated")
+    return ids, history_id
+
+
+def sync_new_message_ids(service, state, max_results=10):
+    """
+    Returns the IDs of messages that still need processing (new ones, then
+    the ones kept for retry) and the historyId to save once they are done
+    (see commit_history_id()).
+    """
+    history_id = state.get("historyId")
+    if history_id:
+        try:
+            ids, latest = _history_message_ids(service, history_id)
+            print(f"[DEBUG] {len(ids)} new message(s) since historyId {history_id}.")
+        except Exception as e:
+            if not _is_history_expired(e):
+                raise
+            print(f"[WARN] historyId {history_id} expired, doing a full resync.")
+            ids, latest = _full_resync(service, max_results, state.get("synced_at"))
+    else:
+        print("[DEBUG] No saved historyId, doing a full resync.")
+        ids, latest = _full_resync(service, max_results)
+
+    processed = set(state["processed"])
+    ids = [msg_id for msg_id in ids if msg_id not in processed]
+    new = set(ids)
+    retry = [msg_id for msg_id in state["retry"] if msg_id not in new]
+    if retry:
+        print(f"[DEBUG] Retrying {len(retry)} unfinished message(s).")
+    return ids + retry, latest
+
+
+def commit_history_id(state, history_id):
+    state["historyId"] = history_id
+    state["synced_at"] = time.time()
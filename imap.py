@@ -13,72 +13,701 @@ Scroll down to App Passwords under 2 step verification.
 Select Mail under Select App. and Other under Select Device. (Give a name, e.g., python)
 The system gives you a password that you need to use to authenticate from python.
 
+Newsletters are streamed out of the mailbox without downloading whole
+messages:
+
+- UID SEARCH for the messages above the last seen UID (kept in
+  imap_state.json together with the mailbox's UIDVALIDITY)
+- UID FETCH of UID_BATCH_SIZE messages at a time, headers only
+  (BODY.PEEK[HEADER.FIELDS (SUBJECT FROM LIST-ID LIST-UNSUBSCRIBE)]), for triage
+- for the newsletters, BODYSTRUCTURE and then only their text/plain part, so
+  attachments and HTML alternatives never cross the wire (HTML-only
+  newsletters get their text/html part, with the markup stripped)
+
+Each batch is parsed as it arrives and its newsletters are extracted while the
+next batch downloads, so memory stays flat however big the mailbox is. PEEK
+leaves every message unread. Newsletters whose body didn't come back or whose
+extraction failed are kept under "retry" in imap_state.json and fetched again
+on the next syncs, up to MAX_RETRIES times. With --idle the connection stays open and IMAP
+IDLE wakes it up when new mail arrives, instead of polling.
+
+    python imap.py                                   # new mail since the last run
+    python imap.py --idle                            # then wait for more
+    python imap.py --host localhost --port 1143 --no-ssl   # fake_imap.py
+    python imap.py --bench 500                       # offline, against fake_imap.py
 """
 
 # Importing libraries
-import imaplib
+import base64
 import email
+import email.policy
+import html
+import imaplib
+import json
+import os
+import quopri
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml  # To load saved login credentials from a yaml file
 
-with open("credentials.yml") as f:
-    content = f.read()
+from event_store import EVENT_STORE_PATH, EventStore
+from metrics import count, span
+from quickstart import (
+    NEWSLETTER_SOURCE,
+    determineEmailType,
+    newsletter_event,
+    newsletter_event_key,
+    parseStuff,
+    publish_events,
+)
+from rate_limit import count_failure
+from triage import BODY_SCAN_CHARS, get_triage
 
-# from credentials.yml import user name and password
-my_credentials = yaml.load(content, Loader=yaml.FullLoader)
+# URL for IMAP connection
+IMAP_URL = "imap.gmail.com"
+MAILBOX = "INBOX"
+IMAP_STATE_PATH = "imap_state.json"
+UID_BATCH_SIZE = 200  # Messages per UID FETCH
+INITIAL_MESSAGES = 10  # Newest messages processed when there's no saved UID
+TRIAGE_FIELDS = ("SUBJECT", "FROM", "LIST-ID", "LIST-UNSUBSCRIBE")
+EXTRACT_WORKERS = 4
+MAX_RETRIES = 5  # Syncs a failed newsletter is fetched again before giving up
+# Servers may drop a connection that has been idle for 30 minutes (RFC 2177)
+IDLE_TIMEOUT = 29 * 60
+POLL_INTERVAL = 60  # For servers without IDLE
 
-# Load the user name and passwd from yaml file
-user, password = my_credentials["user"], my_credentials["password"]
+_LITERAL_RE = re.compile(rb"\{\d+\}$")
+_HIDDEN_RE = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.I | re.S)
+_BREAK_RE = re.compile(r"<(br|/p|/div|/li|/tr|/h\d)\b[^>]*>", re.I)
+_TAG_RE = re.compile(r"<[^>]+>")
+_OPEN, _CLOSE = object(), object()
 
-# URL for IMAP connection
-imap_url = "imap.gmail.com"
-
-# Connection with GMAIL using SSL
-my_mail = imaplib.IMAP4_SSL(imap_url)
-
-# Log in using your credentials
-my_mail.login(user, password)
-
-# Select the Inbox to fetch messages
-my_mail.select("Inbox")
-
-# Define Key and Value for email search
-# For other keys (criteria): https://gist.github.com/martinrusev/6121028#file-imap-search
-key = "FROM"
-value = "bnsreenu@hotmail.com"
-_, data = my_mail.search(
-    None, key, value
-)  # Search for emails with specific key and value
-
-mail_id_list = data[0].split()  # IDs of all emails that we want to fetch
-
-msgs = []  # empty list to capture all messages
-# Iterate through messages and extract data into the msgs list
-for num in mail_id_list:
-    typ, data = my_mail.fetch(
-        num, "(RFC822)"
-    )  # RFC822 returns whole message (BODY fetches just body)
-    msgs.append(data)
-
-# Now we have all messages, but with a lot of details
-# Let us extract the right text and print on the screen
-
-# In a multipart e-mail, email.message.Message.get_payload() returns a
-# list with one item for each part. The easiest way is to walk the message
-# and get the payload on each part:
-# https://stackoverflow.com/questions/1463074/how-can-i-get-an-email-messages-text-content-using-python
-
-# NOTE that a Message object consists of headers and payloads.
-
-for msg in msgs[::-1]:
-    for response_part in msg:
-        if type(response_part) is tuple:
-            my_msg = email.message_from_bytes((response_part[1]))
-            print("_________________________________________")
-            print("subj:", my_msg["subject"])
-            print("from:", my_msg["from"])
-            print("body:")
-            for part in my_msg.walk():
-                # print(part.get_content_type())
-                if part.get_content_type() == "text/plain":
-                    print(part.get_payload())
+
+def load_credentials(path="credentials.yml"):
+    with open(path) as f:
+        content = f.read()
+
+    # from credentials.yml import user name and password
+    my_credentials = yaml.load(content, Loader=yaml.FullLoader)
+
+    # Load the user name and passwd from yaml file
+    return my_credentials["user"], my_credentials["password"]
+
+
+def connect(user, password, host=IMAP_URL, port=None, ssl=True):
+    """
+    A logged-in connection; ssl=False is for local test servers only.
+    """
+    if ssl:
+        conn = imaplib.IMAP4_SSL(host, port or imaplib.IMAP4_SSL_PORT)
+    else:
+        conn = imaplib.IMAP4(host, port or imaplib.IMAP4_PORT)
+    conn.login(user, password)
+    return conn
+
+
+def load_imap_state(path=IMAP_STATE_PATH):
+    empty = {"mailbox": None, "uidvalidity": None, "last_uid": 0, "retry": {}}
+    if not os.path.exists(path):
+        return empty
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {**empty, **json.load(f)}
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Could not read {path}, starting over: {e}")
+        return empty
+
+
+def save_imap_state(state, path=IMAP_STATE_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def keep_for_retry(state, uids):
+    """
+    Fetches newsletters that didn't make it again on the next syncs; after
+    MAX_RETRIES tries a newsletter is given up on.
+    """
+    given_up = count_failure(state["retry"], uids, MAX_RETRIES, key=str)
+    if given_up:
+        print(
+            f"[WARN] Giving up on {len(given_up)} newsletter(s) after "
+            f"{MAX_RETRIES} tries: {', '.join(given_up)}"
+        )
+        count("imap.given_up", len(given_up))
+
+
+# --- FETCH responses ---
+def _line_tokens(line):
+    i, n = 0, len(line)
+    while i < n:
+        c = line[i : i + 1]
+        if c in (b" ", b"\r", b"\n"):
+            i += 1
+        elif c == b"(":
+            yield _OPEN
+            i += 1
+        elif c == b")":
+            yield _CLOSE
+            i += 1
+        elif c == b'"':
+            value = bytearray()
+            i += 1
+            while i < n and line[i : i + 1] != b'"':
+                if line[i : i + 1] == b"\\":
+                    i += 1
+                value += line[i : i + 1]
+                i += 1
+            yield value.decode("utf-8", "replace")
+            i += 1
+        else:
+            start = i
+            while i < n and line[i : i + 1] not in (b" ", b"(", b")"):
+                if line[i : i + 1] == b"[":  # BODY[HEADER.FIELDS (A B)] is one atom
+                    i = line.index(b"]", i)
+                i += 1
+            atom = line[start:i].decode("ascii", "replace")
+            yield None if atom.upper() == "NIL" else atom
+
+
+def _tokens(data):
+    """
+    Tokens of the response data imaplib returns: lines as bytes, and
+    (line ending in {size}, literal) tuples. Literals come out as bytes.
+    """
+    for item in data:
+        if isinstance(item, tuple):
+            head, literal = item
+            yield from _line_tokens(_LITERAL_RE.sub(b"", head))
+            yield literal
+        elif item:
+            yield from _line_tokens(item)
+
+
+def _read_list(tokens):
+    items = []
+    for token in tokens:
+        if token is _CLOSE:
+            return items
+        items.append(_read_list(tokens) if token is _OPEN else token)
+    return items
+
+
+def parse_fetch(data):
+    """
+    Yields one {item name: value} dict per message of a FETCH response, e.g.
+    {"UID": "12", "BODY[TEXT]": b"...", "BODYSTRUCTURE": [...]}.
+    """
+    tokens = _tokens(data)
+    for token in tokens:
+        if token is _OPEN:
+            items = _read_list(tokens)
+            yield {str(k).upper(): v for k, v in zip(items[::2], items[1::2])}
+
+
+def _uid_set(uids):
+    """
+    A compact UID set for a command: [1, 2, 3, 7] -> "1:3,7".
+    """
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def _uid_fetch(conn, uids, items, kind):
+    """
+    {uid: fetched items} of one UID FETCH.
+    """
+    with span("imap.fetch", kind=kind):
+        typ, data = conn.uid("FETCH", _uid_set(uids), items)
+    if typ != "OK":
+        raise conn.error(f"UID FETCH {kind} failed: {data}")
+    count(
+        "imap.fetch_bytes",
+        sum(len(item[1]) for item in data if isinstance(item, tuple)),
+        kind=kind,
+    )
+    return {int(msg["UID"]): msg for msg in parse_fetch(data) if "UID" in msg}
+
+
+def _section(msg, name):
+    # Servers echo sections upper-cased and may add an <origin>
+    for key, value in msg.items():
+        if key.startswith(name):
+            return value
+    return None
+
+
+# --- Mailbox ---
+def select_mailbox(conn, mailbox=MAILBOX):
+    """
+    Opens the mailbox read-only and returns its UIDVALIDITY.
+    """
+    typ, data = conn.select(mailbox, readonly=True)
+    if typ != "OK":
+        raise conn.error(f"Could not select {mailbox}: {data}")
+    _, (uidvalidity,) = conn.response("UIDVALIDITY")
+    return int(uidvalidity)
+
+
+def new_uids(conn, last_uid, criteria=None):
+    """
+    UIDs above last_uid, oldest first. `criteria` is an extra IMAP search
+    key, e.g. 'FROM "news@example.org"'.
+    """
+    query = f"UID {last_uid + 1}:*"
+    if criteria:
+        query += f" {criteria}"
+    with span("imap.search"):
+        typ, data = conn.uid("SEARCH", None, query)
+    if typ != "OK":
+        raise conn.error(f"UID SEARCH failed: {data}")
+    # "n:*" always matches the newest message, even when its UID is below n
+    return [uid for uid in map(int, data[0].split()) if uid > last_uid]
+
+
+def _headers(raw):
+    msg = email.message_from_bytes(raw or b"", policy=email.policy.default)
+    return {
+        name: str(msg.get(name, ""))
+        for name in ("Subject", "From", "List-Id", "List-Unsubscribe")
+    }
+
+
+def _text_part(structure, number="", subtype="plain"):
+    """
+    (part number, charset, transfer encoding, subtype) of the first text part
+    of `subtype` that isn't an attachment, from a BODYSTRUCTURE, or None.
+    """
+    if structure and isinstance(structure[0], list):
+        # Multipart: the parts, then the subtype and extension data
+        parts = []
+        for item in structure:
+            if not isinstance(item, list):
+                break
+            parts.append(item)
+        for i, part in enumerate(parts, start=1):
+            found = _text_part(part, f"{number}.{i}" if number else str(i), subtype)
+            if found:
+                return found
+        return None
+    if len(structure) < 7 or not all(isinstance(v, str) for v in structure[:2]):
+        return None
+    if (structure[0].lower(), structure[1].lower()) != ("text", subtype):
+        return None
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and str(disposition[0]).lower() == "attachment":
+        return None
+    params = structure[2] or []
+    params = {str(k).lower(): v for k, v in zip(params[::2], params[1::2])}
+    return (
+        number or "1",
+        params.get("charset") or "us-ascii",
+        (structure[5] or "7bit").lower(),
+        subtype,
+    )
+
+
+def _html_text(text):
+    text = _BREAK_RE.sub("\n", _HIDDEN_RE.sub("", text))
+    return html.unescape(_TAG_RE.sub("", text))
+
+
+def _decode_part(data, charset, encoding, subtype="plain"):
+    if encoding == "base64":
+        data = base64.b64decode(data)
+    elif encoding == "quoted-printable":
+        data = quopri.decodestring(data)
+    try:
+        text = data.decode(charset, "replace")
+    except LookupError:
+        text = data.decode("utf-8", "replace")
+    return _html_text(text) if subtype == "html" else text
+
+
+def fetch_newsletters(conn, uids, is_newsletter=None, batch_size=UID_BATCH_SIZE):
+    """
+    Yields (batch, [{"uid", "headers", "body"} for its newsletters], [UIDs
+    that couldn't be fetched]) for every batch of `uids`. Only the triage
+    headers of every message and the text part of the newsletters are
+    downloaded.
+    """
+    is_newsletter = is_newsletter or (
+        lambda headers: determineEmailType(headers["Subject"] or "No Subject", headers)
+    )
+    for i in range(0, len(uids), batch_size):
+        batch = uids[i : i + batch_size]
+        fetched = _uid_fetch(
+            conn,
+            batch,
+            f"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(TRIAGE_FIELDS)})])",
+            "headers",
+        )
+        count("imap.messages", len(fetched))
+        failed = [uid for uid in batch if uid not in fetched]
+        headers = {
+            uid: _headers(_section(msg, "BODY[HEADER.FIELDS"))
+            for uid, msg in fetched.items()
+        }
+        newsletters = [
+            uid for uid in batch if uid in headers and is_newsletter(headers[uid])
+        ]
+
+        # Newsletters sharing a part number (usually all of them) share a fetch
+        by_part = {}
+        if newsletters:
+            structures = _uid_fetch(
+                conn, newsletters, "(UID BODYSTRUCTURE)", "structure"
+            )
+            for uid in newsletters:
+                structure = structures.get(uid, {}).get("BODYSTRUCTURE")
+                if not structure:
+                    failed.append(uid)
+                    continue
+                part = _text_part(structure) or _text_part(structure, subtype="html")
+                if part is None:
+                    print(f"[WARN] Newsletter {uid} has no text part, skipping it.")
+                    count("imap.no_text_part")
+                    continue
+                by_part.setdefault(part, []).append(uid)
+
+        bodies = {}
+        for (number, charset, encoding, subtype), part_uids in by_part.items():
+            parts = _uid_fetch(conn, part_uids, f"(UID BODY.PEEK[{number}])", "body")
+            for uid in part_uids:
+                data = _section(parts.get(uid, {}), f"BODY[{number}]")
+                if data:
+                    bodies[uid] = _decode_part(data, charset, encoding, subtype)
+                else:
+                    failed.append(uid)
+        count("imap.newsletters", len(bodies))
+        yield batch, [
+            {"uid": uid, "headers": headers[uid], "body": bodies[uid]}
+            for uid in newsletters
+            if uid in bodies
+        ], failed
+
+
+# --- IDLE ---
+class _IdleReader:
+    """
+    Reads response lines straight off the socket while idling: imaplib's
+    buffered file can't be read with a timeout without breaking it.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+
+    def readline(self, deadline):
+        while b"\r\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError
+            self.sock.settimeout(remaining)
+            data = self.sock.recv(4096)
+            if not data:
+                raise imaplib.IMAP4.abort("Connection closed while idling")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\r\n", 1)
+        return line
+
+
+def wait_for_mail(conn, timeout=IDLE_TIMEOUT):
+    """
+    IMAP IDLE (RFC 2177): blocks until the server reports new mail (an EXISTS
+    response) or `timeout` seconds pass. Returns True for new mail. Servers
+    without IDLE are polled every POLL_INTERVAL seconds instead. (imaplib has
+    no IDLE before Python 3.14, so the command is sent by hand.)
+    """
+    if "IDLE" not in conn.capabilities:
+        time.sleep(min(timeout, POLL_INTERVAL))
+        return True
+
+    reader = _IdleReader(conn.sock)
+    previous_timeout = conn.sock.gettimeout()
+    tag = conn._new_tag()
+    new_mail = False
+    try:
+        with span("imap.idle"):
+            conn.send(tag + b" IDLE\r\n")
+            deadline = time.monotonic() + timeout
+            line = reader.readline(deadline)
+            if not line.startswith(b"+"):
+                raise conn.error(f"IDLE refused: {line!r}")
+            try:
+                while not new_mail:
+                    line = reader.readline(deadline)
+                    if line.startswith(b"* BYE"):
+                        raise conn.abort(f"Server closed the connection: {line!r}")
+                    new_mail = line.startswith(b"* ") and line.endswith(b" EXISTS")
+            except TimeoutError:
+                pass
+            conn.send(b"DONE\r\n")
+            while True:
+                line = reader.readline(time.monotonic() + 60)
+                if line.startswith(tag + b" "):
+                    if not line[len(tag) + 1 :].upper().startswith(b"OK"):
+                        raise conn.error(f"IDLE failed: {line!r}")
+                    break
+    finally:
+        conn.sock.settimeout(previous_timeout)
+    count("imap.idle_wakeups" if new_mail else "imap.idle_timeouts")
+    return new_mail
+
+
+# --- Ingestion ---
+def sync_mailbox(
+    conn,
+    state,
+    event_store,
+    mailbox=MAILBOX,
+    criteria=None,
+    client=None,
+    is_newsletter=None,
+    state_path=IMAP_STATE_PATH,
+    max_initial=INITIAL_MESSAGES,
+):
+    """
+    Extracts and stores the events of every newsletter that arrived since the
+    saved UID. The UID is saved after each batch, once all of its newsletters
+    are stored; the ones that couldn't be fetched or extracted are kept for
+    retry (see keep_for_retry()) and fetched again on the next syncs. Unless
+    `is_newsletter` is given, newsletters are triaged again with their body
+    before the model sees them, and what the model found is fed back to
+    triage.py. Returns {uid: extracted events}.
+    """
+    triage = get_triage()
+    uidvalidity = select_mailbox(conn, mailbox)
+    if (state["mailbox"], state["uidvalidity"]) != (mailbox, uidvalidity):
+        if state["uidvalidity"] is not None:
+            print(f"[WARN] UIDVALIDITY of {mailbox} changed, saved UIDs are void.")
+        print(f"[DEBUG] No saved UID, processing the newest {max_initial} message(s).")
+        uids = new_uids(conn, 0, criteria)[-max_initial:]
+        state.update(mailbox=mailbox, uidvalidity=uidvalidity, last_uid=0, retry={})
+    else:
+        uids = new_uids(conn, state["last_uid"], criteria)
+    print(f"[DEBUG] {len(uids)} new message(s) in {mailbox}.")
+    fetched = set(uids)
+    retry = sorted(int(uid) for uid in state["retry"] if int(uid) not in fetched)
+    if retry:
+        print(f"[DEBUG] Retrying {len(retry)} unfinished newsletter(s).")
+        uids = retry + uids
+
+    results = {}
+
+    def finish(batch, futures, failed):
+        failed = list(failed)
+        for item, future in futures:
+            uid = item["uid"]
+            try:
+                events = future.result()
+            except Exception as e:
+                print(f"[ERROR] Extracting newsletter {uid} failed: {e}")
+                count("imap.failed")
+                failed.append(uid)
+                continue
+            results[uid] = events
+            if is_newsletter is None:
+                triage.learn(
+                    item["headers"], item["body"][:BODY_SCAN_CHARS], bool(events)
+                )
+            print(f"[DEBUG] {len(events)} event(s) from message {uid}")
+            event_store.upsert(
+                NEWSLETTER_SOURCE,
+                [newsletter_event(event, f"imap:{uid}") for event in events],
+                newsletter_event_key,
+            )
+        for uid in set(batch) - set(failed):
+            state["retry"].pop(str(uid), None)
+        keep_for_retry(state, failed)
+        state["last_uid"] = max(state["last_uid"], batch[-1])
+        save_imap_state(state, state_path)
+        if is_newsletter is None:
+            triage.save()
+
+    # The model works on one batch while the next one downloads
+    pending = None
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        for batch, newsletters, failed in fetch_newsletters(conn, uids, is_newsletter):
+            if is_newsletter is None:
+                kept = [
+                    item
+                    for item in newsletters
+                    if determineEmailType(
+                        item["headers"]["Subject"], item["headers"], item["body"]
+                    )
+                ]
+                count("imap.skipped", len(newsletters) - len(kept))
+                newsletters = kept
+            futures = [
+                (item, executor.submit(parseStuff, item["body"], client))
+                for item in newsletters
+            ]
+            if pending:
+                finish(*pending)
+            pending = batch, futures, failed
+        if pending:
+            finish(*pending)
+    return results
+
+
+def run(
+    conn,
+    mailbox=MAILBOX,
+    idle=False,
+    criteria=None,
+    client=None,
+    is_newsletter=None,
+    state_path=IMAP_STATE_PATH,
+    store_path=EVENT_STORE_PATH,
+):
+    """
+    Syncs the mailbox once, or with idle=True keeps syncing whenever new
+    mail arrives.
+    """
+    state = load_imap_state(state_path)
+    event_store = EventStore(store_path)
+    try:
+        while True:
+            results = sync_mailbox(
+                conn,
+                state,
+                event_store,
+                mailbox,
+                criteria,
+                client,
+                is_newsletter,
+                state_path,
+            )
+            if results:
+                publish_events(event_store)
+            if not idle:
+                return results
+            print("[DEBUG] Waiting for new mail (IDLE)...")
+            while not wait_for_mail(conn):
+                pass
+    finally:
+        event_store.close()
+
+
+def _benchmark(messages):
+    """
+    The old way (an RFC822 fetch per message, all kept in memory) against
+    sync_mailbox() on fake_imap.py. The stub model answers instantly, so
+    both runs time the IMAP side only.
+    """
+    import tempfile
+    import tracemalloc
+
+    import quickstart
+    from cache_store import SqliteCache
+    from fake_imap import FakeImapServer
+    from rate_limit import MODEL_HOST, set_policy
+    from stub_model import StubGenaiClient
+
+    set_policy(MODEL_HOST, 1000, 1000)
+    tmp = tempfile.mkdtemp()
+    quickstart.extraction_cache = SqliteCache(
+        os.path.join(tmp, "bench_cache.sqlite3"), table="extractions"
+    )
+    quiet = lambda headers: any(
+        w in headers["Subject"].lower()
+        for w in ("weekly", "monthly", "newsletter", "digest", "highlights")
+    )
+    server = FakeImapServer.with_sample_mailbox(messages).start()
+
+    def measure(fn):
+        before = dict(server.stats["commands"]), server.stats["bytes_sent"]
+        conn = connect("me", "pw", server.host, server.port, ssl=False)
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            fn(conn)
+        finally:
+            seconds = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            conn.logout()
+        commands = sum(server.stats["commands"].values()) - sum(before[0].values())
+        return seconds, commands, server.stats["bytes_sent"] - before[1], peak
+
+    def old(conn):
+        conn.select("Inbox")
+        _, data = conn.search(None, "ALL")
+        msgs = []
+        for num in data[0].split():
+            _, data = conn.fetch(num, "(RFC822)")
+            msgs.append(data)
+
+    def new(conn):
+        state = load_imap_state(os.path.join(tmp, "missing.json"))
+        store = EventStore(os.path.join(tmp, "events.sqlite3"))
+        try:
+            sync_mailbox(
+                conn,
+                state,
+                store,
+                client=StubGenaiClient(latency=0, per_token_latency=0),
+                is_newsletter=quiet,
+                state_path=os.path.join(tmp, "imap_state.json"),
+                max_initial=messages,
+            )
+        finally:
+            store.close()
+
+    try:
+        for name, fn in (("RFC822 per message", old), ("streaming", new)):
+            seconds, commands, sent, peak = measure(fn)
+            print(
+                f"[BENCH] {messages} messages, {name}: {seconds:.2f}s, "
+                f"{commands} commands, {sent / 1024:.0f} KiB downloaded, "
+                f"Python peak {peak / 1024:.0f} KiB"
+            )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Newsletter ingestion over IMAP.")
+    parser.add_argument("--host", default=IMAP_URL)
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--no-ssl", action="store_true", help="for local test servers")
+    parser.add_argument("--mailbox", default=MAILBOX)
+    parser.add_argument("--from", dest="sender", help="only mail from this sender")
+    parser.add_argument("--idle", action="store_true", help="keep waiting for new mail")
+    parser.add_argument("--credentials", default="credentials.yml")
+    parser.add_argument("--user", help="instead of the credentials file")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--bench", type=int, metavar="MESSAGES")
+    args = parser.parse_args()
+
+    if args.bench:
+        _benchmark(args.bench)
+    else:
+        if args.user:
+            user, password = args.user, args.password
+        else:
+            user, password = load_credentials(args.credentials)
+        my_mail = connect(user, password, args.host, args.port, ssl=not args.no_ssl)
+        try:
+            run(
+                my_mail,
+                args.mailbox,
+                idle=args.idle,
+                criteria=f'FROM "{args.sender}"' if args.sender else None,
+            )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            my_mail.logout()
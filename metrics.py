@@ -0,0 +1,199 @@
+"""
+Timers and counters for the scrapers, geocoding, Gmail and the model.
+
+Off unless the EVENT_METRICS environment variable names an output file:
+
+    EVENT_METRICS=metrics.json python scr.py           # JSON when the run ends
+    EVENT_METRICS=metrics.prom python quickstart.py    # Prometheus text format
+
+Instrumented code uses two calls:
+
+    with span("scrape.navigate", source="Mass Audubon"):
+        page.goto(url)
+    count("geocode.cache_hits")
+
+Spans record how many times a block ran and its total and max wall time;
+counters add up. Both can carry labels (keep them low-cardinality: a source
+name, not a URL). When metrics are off, span() hands back one shared no-op
+context manager and count() returns right away, so the calls can stay on hot
+paths.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+METRICS_ENV = "EVENT_METRICS"
+PROMETHEUS_PREFIX = "events_"
+
+_enabled = False
+_lock = threading.Lock()
+_spans = {}  # (name, labels) -> [count, total seconds, max seconds]
+_counters = {}  # (name, labels) -> value
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("key", "started")
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        with _lock:
+            stats = _spans.get(self.key)
+            if stats is None:
+                _spans[self.key] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+        return False
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def span(name, **labels):
+    """
+    Times the `with` block under `name`. Exceptions pass through and the
+    time is still recorded.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(_key(name, labels))
+
+
+def count(name, n=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def enabled():
+    return _enabled
+
+
+def enable(path=None):
+    """
+    Turns metrics on. With a path, they are written there when the process
+    exits (see write_metrics).
+    """
+    global _enabled
+    _enabled = True
+    if path:
+        atexit.register(write_metrics, path)
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def snapshot():
+    """
+    Everything recorded so far as plain data (the JSON export).
+    """
+    with _lock:
+        spans = [
+            {
+                "name": name,
+                "labels": dict(labels),
+                "count": stats[0],
+                "total_ms": round(stats[1] * 1000, 3),
+                "mean_ms": round(stats[1] / stats[0] * 1000, 3),
+                "max_ms": round(stats[2] * 1000, 3),
+            }
+            for (name, labels), stats in sorted(_spans.items())
+        ]
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+    return {"spans": spans, "counters": counters}
+
+
+def _prometheus_name(name):
+    return PROMETHEUS_PREFIX + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def prometheus_text():
+    """
+    The Prometheus text exposition format: spans as summaries (_count and
+    _sum in seconds) plus a _max gauge, counters as counters (_total).
+    """
+    data = snapshot()
+    families = {}  # metric name -> (type, sample lines); one group per name
+    for s in data["spans"]:
+        name = _prometheus_name(s["name"]) + "_seconds"
+        labels = _prometheus_labels(s["labels"])
+        families.setdefault(name, ("summary", []))[1].extend(
+            [
+                f"{name}_count{labels} {s['count']}",
+                f"{name}_sum{labels} {s['total_ms'] / 1000:.6f}",
+            ]
+        )
+        families.setdefault(f"{name}_max", ("gauge", []))[1].append(
+            f"{name}_max{labels} {s['max_ms'] / 1000:.6f}"
+        )
+    for c in data["counters"]:
+        name = _prometheus_name(c["name"]) + "_total"
+        families.setdefault(name, ("counter", []))[1].append(
+            f"{name}{_prometheus_labels(c['labels'])} {c['value']}"
+        )
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    """
+    Writes the metrics to `path`: Prometheus text for *.prom / *.txt files
+    (e.g. for node_exporter's textfile collector), JSON otherwise.
+    """
+    if path.endswith((".prom", ".txt")):
+        content = prometheus_text()
+    else:
+        content = json.dumps(snapshot(), indent=2)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    print(f"[DEBUG] Metrics written to {path}")
+
+
+if os.environ.get(METRICS_ENV):
+    enable(os.environ[METRICS_ENV])
@@ -0,0 +1,487 @@
+"""
+Streaming newsletter pipeline: fetch -> triage -> extract -> store.
+
+Each stage runs in its own thread(s) and hands work to the next one through a
+bounded queue, so Gmail I/O and model calls overlap instead of running one
+after the other:
+
+- fetch:   metadata-only batch fetches of the message headers
+- triage:  determineEmailType() on the headers (triage.py); newsletter bodies
+           are then fetched in small batches, triaged again with the body and
+           pre-processed (newsletter_prep.py)
+- extract: a few workers calling the model, rate limited and retried with
+           backoff (rate_limit.py). Several small newsletters are packed into
+           one request whose events come back tagged with their message_id.
+- store:   hands every message's events to a callback and tells triage
+           whether the newsletter had any
+
+A message is finished once triage skipped it or its events were stored.
+Everything else - a failed fetch (even a non-transient one), an extraction
+that was given up on, a store callback that raised - is reported back as
+unfinished, so the caller can try it again on its next run.
+
+Run `python newsletter_pipeline.py --bench` to time it offline against the fake
+Gmail service and the stub model.
+"""
+
+import json
+import queue
+import threading
+import time
+
+from gmail_fetch import (
+    BATCH_SIZE,
+    FULL_FIELDS,
+    METADATA_FIELDS,
+    TRIAGE_HEADERS,
+    batch_get_messages,
+    get_header,
+    triage_headers,
+)
+from metrics import count, span
+from newsletter_prep import prepare_newsletter, restore_links
+from rate_limit import MODEL_HOST, call, http_status, is_transient, with_retries
+from triage import BODY_SCAN_CHARS, get_triage
+from quickstart import (
+    MISSING,
+    MODEL,
+    EXTRACTION_CACHE_TTL,
+    Rating,
+    determineEmailType,
+    extract_prepared,
+    extraction_cache,
+    extraction_cache_key,
+    extraction_cache_stats,
+    get_genai_client,
+    get_message_body,
+)
+
+QUEUE_SIZE = 50  # Max items waiting between two stages
+BODY_BATCH_SIZE = 20  # Newsletter bodies fetched per batch request
+EXTRACT_WORKERS = 4
+
+# Newsletters up to this size can be packed together, up to PACK_MAX_TOKENS
+PACK_MAX_MESSAGE_TOKENS = 800
+PACK_MAX_TOKENS = 3000
+PACK_MAX_MESSAGES = 5
+
+_DONE = object()  # End-of-stream marker passed down the queues
+
+
+class TaggedRating(Rating):
+    message_id: str
+
+
+class _CountedModels:
+    def __init__(self, models, on_call):
+        self._models = models
+        self._on_call = on_call
+
+    def generate_content(self, **kwargs):
+        self._on_call()
+        return self._models.generate_content(**kwargs)
+
+
+class CountingClient:
+    """
+    Wraps a genai client to count its generate_content() calls.
+    """
+
+    def __init__(self, client, on_call):
+        self.models = _CountedModels(client.models, on_call)
+
+
+def _is_bad_response(error):
+    """
+    Failures worth redoing a whole message for, like a reply that isn't valid
+    JSON. Transient request errors were already retried by rate_limit.call(),
+    and other HTTP errors (400, 403) won't go away.
+    """
+    return http_status(error) is None and not is_transient(error)
+
+
+def _is_packable(prepared):
+    return (
+        len(prepared["chunks"]) == 1
+        and prepared["tokens_after"] <= PACK_MAX_MESSAGE_TOKENS
+    )
+
+
+def extract_packed(items, client):
+    """
+    One model request for several small newsletters. Returns
+    {message id: events}. Every message's result is also cached on its own,
+    the same way extract_events() would have cached it.
+    """
+    sections = "\n\n".join(
+        f"=== MESSAGE {item['id']} ===\n{item['prepared']['chunks'][0]}"
+        for item in items
+    )
+    with span("model.generate", kind="packed"):
+        response = call(
+            MODEL_HOST,
+            lambda: client.models.generate_content(
+                model=MODEL,
+                contents=f"Each section below is a separate newsletter, starting with a line '=== MESSAGE <id> ==='. Parse out any events in them (return nothing for a newsletter without events) and give them the most appropriate age rating based on the context. Also provide the link to the event (links are written as placeholders like <LINK1>, copy the placeholder exactly), the location, a one or two sentence description of the event in the newsletter's words, and the message_id of the newsletter the event came from.\n\n{sections}",
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": list[TaggedRating],
+                },
+            ),
+            "Packed model call",
+        )
+    by_message = {item["id"]: [] for item in items}
+    for event in json.loads(response.text) if response.text else []:
+        msg_id = event.pop("message_id", None)
+        if msg_id in by_message:
+            by_message[msg_id].append(event)
+
+    for item in items:
+        key = extraction_cache_key(item["prepared"]["chunks"][0])
+        extraction_cache.set(key, by_message[item["id"]], EXTRACTION_CACHE_TTL)
+    return {
+        item["id"]: restore_links(by_message[item["id"]], item["prepared"]["links"])
+        for item in items
+    }
+
+
+class NewsletterPipeline:
+    def __init__(
+        self,
+        service,
+        http_factory=None,
+        client=None,
+        store=None,
+        is_newsletter=None,
+        extract_workers=EXTRACT_WORKERS,
+        pack=True,
+    ):
+        self.service = service
+        self.http_factory = http_factory
+        self.client = CountingClient(
+            client or get_genai_client(), on_call=lambda: self._count("model_calls")
+        )
+        self.store = store
+        # A custom is_newsletter replaces both triage stages
+        self.check_body = is_newsletter is None
+        self.is_newsletter = is_newsletter or (
+            lambda msg: determineEmailType(
+                get_header(msg, "Subject", "No Subject"), triage_headers(msg)
+            )
+        )
+        self.triage = get_triage()
+        self._examined = {}  # message id -> (headers, start of body) for learning
+        self.extract_workers = extract_workers
+        self.pack = pack
+
+        self.triage_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.extract_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.store_q = queue.Queue(maxsize=QUEUE_SIZE)
+        self.results = {}
+        self.finished = set()  # Skipped by triage or stored
+        self.stats = {
+            "messages": 0,
+            "newsletters": 0,
+            "skipped": 0,
+            "model_calls": 0,
+            "failed": 0,
+        }
+        self._stats_lock = threading.Lock()
+
+    def _finish(self, msg_id):
+        with self._stats_lock:
+            self.finished.add(msg_id)
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+        count(f"pipeline.{name}", n)
+
+    # --- fetch ---
+    def _fetch(self, message_ids):
+        try:
+            for i in range(0, len(message_ids), BATCH_SIZE):
+                chunk = message_ids[i : i + BATCH_SIZE]
+                headers = batch_get_messages(
+                    self.service,
+                    chunk,
+                    fmt="metadata",
+                    metadata_headers=TRIAGE_HEADERS,
+                    fields=METADATA_FIELDS,
+                    http_factory=self.http_factory,
+                    max_workers=1,
+                )
+                for msg_id in chunk:
+                    if msg_id in headers:
+                        self.triage_q.put(headers[msg_id])
+        finally:
+            self.triage_q.put(_DONE)
+
+    # --- triage ---
+    def _triage(self):
+        pending = []
+        try:
+            while True:
+                msg = self.triage_q.get()
+                if msg is _DONE:
+                    break
+                self._count("messages")
+                if self.is_newsletter(msg):
+                    pending.append(msg["id"])
+                else:
+                    self._finish(msg["id"])
+                if len(pending) >= BODY_BATCH_SIZE or (
+                    pending and self.triage_q.empty()
+                ):
+                    self._fetch_bodies(pending)
+                    pending = []
+            if pending:
+                self._fetch_bodies(pending)
+        finally:
+            for _ in range(self.extract_workers):
+                self.extract_q.put(_DONE)
+
+    def _fetch_bodies(self, ids):
+        full = batch_get_messages(
+            self.service,
+            ids,
+            fmt="full",
+            fields=FULL_FIELDS,
+            http_factory=self.http_factory,
+            max_workers=1,
+        )
+        for msg_id in ids:
+            if msg_id not in full:
+                continue
+            body = get_message_body(full[msg_id]["payload"]) or ""
+            headers = triage_headers(full[msg_id])
+            if self.check_body and not determineEmailType(
+                headers["Subject"], headers, body
+            ):
+                self._count("skipped")
+                self._finish(msg_id)
+                continue
+            self._count("newsletters")
+            self._examined[msg_id] = (headers, body[:BODY_SCAN_CHARS])
+            self.extract_q.put({"id": msg_id, "prepared": prepare_newsletter(body)})
+
+    # --- extract ---
+    def _next_pack(self, first):
+        """
+        Adds more small, uncached newsletters from the queue to `first`.
+        Returns (pack, saw_done).
+        """
+        pack = [first]
+        tokens = first["prepared"]["tokens_after"]
+        while len(pack) < PACK_MAX_MESSAGES:
+            try:
+                item = self.extract_q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return pack, True
+            fits = (
+                _is_packable(item["prepared"])
+                and tokens + item["prepared"]["tokens_after"] <= PACK_MAX_TOKENS
+            )
+            if not fits or self._cached(item):
+                self._extract_single(item)
+                continue
+            pack.append(item)
+            tokens += item["prepared"]["tokens_after"]
+        return pack, False
+
+    def _cached(self, item):
+        chunks = item["prepared"]["chunks"]
+        return all(
+            extraction_cache.get(extraction_cache_key(chunk)) is not MISSING
+            for chunk in chunks
+        )
+
+    def _extract_single(self, item):
+        try:
+            # Chunks that already succeeded are cached, so a retry only redoes the rest
+            events = with_retries(
+                lambda: extract_prepared(item["prepared"], self.client),
+                f"Extraction for message {item['id']}",
+                retry_if=_is_bad_response,
+            )
+        except Exception as e:
+            print(f"[ERROR] Giving up on message {item['id']}: {e}")
+            self._count("failed")
+            return
+        self.store_q.put((item["id"], events))
+
+    def _extract_pack(self, pack):
+        try:
+            extraction_cache_stats["misses"] += len(pack)
+            count("model.cache_misses", len(pack))
+            by_message = with_retries(
+                lambda: extract_packed(pack, self.client),
+                f"Packed extraction for {len(pack)} messages",
+                retry_if=_is_bad_response,
+            )
+        except Exception as e:
+            print(f"[WARN] Packed extraction failed ({e}), extracting one by one")
+            for item in pack:
+                self._extract_single(item)
+            return
+        for item in pack:
+            self.store_q.put((item["id"], by_message[item["id"]]))
+
+    def _extract(self):
+        while True:
+            item = self.extract_q.get()
+            if item is _DONE:
+                break
+            if (
+                not self.pack
+                or not _is_packable(item["prepared"])
+                or self._cached(item)
+            ):
+                self._extract_single(item)
+                continue
+            pack, saw_done = self._next_pack(item)
+            if len(pack) == 1:
+                self._extract_single(item)
+            else:
+                self._extract_pack(pack)
+            if saw_done:
+                break
+
+    # --- store ---
+    def _store(self):
+        while True:
+            item = self.store_q.get()
+            if item is _DONE:
+                return
+            msg_id, events = item
+            self.results[msg_id] = events
+            examined = self._examined.pop(msg_id, None)
+            if examined:
+                self.triage.learn(*examined, bool(events))
+            if self.store:
+                try:
+                    self.store(msg_id, events)
+                except Exception as e:
+                    print(f"[ERROR] Storing events of message {msg_id} failed: {e}")
+                    continue
+            self._finish(msg_id)
+
+    def run(self, message_ids):
+        fetcher = threading.Thread(target=self._fetch, args=(message_ids,))
+        triager = threading.Thread(target=self._triage)
+        extractors = [
+            threading.Thread(target=self._extract) for _ in range(self.extract_workers)
+        ]
+        storer = threading.Thread(target=self._store)
+
+        for thread in [fetcher, triager, *extractors, storer]:
+            thread.start()
+        for thread in [fetcher, triager, *extractors]:
+            thread.join()
+        self.store_q.put(_DONE)
+        storer.join()
+        return self.results
+
+    def unfinished(self, message_ids):
+        return [msg_id for msg_id in message_ids if msg_id not in self.finished]
+
+
+def run_pipeline(service, message_ids, **kwargs):
+    """
+    Runs message_ids through the pipeline. Returns ({message id: events}, IDs
+    of the unfinished messages). Keyword arguments are passed to
+    NewsletterPipeline.
+    """
+    pipeline = NewsletterPipeline(service, **kwargs)
+    started = time.perf_counter()
+    results = pipeline.run(message_ids)
+    unfinished = pipeline.unfinished(message_ids)
+    print(
+        f"[DEBUG] Pipeline: {pipeline.stats['messages']} messages, "
+        f"{pipeline.stats['newsletters']} newsletters "
+        f"({pipeline.stats['skipped']} more skipped after reading the body), "
+        f"{pipeline.stats['model_calls']} model calls, "
+        f"{pipeline.stats['failed']} failed, {len(unfinished)} unfinished, "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+    return results, unfinished
+
+
+def _benchmark(messages, model_latency, gmail_latency, failure_rate):
+    import os
+    import tempfile
+
+    import quickstart
+    from cache_store import SqliteCache
+    from fake_gmail import FakeGmailService
+    from rate_limit import GMAIL_HOST, set_policy
+    from stub_model import StubGenaiClient
+
+    def fresh_cache():
+        # Every run starts cold so the numbers compare model time, not cache hits
+        path = os.path.join(tempfile.mkdtemp(), "bench_cache.sqlite3")
+        cache = SqliteCache(path, table="extractions")
+        quickstart.extraction_cache = cache
+        globals()["extraction_cache"] = cache
+
+    # Time our own code, not the real services' quotas
+    set_policy(MODEL_HOST, 1000, 1000)
+    set_policy(GMAIL_HOST, 100000, 100000)
+    service = FakeGmailService.with_sample_mailbox(messages, latency=gmail_latency)
+    message_ids = service.order[:messages]
+    quiet = lambda msg: any(
+        w in get_header(msg, "Subject", "").lower()
+        for w in ("weekly", "monthly", "newsletter", "digest", "highlights")
+    )
+
+    fresh_cache()
+    client = StubGenaiClient(latency=model_latency, failure_rate=failure_rate)
+    started = time.perf_counter()
+    for msg_id in message_ids:
+        msg = service.users().messages().get(userId="me", id=msg_id).execute()
+        if quiet(msg):
+            try:
+                quickstart.parseStuff(get_message_body(msg["payload"]), client)
+            except Exception as e:
+                print(f"[WARN] Serial extraction failed: {e}")
+    serial = time.perf_counter() - started
+    serial_calls = client.calls
+
+    fresh_cache()
+    client = StubGenaiClient(latency=model_latency, failure_rate=failure_rate)
+    started = time.perf_counter()
+    run_pipeline(
+        service,
+        message_ids,
+        client=client,
+        is_newsletter=quiet,
+    )
+    pipelined = time.perf_counter() - started
+
+    print(
+        f"[BENCH] {messages} messages: serial {serial:.2f}s ({serial_calls} model calls), "
+        f"pipeline {pipelined:.2f}s ({client.calls} model calls)"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Newsletter extraction pipeline.")
+    parser.add_argument(
+        "--bench", action="store_true", help="run the offline benchmark"
+    )
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--model-latency", type=float, default=0.2)
+    parser.add_argument("--gmail-latency", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.bench:
+        _benchmark(
+            args.messages, args.model_latency, args.gmail_latency, args.failure_rate
+        )
+    else:
+        parser.print_help()
@@ -0,0 +1,218 @@
+"""
+Shrinks newsletter bodies before they are sent to the model.
+
+Most of a newsletter email is noise for event extraction: unsubscribe/legal
+footers, quoted replies, the same header repeated in every section, and long
+tracking URLs. prepare_newsletter() removes that, swaps every URL for a short
+placeholder such as <LINK3> (restore_links() maps them back into the extracted
+event_link), and splits long newsletters into event-sized chunks that can be
+extracted in parallel.
+"""
+
+import re
+
+from metrics import count
+
+# Rough size of a model token, good enough to report savings
+CHARS_PER_TOKEN = 4
+# Upper bound for one chunk sent to the model
+MAX_CHUNK_TOKENS = 1500
+
+_URL_RE = re.compile(r"<?(https?://[^\s<>\"')\]]+)>?")
+_PLACEHOLDER_RE = re.compile(r"<LINK\d+>")
+
+# Lines that start the footer; everything after the first one is dropped
+_FOOTER_RE = re.compile(
+    r"^\s*("
+    r"unsubscribe|to unsubscribe|you are receiving this|you received this"
+    r"|this email was sent to|update your (email )?preferences|manage (your )?preferences"
+    r"|view (this email )?in (your )?browser|privacy policy|copyright|©|\(c\) \d{4}"
+    r"|sent from my|-- ?$"
+    r")",
+    re.IGNORECASE,
+)
+# Single boilerplate lines that can appear anywhere
+_BOILERPLATE_LINE_RE = re.compile(
+    r"^\s*("
+    r"view (this email )?(online|in (your )?browser)|forward to a friend"
+    r"|follow us on|share on (facebook|twitter|x)|add us to your address book"
+    r"|having trouble viewing|if you can't see this email"
+    r")",
+    re.IGNORECASE,
+)
+# "On Mon, Jul 21, 2025 at 10:00 AM Someone <a@b.c> wrote:" starts a quoted reply
+_QUOTE_HEADER_RE = re.compile(r"^\s*On .{5,200} wrote:\s*$")
+
+
+def estimate_tokens(text):
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+# Decorative rules like "-----", "=====" or "* * *"
+_RULE_RE = re.compile(r"^[-=*_~#\s]{3,}$")
+# Section headings newsletters repeat in every section
+_SECTION_HEADER_RE = re.compile(
+    r"^\W*("
+    r"upcoming events|upcoming programs|events|programs|news|announcements"
+    r"|in this issue|featured|featured events|highlights|don't miss|save the date"
+    r"|register now|learn more|read more|more info|back to top"
+    r")\W*$",
+    re.IGNORECASE,
+)
+# Dates, times and prices are event details, however often they repeat
+_DATE_WORD_RE = re.compile(
+    r"\b(mon|tue|wed|thu|fri|sat|sun|jan|feb|mar|apr|may|jun|jul|aug|sep|oct"
+    r"|nov|dec)[a-z]*\b|\b(today|tomorrow|tonight)\b",
+    re.IGNORECASE,
+)
+
+
+def _is_banner(line):
+    if any(c.isdigit() for c in line) or _DATE_WORD_RE.search(line):
+        return False
+    return bool(_RULE_RE.match(line) or _SECTION_HEADER_RE.match(line))
+
+
+def strip_boilerplate(text):
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    kept = []
+    seen = set()
+    for i, line in enumerate(lines):
+        if _QUOTE_HEADER_RE.match(line):
+            break
+        # Footers don't count near the top, so an early "Privacy" heading survives
+        if _FOOTER_RE.match(line) and i >= len(lines) // 3:
+            break
+        if line.lstrip().startswith(">") or _BOILERPLATE_LINE_RE.match(line):
+            continue
+        # Decorative rules and known section headings repeated in every section
+        # are kept once. Anything else can legitimately repeat ("Ages 4-10",
+        # "SATURDAY, JULY 26", "$15").
+        normalized = " ".join(line.split())
+        if normalized and _is_banner(normalized):
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def collapse_whitespace(text):
+    text = re.sub(r"[ \t\u00a0]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def shorten_links(text):
+    """
+    Replaces every URL with a placeholder. The same URL always gets the same
+    placeholder. Returns (text, {placeholder: url}).
+    """
+    links = {}
+    by_url = {}
+
+    def replace(match):
+        url = match.group(1).rstrip(".,;:")
+        if url not in by_url:
+            placeholder = f"<LINK{len(by_url) + 1}>"
+            by_url[url] = placeholder
+            links[placeholder] = url
+        return by_url[url]
+
+    return _URL_RE.sub(replace, text), links
+
+
+def restore_links(events, links):
+    """
+    Puts the real URLs back into extracted events (in place) and returns them.
+    """
+    for event in events:
+        for field, value in event.items():
+            if isinstance(value, str) and "<LINK" in value:
+                event[field] = _PLACEHOLDER_RE.sub(
+                    lambda m: links.get(m.group(0), m.group(0)), value
+                )
+    return events
+
+
+def _cut(text, max_chars):
+    """
+    Pieces of at most max_chars, cut at the last space before the limit when
+    there is one (so <LINKn> placeholders stay whole).
+    """
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 1, max_chars + 1)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip(" ")
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def _split_block(block, max_chars):
+    """
+    A block too big for one chunk, split on its lines and, for lines that are
+    too long on their own, inside them.
+    """
+    if len(block) <= max_chars:
+        return [block]
+    pieces = []
+    current = ""
+    for line in block.split("\n"):
+        for part in _cut(line, max_chars):
+            if current and len(current) + 1 + len(part) > max_chars:
+                pieces.append(current)
+                current = ""
+            current = f"{current}\n{part}" if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_chunks(text, max_tokens=MAX_CHUNK_TOKENS):
+    """
+    Splits on blank lines (newsletters usually put one event per block) and
+    packs consecutive blocks into chunks of at most max_tokens. Blocks that
+    are bigger than that on their own are split on lines first.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = ""
+    for block in text.split("\n\n"):
+        for piece in _split_block(block, max_chars):
+            if current and len(current) + 2 + len(piece) > max_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def prepare_newsletter(body, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    """
+    Returns {"chunks": [...], "links": {placeholder: url},
+    "tokens_before": n, "tokens_after": n}. The token counts are also added
+    to the newsletter.tokens_before/tokens_after counters (see metrics.py).
+    """
+    body = body or ""
+    text = strip_boilerplate(body)
+    text, links = shorten_links(text)
+    text = collapse_whitespace(text)
+    chunks = split_chunks(text, max_chunk_tokens) if text else []
+
+    tokens_before = estimate_tokens(body)
+    tokens_after = sum(estimate_tokens(chunk) for chunk in chunks)
+    count("newsletter.tokens_before", tokens_before)
+    count("newsletter.tokens_after", tokens_after)
+    count("newsletter.chunks", len(chunks))
+    return {
+        "chunks": chunks,
+        "links": links,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+    }
@@ -0,0 +1,256 @@
+"""
+Turns the free-text `date` and `ages` of an event into typed fields, once,
+when events are written:
+
+    "Thursday, July 24\n\n1:00-3:00pm"   -> start "2025-07-24T13:00", end "2025-07-24T15:00"
+    "JUL 23 — 7:00 pm - 9:00 pm"        -> start "2025-07-23T19:00", end "2025-07-23T21:00"
+    "Families - children 2 - 16 years"  -> age_min 2, age_max 16
+    "3-6" (quickstart.Age values)       -> age_min 3, age_max 6
+
+The original strings are kept for display. Anything that can't be parsed gets
+None, so the search API can tell "unknown" from a real value.
+"""
+
+import re
+from datetime import date, datetime, timedelta
+
+MAX_AGE = 99
+_EPOCH = datetime(1970, 1, 1)
+# A listed date this long ago is assumed to be next year's (listings have no year)
+PAST_DATE_GRACE = timedelta(days=60)
+
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}  # fmt: skip
+_MONTH_DAY_RE = re.compile(
+    r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2})\b"
+    r"(?:,?\s+(\d{4}))?",
+    re.IGNORECASE,
+)
+_WEEKDAY_RE = re.compile(
+    r"\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\.?,?\s+(?=[a-z]{3})", re.IGNORECASE
+)
+_WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+_NUMERIC_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})\b")
+_ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_TIME = r"(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)?"
+_TIME_RANGE_RE = re.compile(
+    _TIME + r"\s*(?:-|–|—|to)\s*" + _TIME + r"(?![\d/])", re.IGNORECASE
+)
+_SINGLE_TIME_RE = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)", re.IGNORECASE)
+
+_AGE_RANGE_RE = re.compile(
+    r"(\d{1,3})\s*(months?|mos?|years?|yrs?)?\s*(?:-|–|to)\s*(\d{1,3})\s*(months?|mos?)?",
+    re.IGNORECASE,
+)
+_AGE_PLUS_RE = re.compile(
+    r"(\d{1,3})\s*\+|(\d{1,3})\s*(?:years?\s*)?(?:and|&)\s*(?:up|older)", re.IGNORECASE
+)
+_AGE_UNDER_RE = re.compile(r"(?:under|up to)\s*(\d{1,3})", re.IGNORECASE)
+# "Grades 3-5", "Grade K", "3rd-5th grade", "K-2"
+_GRADE = r"(pre-?k|k|\d{1,2})(?:st|nd|rd|th)?"
+_GRADE_RE = re.compile(
+    rf"\bgrades?\s*{_GRADE}(?:\s*(?:-|–|to)\s*{_GRADE})?"
+    rf"|\b{_GRADE}\s*(?:-|–|to)\s*{_GRADE}\s*grades?\b"
+    rf"|\b(k)\s*(?:-|–|to)\s*(\d{{1,2}})\b",
+    re.IGNORECASE,
+)
+
+
+def _infer_year(month, day, today, weekday=None):
+    """
+    Listings have no year: take the first one that isn't long past. A weekday
+    ("Monday, July 21") pins the year, which matters for older scrapes.
+    """
+    candidates = []
+    for year in range(today.year - 6, today.year + 2):
+        try:
+            candidates.append(date(year, month, day))
+        except ValueError:
+            continue
+    if weekday is not None:
+        matching = [c for c in candidates if c.weekday() == weekday]
+        recent = [c for c in matching if c >= today - PAST_DATE_GRACE]
+        if recent or matching:
+            return (recent or matching[-1:])[0]
+    for candidate in candidates:
+        if candidate >= today - PAST_DATE_GRACE:
+            return candidate
+    return None
+
+
+def _parse_days(text, today):
+    """
+    The first (and, for multi-day listings, last) calendar date in the text.
+    """
+    days = []
+    for m in _ISO_DATE_RE.finditer(text):
+        try:
+            days.append(date(int(m.group(1)), int(m.group(2)), int(m.group(3))))
+        except ValueError:
+            pass
+    for m in _NUMERIC_DATE_RE.finditer(text):
+        year = int(m.group(3))
+        try:
+            days.append(
+                date(
+                    year + 2000 if year < 100 else year,
+                    int(m.group(1)),
+                    int(m.group(2)),
+                )
+            )
+        except ValueError:
+            pass
+    weekday = _WEEKDAY_RE.search(text)
+    weekday = _WEEKDAYS.index(weekday.group(1).lower()) if weekday else None
+    for m in _MONTH_DAY_RE.finditer(text):
+        month = _MONTHS[m.group(1).lower()[:3]]
+        if m.group(3):
+            try:
+                days.append(date(int(m.group(3)), month, int(m.group(2))))
+            except ValueError:
+                pass
+        else:
+            day = _infer_year(month, int(m.group(2)), today, weekday)
+            if day:
+                days.append(day)
+    if not days:
+        return None, None
+    return min(days), max(days)
+
+
+def _to_minutes(hour, minute, meridiem):
+    hour = int(hour)
+    minute = int(minute or 0)
+    if meridiem:
+        pm = meridiem.lower().startswith("p")
+        hour = hour % 12 + (12 if pm else 0)
+    return hour * 60 + minute
+
+
+def _parse_times(text):
+    """
+    (start, end) as minutes after midnight, or (None, None).
+    "1:00-3:00pm" borrows the "pm" for the start unless that would put the
+    start after the end ("10:00-11:30am", "11:00-1:00pm").
+    """
+    m = _TIME_RANGE_RE.search(text)
+    if m and (m.group(3) or m.group(6)):
+        h1, m1, mer1, h2, m2, mer2 = m.groups()
+        end = _to_minutes(h2, m2, mer2 or mer1)
+        if mer1:
+            start = _to_minutes(h1, m1, mer1)
+        else:
+            start = _to_minutes(h1, m1, mer2)
+            if start > end:
+                start = _to_minutes(h1, m1, "am")
+        if start <= 24 * 60 and end <= 24 * 60:
+            return start, max(start, end)
+    m = _SINGLE_TIME_RE.search(text)
+    if m:
+        start = _to_minutes(*m.groups())
+        return start, start
+    return None, None
+
+
+def parse_date_range(text, today=None):
+    """
+    (start, end) as "YYYY-MM-DDTHH:MM" strings, or (None, None). Listings
+    without a time cover the whole day.
+    """
+    if not text:
+        return None, None
+    today = today or date.today()
+    first_day, last_day = _parse_days(text, today)
+    if first_day is None:
+        return None, None
+    # Take the dates out first so "JUL 23 — 7:00 pm" isn't read as "23 — 7:00 pm"
+    for pattern in (_ISO_DATE_RE, _NUMERIC_DATE_RE, _MONTH_DAY_RE):
+        text = pattern.sub(" ", text)
+    start_min, end_min = _parse_times(text)
+    if start_min is None:
+        start_min, end_min = 0, 24 * 60 - 1
+    start = datetime.combine(first_day, datetime.min.time()) + timedelta(
+        minutes=start_min
+    )
+    end = datetime.combine(last_day, datetime.min.time()) + timedelta(minutes=end_min)
+    return start.strftime("%Y-%m-%dT%H:%M"), end.strftime("%Y-%m-%dT%H:%M")
+
+
+def _grade_age(grade):
+    # Children start kindergarten at 5
+    grade = grade.lower()
+    if grade.startswith("pre"):
+        return 4
+    return 5 if grade == "k" else int(grade) + 5
+
+
+def parse_age_range(text):
+    """
+    (age_min, age_max) in whole years, or (None, None) if the text doesn't
+    say ("Varies"). School grades are turned into ages ("Grades 3-5" is
+    8-10) when no ages are given.
+    """
+    if not text:
+        return None, None
+    lowered = text.lower()
+    if "all ages" in lowered:
+        return 0, MAX_AGE
+
+    grade = _GRADE_RE.search(text)
+    # Take the grades out first so "Grades 3-5" isn't read as ages 3-5
+    text = _GRADE_RE.sub(" ", text)
+    m = _AGE_RANGE_RE.search(text)
+    if m:
+        low, low_unit, high, high_unit = m.groups()
+        low, high = int(low), int(high)
+        # "18 months - 3 years": the unit after the first number applies to it
+        if low_unit and low_unit.lower().startswith("mo"):
+            low //= 12
+        if high_unit and high_unit.lower().startswith("mo"):
+            high = max(1, -(-high // 12))
+        if low <= high <= MAX_AGE + 1:
+            return low, min(high, MAX_AGE)
+    m = _AGE_PLUS_RE.search(text)
+    if m:
+        return int(m.group(1) or m.group(2)), MAX_AGE
+    m = _AGE_UNDER_RE.search(text)
+    if m:
+        return 0, int(m.group(1))
+    if grade:
+        grades = [g for g in grade.groups() if g]
+        low, high = _grade_age(grades[0]), _grade_age(grades[-1])
+        if low <= high:
+            return low, high
+    if "adult" in lowered:
+        return 18, MAX_AGE
+    return None, None
+
+
+def to_minutes(text):
+    """
+    Minutes since 1970 for a normalized "YYYY-MM-DDTHH:MM" (or a plain date),
+    for storing and comparing start/end as integers.
+    """
+    return (datetime.fromisoformat(text) - _EPOCH) // timedelta(minutes=1)
+
+
+def from_minutes(minutes):
+    return (_EPOCH + timedelta(minutes=int(minutes))).strftime("%Y-%m-%dT%H:%M")
+
+
+def normalize_event(event, today=None):
+    """
+    Adds start, end, age_min and age_max to the event (in place) and returns it.
+    """
+    event["start"], event["end"] = parse_date_range(event.get("date"), today)
+    event["age_min"], event["age_max"] = parse_age_range(event.get("ages"))
+    return event
+
+
+def normalize_events(events, today=None):
+    today = today or date.today()
+    for event in events:
+        normalize_event(event, today)
+    return events
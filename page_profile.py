@@ -0,0 +1,237 @@
+"""
+Lightweight page profiles for the Playwright scrapers.
+
+The scrapers only read the event cards (and the YMCA table), so images, media,
+fonts, analytics and third-party tags are dead weight. A profile says what to
+abort with page.route():
+
+    block_types          resource types that are never loaded
+    block_hosts          hosts (and their subdomains) that are never contacted
+    third_party_types    resource types aborted unless they come from the
+                         source's own site or one of allow_hosts
+    allow_hosts          hosts that are always let through
+
+Scripts and stylesheets are kept: the listing pages render their cards with
+JS, and the readiness checks rely on elements being laid out and hidden like
+in a normal browser. The YMCA page is a Salesforce community that fills its
+table from XHRs to Salesforce hosts, so its profile allows those.
+
+On top of the routes, contexts are created without service workers and
+with a small viewport and reduced motion, and Chromium starts without
+extensions, background networking, sync or audio.
+
+    context = await browser.new_context(**CONTEXT_OPTIONS)
+    page = await context.new_page()
+    stats = await apply_profile(page, "YMCA Boston", "community.ymcaboston.org")
+
+`stats` counts requests and blocked requests by type. With track_bytes=True it
+also sums response bytes, which scrape_bench.py uses to report the bytes and
+load time a profile saves per page (`run --no-profile` vs `run`).
+"""
+
+import asyncio
+from collections import Counter
+from urllib.parse import urlparse
+
+from metrics import count
+
+LAUNCH_ARGS = [
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--mute-audio",
+    "--no-first-run",
+]
+CONTEXT_OPTIONS = {
+    "service_workers": "block",
+    "viewport": {"width": 1280, "height": 800},
+    "reduced_motion": "reduce",
+    "accept_downloads": False,
+}
+
+# Analytics, tag managers, ads, chat widgets and session recorders
+TRACKER_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googleadservices.com",
+    "googlesyndication.com",
+    "doubleclick.net",
+    "facebook.net",
+    "facebook.com",
+    "connect.facebook.net",
+    "hotjar.com",
+    "newrelic.com",
+    "nr-data.net",
+    "segment.io",
+    "segment.com",
+    "mixpanel.com",
+    "clarity.ms",
+    "bing.com",
+    "twitter.com",
+    "linkedin.com",
+    "licdn.com",
+    "adroll.com",
+    "quantserve.com",
+    "scorecardresearch.com",
+    "intercom.io",
+    "zdassets.com",
+    "youtube.com",
+    "vimeo.com",
+)
+
+DEFAULT_PROFILE = {
+    "block_types": ("image", "media", "font", "texttrack", "manifest"),
+    "block_hosts": TRACKER_HOSTS,
+    "third_party_types": ("xhr", "fetch", "eventsource"),
+    "allow_hosts": (),
+}
+
+PROFILES = {
+    "Mass Audubon": DEFAULT_PROFILE,
+    "National Audubon": DEFAULT_PROFILE,
+    "YMCA Boston": {
+        **DEFAULT_PROFILE,
+        # The registration table is loaded by Aura XHRs to Salesforce
+        "allow_hosts": (
+            "force.com",
+            "salesforce.com",
+            "salesforce-sites.com",
+            "sfdcstatic.com",
+            "visualforce.com",
+        ),
+    },
+}
+
+
+# Lets everything through; for measuring a page without a profile
+NO_BLOCKING = {
+    "block_types": (),
+    "block_hosts": (),
+    "third_party_types": (),
+    "allow_hosts": (),
+}
+
+
+def profile_for(source_name):
+    return PROFILES.get(source_name, DEFAULT_PROFILE)
+
+
+def _site(host):
+    # Good enough for the sources we scrape (no co.uk-style suffixes)
+    return ".".join(host.split(".")[-2:])
+
+
+def _matches_host(host, suffixes):
+    return any(host == s or host.endswith("." + s) for s in suffixes)
+
+
+def block_reason(profile, resource_type, url, site):
+    """
+    Why a request would be aborted under `profile` ("type", "host" or
+    "third-party"), or None to let it through. `site` is the source's
+    registrable domain, e.g. "massaudubon.org".
+    """
+    host = urlparse(url).hostname or ""
+    if _matches_host(host, profile["allow_hosts"]):
+        return None
+    if resource_type in profile["block_types"]:
+        return "type"
+    if _matches_host(host, profile["block_hosts"]):
+        return "host"
+    if resource_type in profile["third_party_types"] and not _matches_host(
+        host, (site,)
+    ):
+        return "third-party"
+    return None
+
+
+class PageStats:
+    def __init__(self, source_name):
+        self.source_name = source_name
+        self.requests = 0
+        self.blocked = Counter()  # resource type -> aborted requests
+        self.bytes = 0
+        self._pending = []
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "blocked": sum(self.blocked.values()),
+            "blocked_by_type": dict(self.blocked),
+            "bytes": self.bytes,
+        }
+
+    def _record(self, request, reason):
+        self.requests += 1
+        if reason:
+            self.blocked[request.resource_type] += 1
+            count("scrape.blocked_requests", source=self.source_name)
+
+    async def _add_size(self, request):
+        try:
+            response = await request.response()
+            if response is not None:
+                self.bytes += len(await response.body())
+        except Exception:
+            pass  # Redirects and cancelled requests have no body
+
+    async def settle(self):
+        """
+        Waits for the byte counts of finished requests to come in.
+        """
+        await asyncio.gather(*self._pending)
+        self._pending.clear()
+
+
+async def apply_profile(page, source_name, host, profile=None, track_bytes=False):
+    """
+    Routes every request of the page through the profile of `source_name`,
+    whose pages are on `host`. Allowed requests fall back to the context's
+    own routes, e.g. a HAR replay. Returns the page's PageStats.
+    """
+    profile = profile or profile_for(source_name)
+    site = _site(host)
+    stats = PageStats(source_name)
+
+    async def handle(route):
+        request = route.request
+        reason = block_reason(profile, request.resource_type, request.url, site)
+        stats._record(request, reason)
+        if reason:
+            await route.abort("blockedbyclient")
+        else:
+            await route.fallback()
+
+    await page.route("**/*", handle)
+    if track_bytes:
+        page.on(
+            "requestfinished",
+            lambda request: stats._pending.append(
+                asyncio.ensure_future(stats._add_size(request))
+            ),
+        )
+    return stats
+
+
+def apply_profile_sync(page, source_name, host, profile=None):
+    """
+    apply_profile() for the sync Playwright API (the fetch_* functions in
+    scr.py). Byte tracking is only available in the async version.
+    """
+    profile = profile or profile_for(source_name)
+    site = _site(host)
+    stats = PageStats(source_name)
+
+    def handle(route):
+        request = route.request
+        reason = block_reason(profile, request.resource_type, request.url, site)
+        stats._record(request, reason)
+        if reason:
+            route.abort("blockedbyclient")
+        else:
+            route.fallback()
+
+    page.route("**/*", handle)
+    return stats
@@ -1,14 +1,28 @@
 import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google import genai
 import base64
 import enum
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 
+from cache_store import MISSING, SqliteCache
+from geocoding import gazetteer_geocode
+from gmail_fetch import authorized_http_factory
+from gmail_sync import (
+    GMAIL_STATE_PATH,
+    commit_history_id,
+    keep_for_retry,
+    load_gmail_state,
+    mark_processed,
+    save_gmail_state,
+    sync_new_message_ids,
+)
+from metrics import count, span
+from newsletter_prep import prepare_newsletter, restore_links
+from rate_limit import MODEL_HOST, call
+from triage import get_triage
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
@@ -34,37 +48,146 @@ def get_message_body(msg_payload):
     return None
 
 
-def parseStuff(body):
-    print("im a newsletter")
+class Age(enum.Enum):
+    INFANT = "0-1"
+    TODDLER = "1-3"
+    YOUNG_CHILD = "3-6"
+    CHILD = "6-11"
+    ADOLESCENT = "11-14"
+    TEEN = "14-18"
+    YOUTH = "0-18"
+    ADULT = "18-65"
+    SENIOR = "65-100"
 
-    class Age(enum.Enum):
-        INFANT = "0-1"
-        TODDLER = "1-3"
-        YOUNG_CHILD = "3-6"
-        CHILD = "6-11"
-        ADOLESCENT = "11-14"
-        TEEN = "14-18"
-        YOUTH = "0-18"
-        ADULT = "18-65"
-        SENIOR = "65-100"
-
-    class Rating(BaseModel):
-        event_name: str
-        rating: Age
-        event_link: str
-        event_location: str
-
-    client = genai.Client()
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=f"Parse out any events in this newsletter {body} (return nothing if there's no events) and give them the most appropriate age rating based on the context. Also provide the link to the event (if provided, usually starts with <http) and the location.",
-        config={
-            "response_mime_type": "application/json",
-            "response_schema": list[Rating],
-        },
-    )
+
+class Rating(BaseModel):
+    event_name: str
+    rating: Age
+    event_link: str
+    event_location: str
+    event_description: str
+
+
+MODEL = "gemini-2.5-flash"
+# Bump whenever Age/Rating or the prompt change, so cached extractions made
+# with the old schema are not reused.
+RATING_SCHEMA_VERSION = 3
+# Newsletter chunks extracted at the same time
+MAX_PARALLEL_CHUNKS = 4
+
+# --- Extraction cache ---
+# The same newsletters come in again and again (re-processed messages, weekly
+# sends with identical bodies), so the parsed event list is cached on disk,
+# keyed by a hash of the normalized body, model and schema version.
+EXTRACTION_CACHE_PATH = "llm_cache.sqlite3"
+EXTRACTION_CACHE_TTL = 60 * 60 * 24 * 30  # 30 days
+EXTRACTION_CACHE_MAX_ENTRIES = 2000
+
+extraction_cache = SqliteCache(
+    EXTRACTION_CACHE_PATH,
+    table="extractions",
+    max_entries=EXTRACTION_CACHE_MAX_ENTRIES,
+)
+extraction_cache_stats = {"hits": 0, "misses": 0}
+
+_client = None
+
+
+def get_genai_client():
+    """
+    Returns one long-lived genai client, created on first use.
+    """
+    global _client
+    if _client is None:
+        from google import genai  # Imported here: it alone takes ~350 ms
+
+        _client = genai.Client()
+    return _client
+
+
+def extraction_cache_key(body, model=MODEL):
+    normalized = " ".join((body or "").split())
+    content = f"{model}\x1f{RATING_SCHEMA_VERSION}\x1f{normalized}"
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def extract_events(text, client=None):
+    """
+    Runs one (pre-processed) newsletter chunk through Gemini and returns the
+    events as a list of dicts (Rating fields). Results are cached, so text
+    we've seen before costs no model call.
+    """
+    key = extraction_cache_key(text)
+    cached = extraction_cache.get(key)
+    if cached is not MISSING:
+        extraction_cache_stats["hits"] += 1
+        count("model.cache_hits")
+        print(f"[DEBUG] Extraction cache hit ({len(cached)} events)")
+        return cached
+    extraction_cache_stats["misses"] += 1
+    count("model.cache_misses")
+
+    client = client or get_genai_client()
+    # Rate limited, and retried on 429s and server errors
+    with span("model.generate", kind="single"):
+        response = call(
+            MODEL_HOST,
+            lambda: client.models.generate_content(
+                model=MODEL,
+                contents=f"Parse out any events in this newsletter {text} (return nothing if there's no events) and give them the most appropriate age rating based on the context. Also provide the link to the event (links are written as placeholders like <LINK1>, copy the placeholder exactly), the location, and a one or two sentence description of the event in the newsletter's words.",
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": list[Rating],
+                },
+            ),
+            "Model call",
+        )
 
     print(response.text)
+    events = json.loads(response.text) if response.text else []
+    extraction_cache.set(key, events, EXTRACTION_CACHE_TTL)
+    return events
+
+
+def extract_prepared(prepared, client=None):
+    """
+    Extracts the events from a newsletter already run through
+    prepare_newsletter(). Chunks are extracted in parallel and the results
+    merged, with the real links put back.
+    """
+    chunks = prepared["chunks"]
+    if not chunks:
+        return []
+    if len(chunks) == 1:
+        results = [extract_events(chunks[0], client)]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(MAX_PARALLEL_CHUNKS, len(chunks))
+        ) as pool:
+            results = list(
+                pool.map(lambda chunk: extract_events(chunk, client), chunks)
+            )
+
+    # Events that straddle a chunk boundary can come back twice
+    events = []
+    seen = set()
+    for event in (event for chunk_events in results for event in chunk_events):
+        key = (event.get("event_name", "").strip().lower(), event.get("event_link"))
+        if key not in seen:
+            seen.add(key)
+            events.append(event)
+    return restore_links(events, prepared["links"])
+
+
+def parseStuff(body, client=None):
+    """
+    Extracts the events from a newsletter body. The body is cleaned up and
+    split into chunks first (see newsletter_prep.py).
+    """
+    print("im a newsletter")
+    with span("model.parse_newsletter"):
+        return extract_prepared(prepare_newsletter(body), client)
+
     # client = genai.Client()
 
     # response = client.models.generate_content(
@@ -77,37 +200,129 @@ def parseStuff(body):
     # print(f"body:{body}")
 
 
-def determineEmailType(subject):
-    print("i got within this func ")
-    print(subject)
-    print(type(subject))
-    newsletterWords = [
-        "Weekly",
-        "weekly",
-        "Monthly",
-        "monthly",
-        "Update",
-        "update",
-        "Newsletter",
-        "newsletter",
-        "Digest",
-        "digest",
-        "Highlights",
-        "highlights",
-    ]
-
-    for word in newsletterWords:
-        if word in subject:
-            print("Success!")
-            return True
-
-    # if we've gotten to this point, all words have been looped thru and we haven't found one
-    print("not a newsletter")
-    return False
-
-
-def main():
-    """Shows basic usage of the Gmail API and prints the raw content of emails."""
+def determineEmailType(subject, headers=None, body=None):
+    """
+    True when the mail looks like a newsletter with events in it, so it's
+    worth a model call. Scored locally by triage.py from the subject and,
+    when given, the other triage headers and the body.
+    """
+    return get_triage().is_newsletter({**(headers or {}), "Subject": subject}, body)
+
+
+NEWSLETTER_SOURCE = "Gmail newsletters"
+
+
+def newsletter_event(extracted, msg_id):
+    """
+    An extracted Rating (as a dict) in the same shape as the scraped events.
+    Coordinates come from the offline gazetteer only, so storing never waits
+    on Nominatim.
+    """
+    lat, lon = gazetteer_geocode(extracted.get("event_location") or "")
+    return {
+        "title": extracted.get("event_name", ""),
+        "date": "",
+        "ages": extracted.get("rating", ""),
+        "location": extracted.get("event_location", ""),
+        "latitude": lat,
+        "longitude": lon,
+        "url": extracted.get("event_link", ""),
+        "description": extracted.get("event_description", ""),
+        "message_id": msg_id,
+    }
+
+
+def newsletter_event_key(event):
+    return event["url"] or f"{event['title']}#{event['location']}"
+
+
+def publish_events(event_store):
+    """
+    Publishes the store with the newsletter events in it. Until the scraper
+    has written to the store once, the JSON export still holds the only copy
+    of the scraped events, so it isn't overwritten.
+    """
+    from event_store import EVENTS_JSON_PATH
+
+    if event_store.sources() - {NEWSLETTER_SOURCE} or not os.path.exists(
+        EVENTS_JSON_PATH
+    ):
+        event_store.publish()
+
+
+def process_mailbox(
+    service,
+    max_results=10,
+    http_factory=None,
+    state_path=GMAIL_STATE_PATH,
+    client=None,
+    store_path=None,
+):
+    """
+    Fetches the messages that arrived since the last run (see gmail_sync.py)
+    and streams them through the fetch -> triage -> extract -> store pipeline
+    (see newsletter_pipeline.py). Extracted events are upserted into the
+    event store and published with the scraped ones. Returns {message id:
+    extracted events}. `store_path` defaults to event_store.EVENT_STORE_PATH.
+    """
+    # Imported here: event_store pulls in NumPy, which commands that only
+    # import this module for its helpers don't need
+    from event_store import EVENT_STORE_PATH, EventStore
+    from newsletter_pipeline import run_pipeline
+
+    state = load_gmail_state(state_path)
+    message_ids, history_id = sync_new_message_ids(service, state, max_results)
+    if not message_ids:
+        print("No new messages.")
+        commit_history_id(state, history_id)
+        save_gmail_state(state, state_path)
+        return {}
+
+    event_store = EventStore(store_path or EVENT_STORE_PATH)
+
+    def store(msg_id, events):
+        print(f"[DEBUG] {len(events)} event(s) from message {msg_id}")
+        event_store.upsert(
+            NEWSLETTER_SOURCE,
+            [newsletter_event(event, msg_id) for event in events],
+            newsletter_event_key,
+        )
+        # Saved after every newsletter so a crash never pays for the same one twice
+        mark_processed(state, [msg_id])
+        save_gmail_state(state, state_path)
+
+    results, unfinished = run_pipeline(
+        service, message_ids, http_factory=http_factory, client=client, store=store
+    )
+
+    # Stored messages were marked as they went; triage skips are done too,
+    # and whatever failed is offered again next run
+    failed = set(unfinished)
+    mark_processed(state, [msg_id for msg_id in message_ids if msg_id not in failed])
+    keep_for_retry(state, unfinished)
+    commit_history_id(state, history_id)
+    save_gmail_state(state, state_path)
+    get_triage().save()
+    publish_events(event_store)
+    event_store.close()
+    print(
+        f"[DEBUG] Extraction cache: {extraction_cache_stats['hits']} hits, "
+        f"{extraction_cache_stats['misses']} misses"
+    )
+    return results
+
+
+def load_credentials():
+    """
+    OAuth credentials from token.json, refreshed (or authorized again in the
+    browser) when they are no longer valid.
+    """
+    # The Google client libraries are slow to import, so only the commands
+    # that talk to Gmail pay for them
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     if os.path.exists("token.json"):
         creds = Credentials.from_authorized_user_file("token.json", SCOPES)
@@ -119,38 +334,22 @@ def main():
             creds = flow.run_local_server(port=0)
         with open("token.json", "w") as token:
             token.write(creds.to_json())
+    return creds
+
 
+def main(max_results=10):
+    """Shows basic usage of the Gmail API and prints the raw content of emails."""
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+
+    creds = load_credentials()
     try:
         service = build("gmail", "v1", credentials=creds)
-        results = service.users().messages().list(userId="me", maxResults=10).execute()
-        messages = results.get("messages", [])
-
-        if not messages:
-            print("No messages found.")
-            return
-
-        print("Printing raw content for the last 5 messages:")
-        for message in messages:
-            msg_id = message["id"]
-            msg = (
-                service.users()
-                .messages()
-                .get(userId="me", id=msg_id, format="full")
-                .execute()
-            )
-
-            headers = msg["payload"]["headers"]
-            subject = "No Subject"
-            # this separates each email entry
-            for header in headers:
-                if header["name"] == "Subject":
-                    subject = header["value"]
-                    break
-
-            body = get_message_body(msg["payload"])
-            if determineEmailType(subject):
-                print("i got here")
-                parseStuff(body)
+        process_mailbox(
+            service,
+            max_results=max_results,
+            http_factory=authorized_http_factory(creds),
+        )
 
     except HttpError as error:
         print(f"An error occurred: {error}")
@@ -0,0 +1,268 @@
+"""
+One place for throttling and retrying outbound calls.
+
+Every host gets a token bucket shared by all threads (and the asyncio
+scrapers), sized by HOST_POLICIES. A caller only waits when the bucket is
+empty, so Nominatim is asked at exactly its allowed 1 request/second while
+calls to other hosts go ahead in parallel.
+
+call() adds retries: transient failures (429, 408, 5xx, timeouts) are retried
+with jittered exponential backoff. A Retry-After from the server replaces the
+backoff and pauses the whole host, not just the caller that got it.
+
+    response = call(MODEL_HOST, lambda: client.models.generate_content(...), "Model call")
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from metrics import count
+
+NOMINATIM_HOST = "nominatim.openstreetmap.org"
+GMAIL_HOST = "gmail.googleapis.com"
+MODEL_HOST = "generativelanguage.googleapis.com"
+
+# rate: requests (tokens) per second, burst: how many can go at once
+HOST_POLICIES = {
+    NOMINATIM_HOST: {"rate": 1.0, "burst": 1},  # Nominatim usage policy
+    # messages.get costs 5 of the 250 quota units per user per second; a batch
+    # takes one token per message in it
+    GMAIL_HOST: {"rate": 40.0, "burst": 100},
+    MODEL_HOST: {"rate": 2.0, "burst": 4},
+    "www.massaudubon.org": {"rate": 2.0, "burst": 3},
+    "www.audubon.org": {"rate": 2.0, "burst": 3},
+    "community.ymcaboston.org": {"rate": 1.0, "burst": 1},
+}
+DEFAULT_POLICY = {"rate": 5.0, "burst": 5}
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0  # seconds, doubled every retry (plus jitter)
+MAX_RETRY_AFTER = 300  # Don't honor Retry-After beyond this many seconds
+
+
+class TokenBucket:
+    """
+    Allows `rate` tokens per second with bursts of `burst`. pause() empties
+    the bucket until a point in time (for Retry-After).
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, n):
+        """
+        Takes n tokens if they are there and returns 0, else the seconds to
+        wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            n = min(
+                n, self.burst
+            )  # A request bigger than the bucket waits for a full one
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0
+            return (n - self._tokens) / self.rate
+
+    def acquire(self, n=1):
+        """
+        Blocks until n tokens are available. Returns the seconds waited.
+        """
+        waited = 0.0
+        while True:
+            wait = self._reserve(n)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def async_acquire(self, n=1):
+        waited = 0.0
+        while True:
+            wait = self._reserve(n)
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                self._tokens = 0
+                self._updated = until
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def limiter(host):
+    """
+    The shared bucket of `host`, created from its policy on first use.
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            policy = HOST_POLICIES.get(host, DEFAULT_POLICY)
+            bucket = _buckets[host] = TokenBucket(policy["rate"], policy["burst"])
+        return bucket
+
+
+def set_policy(host, rate, burst):
+    """
+    Replaces the host's policy (and bucket), e.g. for offline benchmarks.
+    """
+    with _buckets_lock:
+        HOST_POLICIES[host] = {"rate": rate, "burst": burst}
+        _buckets[host] = TokenBucket(rate, burst)
+
+
+def acquire(host, n=1):
+    waited = limiter(host).acquire(n)
+    if waited:
+        count("rate_limit.wait_seconds", waited, host=host)
+
+
+async def async_acquire(host, n=1):
+    waited = await limiter(host).async_acquire(n)
+    if waited:
+        count("rate_limit.wait_seconds", waited, host=host)
+
+
+def http_status(error):
+    """
+    The HTTP status of a failed call, for the client libraries we use:
+    googleapiclient (.resp.status), google-genai (.code), requests/httpx
+    (.response.status_code).
+    """
+    for value in (
+        getattr(error, "code", None),
+        getattr(error, "status_code", None),
+        getattr(getattr(error, "resp", None), "status", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+    ):
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def retry_after(error):
+    """
+    Seconds the server asked us to wait (Retry-After header, or geopy's
+    GeocoderRateLimited.retry_after), or None.
+    """
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        resp = getattr(error, "resp", None)
+        headers = resp if isinstance(resp, dict) else None
+        if headers is None:
+            headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def is_transient(error):
+    """
+    Worth retrying: rate limited, timed out or a server error. Other HTTP
+    errors (400, 403, 404...) and bugs (ValueError, KeyError...) aren't.
+    """
+    status = http_status(error)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE):
+    """
+    Jittered exponential backoff before retry number `attempt` (1-based).
+    """
+    return base * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+
+def count_failure(retry, keys, max_attempts, key=str):
+    """
+    Retries across runs: adds one failed attempt for each of `keys` to
+    `retry` ({key(k): attempts so far}, kept in a state file). Keys that
+    reach max_attempts are dropped from it and returned, to be given up on.
+    """
+    given_up = []
+    for k in keys:
+        k = key(k)
+        attempts = retry.get(k, 0) + 1
+        if attempts >= max_attempts:
+            retry.pop(k, None)
+            given_up.append(k)
+        else:
+            retry[k] = attempts
+    return given_up
+
+
+def with_retries(
+    fn,
+    what,
+    attempts=MAX_ATTEMPTS,
+    base=BACKOFF_BASE,
+    retry_if=lambda error: True,
+    host=None,
+):
+    """
+    Calls fn() until it succeeds, retrying failures that `retry_if` accepts
+    and re-raising the last one. A Retry-After pauses `host` (if given).
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts or not retry_if(e):
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = backoff_delay(attempt, base)
+            elif host is not None:
+                limiter(host).pause(delay)
+            count("rate_limit.retries", host=host or "none")
+            print(
+                f"[WARN] {what} failed ({e}), retry {attempt}/{attempts - 1} in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+
+def call(
+    host, fn, what, attempts=MAX_ATTEMPTS, base=BACKOFF_BASE, retry_if=is_transient
+):
+    """
+    fn() once the host's bucket allows it, with transient failures retried
+    (every attempt takes a token).
+    """
+
+    def attempt():
+        acquire(host)
+        return fn()
+
+    return with_retries(attempt, what, attempts, base, retry_if, host)
@@ -0,0 +1,146 @@
+"""
+Page readiness checks for the Playwright scrapers.
+
+Instead of sleeping a fixed 4-5 seconds after every page.goto(), wait for the
+thing we actually need: the event cards being in the DOM and their count no
+longer changing (the listing pages fill in cards with JS after load). Every
+wait is bounded, and the time it took is logged per page so we can see how
+long each source really needs.
+
+There is a sync version (for the fetch_* functions in scr.py) and an async
+version (for scrape_runner.py); both use the same settings and JS check.
+"""
+
+import time
+
+# How long to wait for the first card before deciding the page has none
+READY_TIMEOUT_MS = 15000
+# The card count has to stay the same for this long to count as "settled"
+SETTLE_MS = 400
+# Upper bound on the settle phase (we scrape whatever is there after this)
+SETTLE_TIMEOUT_MS = 5000
+# Upper bound on waiting for network idle, when requested
+NETWORK_IDLE_TIMEOUT_MS = 5000
+
+# Returns true once the number of elements matching the selector has been
+# non-zero and unchanged for quietMs. State is kept on window per selector.
+_CARD_COUNT_SETTLED_JS = """
+([selector, quietMs]) => {
+  const n = document.querySelectorAll(selector).length;
+  const now = performance.now();
+  window.__cardSettle = window.__cardSettle || {};
+  const s = window.__cardSettle[selector];
+  if (!s || s.n !== n) {
+    window.__cardSettle[selector] = { n: n, t: now };
+    return false;
+  }
+  return n > 0 && now - s.t >= quietMs;
+}
+"""
+
+
+def _log_ready(label, started, signal):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"[READY] {label}: {signal} after {elapsed_ms:.0f} ms")
+    return elapsed_ms
+
+
+def wait_until_ready(
+    page,
+    label,
+    selector,
+    hidden_selector=None,
+    network_idle=False,
+    timeout_ms=READY_TIMEOUT_MS,
+):
+    """
+    Waits until `selector` matches at least one element and the match count has
+    settled. Optionally also waits for `hidden_selector` (e.g. a spinner) to be
+    hidden and for network idle. Returns True if cards showed up, False if the
+    page never produced any within the timeout.
+    """
+    started = time.perf_counter()
+    try:
+        page.wait_for_selector(selector, state="attached", timeout=timeout_ms)
+    except Exception:
+        _log_ready(label, started, f"no '{selector}' (gave up)")
+        return False
+
+    if hidden_selector:
+        try:
+            page.wait_for_selector(
+                hidden_selector, state="hidden", timeout=SETTLE_TIMEOUT_MS
+            )
+        except Exception:
+            print(f"[WARN] {label}: '{hidden_selector}' still visible, continuing")
+
+    signal = "cards settled"
+    try:
+        page.wait_for_function(
+            _CARD_COUNT_SETTLED_JS,
+            arg=[selector, SETTLE_MS],
+            polling=100,
+            timeout=SETTLE_TIMEOUT_MS,
+        )
+    except Exception:
+        signal = "cards still changing (settle timeout)"
+
+    if network_idle:
+        try:
+            page.wait_for_load_state("networkidle", timeout=NETWORK_IDLE_TIMEOUT_MS)
+            signal += " + network idle"
+        except Exception:
+            signal += " (network not idle)"
+
+    _log_ready(label, started, signal)
+    return True
+
+
+async def async_wait_until_ready(
+    page,
+    label,
+    selector,
+    hidden_selector=None,
+    network_idle=False,
+    timeout_ms=READY_TIMEOUT_MS,
+):
+    """
+    Async version of wait_until_ready() for playwright.async_api pages.
+    """
+    started = time.perf_counter()
+    try:
+        await page.wait_for_selector(selector, state="attached", timeout=timeout_ms)
+    except Exception:
+        _log_ready(label, started, f"no '{selector}' (gave up)")
+        return False
+
+    if hidden_selector:
+        try:
+            await page.wait_for_selector(
+                hidden_selector, state="hidden", timeout=SETTLE_TIMEOUT_MS
+            )
+        except Exception:
+            print(f"[WARN] {label}: '{hidden_selector}' still visible, continuing")
+
+    signal = "cards settled"
+    try:
+        await page.wait_for_function(
+            _CARD_COUNT_SETTLED_JS,
+            arg=[selector, SETTLE_MS],
+            polling=100,
+            timeout=SETTLE_TIMEOUT_MS,
+        )
+    except Exception:
+        signal = "cards still changing (settle timeout)"
+
+    if network_idle:
+        try:
+            await page.wait_for_load_state(
+                "networkidle", timeout=NETWORK_IDLE_TIMEOUT_MS
+            )
+            signal += " + network idle"
+        except Exception:
+            signal += " (network not idle)"
+
+    _log_ready(label, started, signal)
+    return True
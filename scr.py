@@ -1,22 +1,35 @@
 from playwright.sync_api import sync_playwright
-from urllib.parse import urljoin
-from geopy.geocoders import Nominatim
-from geopy.exc import (
-    GeocoderTimedOut,
-    GeocoderServiceError,
-)  # Import specific exceptions
-import json
-import time
+from urllib.parse import urljoin, urlparse
 import re  # Added for potential string cleaning
 
+from extract import check_row, extract_cards
+from geocoding import cached_geocode, gazetteer_geocode
+from metrics import count, span
+from page_profile import CONTEXT_OPTIONS, LAUNCH_ARGS, apply_profile_sync
+from readiness import wait_until_ready
+
 BASE_MASS = "https://www.massaudubon.org"
 BASE_NATL = "https://www.audubon.org"
+YMCA_URL = "https://community.ymcaboston.org/s/registration"
+
+# What each listing page is "ready" on (see readiness.py)
+MASS_CARD_SELECTOR = ".event-card"
+NATL_CARD_SELECTOR = ".event-card-item"
+YMCA_TABLE_SELECTOR = "table[role='grid'].tsr-course-table"
+YMCA_ROW_SELECTOR = "tr[data-aura-class*='TREX1WebRegistrationComponentCourseListItem']"
+YMCA_SPINNER_SELECTOR = "div.TREX1Spinner"
+
+
+def mass_audubon_page_url(page_num):
+    return (
+        BASE_MASS
+        + f"/programs?prg%5Baudiences%5D%5B0%5D=864&prg%5Baudiences%5D%5B1%5D=865&page={page_num}"
+    )
+
+
+def national_audubon_page_url(page_num):
+    return f"{BASE_NATL}/events?view_type=row&page={page_num}"
 
-# IMPORTANT: Provide a unique user_agent with an identifiable string (e.g., your email or project name)
-# This is crucial for Nominatim's usage policy.
-geolocator = Nominatim(
-    user_agent="YourAudubonEventScraper/1.0 (ondrasek_hanna@wheatoncollege.edu)"
-)
 
 # --- Manual Lookup Table (Add more as you encounter consistently failing locations) ---
 MANUAL_NATIONAL_AUDUBON_LOCATIONS = {
@@ -61,32 +74,42 @@ MANUAL_NATIONAL_AUDUBON_LOCATIONS = {
 }
 
 
-def _geocode_location(location_str, attempt_type="original"):
+def _geocode_candidates(location_str):
     """
-    Helper function to geocode a location string with Nominatim and handle delays/retries.
+    Returns the (attempt_type, location string) pairs to try, in order.
     """
-    print(f"   [GEOCoding] Attempting geocoding '{attempt_type}' for: '{location_str}'")
-    try:
-        # Nominatim requires a delay between requests
-        time.sleep(1.2)  # Increased slightly to be safer than exactly 1 second
+    candidates = [("original", location_str)]
 
-        loc = geolocator.geocode(location_str, timeout=10)  # Add a timeout for safety
-        if loc:
-            print(
-                f"   [GEOCoding] Success for '{location_str}': {loc.latitude}, {loc.longitude}"
-            )
-            return str(loc.latitude), str(loc.longitude)
-        else:
-            print(f"   [GEOCoding] No results from Nominatim for: '{location_str}'")
-            return None, None
-    except (GeocoderTimedOut, GeocoderServiceError) as e:
-        print(
-            f"   [GEOCoding ERROR] Nominatim service error or timeout for '{location_str}': {e}"
+    # "City, State" simplification
+    # This regex attempts to find "Something, City, State" or "City, State" patterns
+    match_city_state = re.search(r"([A-Za-z\s\.-]+),\s*([A-Z]{2})$", location_str)
+    if match_city_state:
+        simpler_location_str = (
+            f"{match_city_state.group(1).strip()}, {match_city_state.group(2).strip()}"
         )
-        return None, None
-    except Exception as e:
-        print(f"   [GEOCoding ERROR] Unexpected error geocoding '{location_str}': {e}")
-        return None, None
+        candidates.append(("city, state", simpler_location_str))
+
+    # Strip common prefixes/suffixes that might confuse geocoder
+    # Example: "Audubon Center at Debs Park, Los Angeles, CA" -> "Debs Park, Los Angeles, CA"
+    # Example: "John James Audubon Center, Audubon, PA" -> "Audubon, PA"
+    cleaned_location_str = (
+        location_str.replace("Audubon Center at ", "")
+        .replace("Audubon Center, ", "")
+        .strip()
+    )
+    cleaned_location_str = cleaned_location_str.replace(
+        "Audubon ", ""
+    ).strip()  # Remove standalone "Audubon"
+    candidates.append(("cleaned", cleaned_location_str))
+
+    # Prevent redundant checks
+    unique = []
+    seen = set()
+    for attempt_type, candidate in candidates:
+        if candidate and candidate not in seen:
+            seen.add(candidate)
+            unique.append((attempt_type, candidate))
+    return unique
 
 
 def get_lat_lon_for_national_audubon_event(location_str):
@@ -100,103 +123,160 @@ def get_lat_lon_for_national_audubon_event(location_str):
     # 1. Check manual lookup first
     if location_str in MANUAL_NATIONAL_AUDUBON_LOCATIONS:
         print(f"[GEOCoding] Using manual lookup for: '{location_str}'")
+        count("geocode.manual_hits")
         return MANUAL_NATIONAL_AUDUBON_LOCATIONS[location_str]
 
-    # 2. Try geocoding the original location string
-    lat, lon = _geocode_location(location_str, "original")
-    if lat is not None:
-        return lat, lon
-
-    # 3. Try simplifying the location string (e.g., "City, State")
-    # This regex attempts to find "Something, City, State" or "City, State" patterns
-    match_city_state = re.search(r"([A-Za-z\s\.-]+),\s*([A-Z]{2})$", location_str)
-    if match_city_state:
-        simpler_location_str = (
-            f"{match_city_state.group(1).strip()}, {match_city_state.group(2).strip()}"
-        )
-        if simpler_location_str != location_str:  # Avoid redundant geocode call
-            lat, lon = _geocode_location(simpler_location_str, "city, state")
+    # 2. The offline gazetteer knows every US town, so "City, ST" never needs
+    # the network. That gives the town's center rather than the venue, which
+    # is close enough for a radius search.
+    for attempt_type, candidate in _geocode_candidates(location_str):
+        if attempt_type == "city, state":
+            lat, lon = gazetteer_geocode(candidate)
             if lat is not None:
+                print(f"[GEOCoding] Gazetteer match for: '{candidate}'")
                 return lat, lon
 
-    # 4. Try stripping common prefixes/suffixes that might confuse geocoder
-    # Example: "Audubon Center at Debs Park, Los Angeles, CA" -> "Debs Park, Los Angeles, CA"
-    # Example: "John James Audubon Center, Audubon, PA" -> "Audubon, PA"
-    cleaned_location_str = (
-        location_str.replace("Audubon Center at ", "")
-        .replace("Audubon Center, ", "")
-        .strip()
-    )
-    cleaned_location_str = cleaned_location_str.replace(
-        "Audubon ", ""
-    ).strip()  # Remove standalone "Audubon"
-    if (
-        cleaned_location_str != location_str
-        and cleaned_location_str != simpler_location_str
-    ):  # Prevent redundant checks
-        lat, lon = _geocode_location(cleaned_location_str, "cleaned")
+    # 3. Try the original string, then "City, State", then a cleaned-up version.
+    # Each one is checked against the geocode cache before touching the network.
+    for attempt_type, candidate in _geocode_candidates(location_str):
+        lat, lon = cached_geocode(candidate, attempt_type)
         if lat is not None:
             return lat, lon
 
-    # 5. If all else fails, return None, None
+    # 4. If all else fails, return None, None
     print(
         f"[GEOCoding] Ultimately failed to geocode: '{location_str}' after all attempts."
     )
+    count("geocode.failures")
     return None, None
 
 
+# --- Card schemas and builders ---
+# Each schema lists the fields to pull out of one card/row (see extract.py for
+# the format). All cards on a page are read in one browser call, then the
+# build_* functions turn each raw row into an event dict.
+MASS_CARD_SCHEMA = {
+    "title": {"selector": ".event-card__content__title", "required": True},
+    "date": {"selector": ".event-card__content__date", "required": True},
+    "ages": {"selector": ".event-card__content__ages", "required": True},
+    "latitude": {
+        "selector": ".event-card__content__place",
+        "attr": "data-latitude",
+        "required": True,
+    },
+    "longitude": {"selector": ".event-card__content__place", "attr": "data-longitude"},
+    "place_parts": {
+        "selector": ".event-card__content__place .ezstring-field",
+        "all": True,
+    },
+    "href": {"selector": "a", "attr": "href"},
+}
+
+NATL_CARD_SCHEMA = {
+    "title": {"selector": "a.card-link", "required": True},
+    "href": {"selector": "a.card-link", "attr": "href", "required": True},
+    "time": {"selector": ".event-card-item-header__time--time", "required": True},
+    "months": {"selector": ".event-card-item-header__month span", "all": True},
+    "day": {"selector": ".event-card-item-header__date span", "required": True},
+    "location": {"selector": ".event-card-item-location", "required": True},
+}
+
+YMCA_ROW_SCHEMA = {
+    "program": {"selector": "td[data-label='Program'] div", "required": True},
+    "course": {"selector": "td[data-label='Course'] div", "required": True},
+    "start_date": {"selector": "td[data-label='Start date']"},
+    "session": {"selector": "td[data-label='Session']"},
+}
+
+
+def build_mass_audubon_event(row):
+    place = ", ".join([part.strip() for part in row["place_parts"] if part.strip()])
+    link = row["href"]
+    return {
+        "title": row["title"].strip(),
+        "date": row["date"].strip(),
+        "ages": row["ages"].strip(),
+        "location": place,
+        "latitude": row["latitude"],
+        "longitude": row["longitude"],
+        "url": urljoin(BASE_MASS, link) if link else "",
+    }
+
+
+def build_national_audubon_event(row):
+    """
+    Latitude/longitude are left as None; the caller geocodes the location.
+    """
+    month = [m.strip() for m in row["months"] if m.strip()][-1]
+    date = f"{month} {row['day']}"
+    return {
+        "title": row["title"].strip(),
+        "date": f"{date} — {row['time']}",
+        "ages": "All ages",
+        "location": row["location"].strip(),
+        "latitude": None,
+        "longitude": None,
+        "url": urljoin(BASE_NATL, row["href"]),
+    }
+
+
+def build_ymca_event(row):
+    """
+    Returns None for adult-only programs, which are skipped.
+    """
+    program = row["program"].strip()
+    course = row["course"].strip()
+    start_date = (row["start_date"] or "").strip()
+    session = (row["session"] or "").strip()
+
+    if (
+        program.lower().startswith("adult")
+        and "child" not in program.lower()
+        and "family" not in program.lower()
+    ):
+        print(f"[DEBUG] Skipping Adult-only program: {program} - {course}")
+        return None
+
+    return {
+        "title": f"{program}: {course}",
+        "date": start_date if start_date else session,
+        "ages": "Varies",
+        "location": "Greater Boston YMCA",
+        "latitude": "42.3601",
+        "longitude": "-71.0589",
+        "url": YMCA_URL,
+    }
+
+
 def fetch_events_with_playwright(pages=3):
     print("[DEBUG] Launching browser for Mass Audubon...")
 
     events = []
     with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
+        browser = p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        page = browser.new_page(**CONTEXT_OPTIONS)
+        apply_profile_sync(page, "Mass Audubon", urlparse(BASE_MASS).netloc)
 
         for page_num in range(1, pages + 1):
-            url = (
-                BASE_MASS
-                + f"/programs?prg%5Baudiences%5D%5B0%5D=864&prg%5Baudiences%5D%5B1%5D=865&page={page_num}"
-            )
+            url = mass_audubon_page_url(page_num)
             print(f"[DEBUG] Navigating to {url}")
-            page.goto(url, timeout=60000)
-            page.wait_for_timeout(5000)
+            with span("scrape.navigate", source="Mass Audubon"):
+                page.goto(url, timeout=60000)
+            with span("scrape.ready", source="Mass Audubon"):
+                wait_until_ready(
+                    page, f"Mass Audubon page {page_num}", MASS_CARD_SELECTOR
+                )
 
-            event_cards = page.locator(".event-card")
-            count = event_cards.count()
-            print(f"[DEBUG] Found {count} Mass Audubon events on page {page_num}.")
+            with span("scrape.extract", source="Mass Audubon"):
+                rows = extract_cards(page.locator(MASS_CARD_SELECTOR), MASS_CARD_SCHEMA)
+            print(f"[DEBUG] Found {len(rows)} Mass Audubon events on page {page_num}.")
+            count("scrape.cards", len(rows), source="Mass Audubon")
 
-            for i in range(count):
+            for i, row in enumerate(rows):
                 try:
-                    card = event_cards.nth(i)
-
-                    title = card.locator(".event-card__content__title").inner_text()
-                    date = card.locator(".event-card__content__date").inner_text()
-                    age = card.locator(".event-card__content__ages").inner_text()
-
-                    place_el = card.locator(".event-card__content__place")
-                    lat = place_el.get_attribute("data-latitude")
-                    lon = place_el.get_attribute("data-longitude")
-                    place_parts = place_el.locator(".ezstring-field").all_inner_texts()
-                    place = ", ".join(
-                        [part.strip() for part in place_parts if part.strip()]
-                    )
-                    link_el = card.locator("a").first
-                    link = link_el.get_attribute("href") if link_el else ""
-                    full_link = urljoin(BASE_MASS, link) if link else ""
-
-                    events.append(
-                        {
-                            "title": title.strip(),
-                            "date": date.strip(),
-                            "ages": age.strip(),
-                            "location": place,
-                            "latitude": lat,
-                            "longitude": lon,
-                            "url": full_link,
-                        }
-                    )
+                    events.append(build_mass_audubon_event(check_row(row)))
                 except Exception as e:
+                    count("scrape.card_errors", source="Mass Audubon")
                     print(
                         f"[WARN] Error parsing Mass Audubon card {i + 1} on page {page_num}: {e}"
                     )
@@ -211,91 +291,60 @@ def fetch_ymca_boston_events():
 
     with sync_playwright() as p:
         browser = p.chromium.launch(
-            headless=True
+            headless=True, args=LAUNCH_ARGS
         )  # Keep headless=True for faster runs once debugged
         # For debugging, temporarily change to headless=False
         # browser = p.chromium.launch(headless=False)
-        page = browser.new_page()
-        url = "https://community.ymcaboston.org/s/registration"
+        page = browser.new_page(**CONTEXT_OPTIONS)
+        apply_profile_sync(page, "YMCA Boston", urlparse(YMCA_URL).netloc)
+        url = YMCA_URL
 
         print(f"[DEBUG] Navigating to {url}")
-        page.goto(url, timeout=60000)
+        with span("scrape.navigate", source="YMCA Boston"):
+            page.goto(url, timeout=60000)
 
         # --- IMPROVED WAITING STRATEGY ---
-        try:
-            # 1. Wait for the main table element to be visible
-            # The table has role="grid" and class "tsr-course-table"
-            page.wait_for_selector(
-                "table[role='grid'].tsr-course-table", state="visible", timeout=20000
-            )
-            print("[DEBUG] Main YMCA table is visible.")
-
-            # 2. Wait for the loading spinner to be HIDDEN
-            # Changed 'state=visible' to 'state=hidden'
-            page.wait_for_selector("div.TREX1Spinner", state="hidden", timeout=10000)
-            print("[DEBUG] YMCA loading spinner is hidden.")
-
-            # 3. Wait for at least one data row to appear
-            page.wait_for_selector(
-                "tr[data-aura-class*='TREX1WebRegistrationComponentCourseListItem']",
-                timeout=15000,
-            )
-            print("[DEBUG] YMCA table content (rows) loaded.")
-
-        except Exception as e:
-            print(
-                f"[WARN] YMCA table content not found or page did not load as expected: {e}"
-            )
-            browser.close()  # Ensure browser is closed on error
-            return events
-        # --- END IMPROVED WAITING STRATEGY ---
-
-        rows = page.locator(
-            "tr[data-aura-class*='TREX1WebRegistrationComponentCourseListItem']"
-        )
-        count = rows.count()
-        print(f"[DEBUG] Found {count} YMCA entries")
-
-        for i in range(count):
+        with span("scrape.ready", source="YMCA Boston"):
             try:
-                row = rows.nth(i)
-                # Ensure the row is visible before trying to extract text
-                row.wait_for(
-                    state="visible", timeout=5000
-                )  # This might also be redundant if the main table/rows are already waited for. Could remove if not seeing specific issues with individual rows.
-
-                program = (
-                    row.locator("td[data-label='Program'] div").inner_text().strip()
+                # 1. Wait for the main table element to be visible
+                # The table has role="grid" and class "tsr-course-table"
+                page.wait_for_selector(
+                    YMCA_TABLE_SELECTOR, state="visible", timeout=20000
                 )
-                course = row.locator("td[data-label='Course'] div").inner_text().strip()
-
-                start_date_el = row.locator("td[data-label='Start date']")
-                start_date = start_date_el.inner_text().strip() if start_date_el else ""
-
-                session_el = row.locator("td[data-label='Session']")
-                session = session_el.inner_text().strip() if session_el else ""
-
-                if (
-                    program.lower().startswith("adult")
-                    and "child" not in program.lower()
-                    and "family" not in program.lower()
-                ):
-                    print(f"[DEBUG] Skipping Adult-only program: {program} - {course}")
-                    continue
-
-                events.append(
-                    {
-                        "title": f"{program}: {course}",
-                        "date": start_date if start_date else session,
-                        "ages": "Varies",
-                        "location": "Greater Boston YMCA",
-                        "latitude": "42.3601",
-                        "longitude": "-71.0589",
-                        "url": url,
-                    }
+                print("[DEBUG] Main YMCA table is visible.")
+            except Exception as e:
+                print(f"[WARN] YMCA table did not become visible: {e}")
+                count("scrape.page_failures", source="YMCA Boston")
+                browser.close()  # Ensure browser is closed on error
+                return events
+
+            # 2. Wait for the loading spinner to be hidden and the rows to settle
+            if not wait_until_ready(
+                page,
+                "YMCA Boston",
+                YMCA_ROW_SELECTOR,
+                hidden_selector=YMCA_SPINNER_SELECTOR,
+            ):
+                print(
+                    "[WARN] YMCA table content not found or page did not load as expected"
                 )
+                count("scrape.page_failures", source="YMCA Boston")
+                browser.close()  # Ensure browser is closed on error
+                return events
+        # --- END IMPROVED WAITING STRATEGY ---
 
+        with span("scrape.extract", source="YMCA Boston"):
+            rows = extract_cards(page.locator(YMCA_ROW_SELECTOR), YMCA_ROW_SCHEMA)
+        print(f"[DEBUG] Found {len(rows)} YMCA entries")
+        count("scrape.cards", len(rows), source="YMCA Boston")
+
+        for i, row in enumerate(rows):
+            try:
+                event = build_ymca_event(check_row(row))
+                if event:
+                    events.append(event)
             except Exception as e:
+                count("scrape.card_errors", source="YMCA Boston")
                 print(f"[WARN] Error parsing YMCA row {i + 1}: {e}")
 
         browser.close()
@@ -307,66 +356,40 @@ def fetch_national_audubon_events(pages=3):
     events = []
 
     with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
+        browser = p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        page = browser.new_page(**CONTEXT_OPTIONS)
+        apply_profile_sync(page, "National Audubon", urlparse(BASE_NATL).netloc)
 
         for page_num in range(1, pages + 1):
-            url = f"https://www.audubon.org/events?view_type=row&page={page_num}"
+            url = national_audubon_page_url(page_num)
             print(f"[DEBUG] Navigating to {url}")
-            page.goto(url, timeout=60000)
-            page.wait_for_timeout(4000)
+            with span("scrape.navigate", source="National Audubon"):
+                page.goto(url, timeout=60000)
+            with span("scrape.ready", source="National Audubon"):
+                wait_until_ready(
+                    page, f"National Audubon page {page_num}", NATL_CARD_SELECTOR
+                )
 
-            cards = page.locator(".event-card-item")
-            count = cards.count()
-            print(f"[DEBUG] Found {count} National Audubon events on page {page_num}.")
+            with span("scrape.extract", source="National Audubon"):
+                rows = extract_cards(page.locator(NATL_CARD_SELECTOR), NATL_CARD_SCHEMA)
+            print(
+                f"[DEBUG] Found {len(rows)} National Audubon events on page {page_num}."
+            )
+            count("scrape.cards", len(rows), source="National Audubon")
 
-            for i in range(count):
+            for i, row in enumerate(rows):
                 try:
-                    card = cards.nth(i)
-
-                    link_el = card.locator("a.card-link")
-                    title = link_el.inner_text()
-                    href = link_el.get_attribute("href")
-                    url = urljoin("https://www.audubon.org", href)
-
-                    time_text = card.locator(
-                        ".event-card-item-header__time--time"
-                    ).inner_text()
-
-                    months = card.locator(
-                        ".event-card-item-header__month span"
-                    ).all_inner_texts()
-                    month = [m.strip() for m in months if m.strip()][-1]
-                    day = (
-                        card.locator(".event-card-item-header__date span")
-                        .nth(0)
-                        .inner_text()
-                    )
-                    date = f"{month} {day}"
-
-                    location = (
-                        card.locator(".event-card-item-location").inner_text().strip()
-                    )
+                    event = build_national_audubon_event(check_row(row))
 
                     # --- Geocoding for National Audubon events (Improved) ---
-                    latitude, longitude = get_lat_lon_for_national_audubon_event(
-                        location
+                    event["latitude"], event["longitude"] = (
+                        get_lat_lon_for_national_audubon_event(event["location"])
                     )
                     # --- End of Geocoding improvement ---
 
-                    events.append(
-                        {
-                            "title": title.strip(),
-                            "date": f"{date} — {time_text}",
-                            "ages": "All ages",
-                            "location": location,
-                            "latitude": latitude,
-                            "longitude": longitude,
-                            "url": url,
-                        }
-                    )
-
+                    events.append(event)
                 except Exception as e:
+                    count("scrape.card_errors", source="National Audubon")
                     print(
                         f"[WARN] Error parsing National Audubon card {i + 1} on page {page_num}: {e}"
                     )
@@ -376,19 +399,31 @@ def fetch_national_audubon_events(pages=3):
 
 
 if __name__ == "__main__":
-    print("[DEBUG] Starting combined scrape...")
-
-    try:
-        mass_events = fetch_events_with_playwright(pages=3)
-        natl_events = fetch_national_audubon_events(pages=3)
-        ymca_events = fetch_ymca_boston_events()  # Call the new YMCA function
-
-        all_events = mass_events + natl_events + ymca_events
+    # The sources are scraped concurrently in one shared browser; see scrape_runner.py.
+    # The fetch_* functions above still work on their own for one-off runs/debugging.
+    import argparse
 
-        with open("audubon_events.json", "w", encoding="utf-8") as f:
-            json.dump(all_events, f, ensure_ascii=False, indent=2)
+    from scrape_runner import DEFAULT_PAGE_BUDGET, run_scrape
 
-        print(f"[DEBUG] Saved {len(all_events)} total events to audubon_events.json")
+    parser = argparse.ArgumentParser(description="Scrape family events.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only crawl until pages with already-known events are reached",
+    )
+    parser.add_argument(
+        "--page-budget",
+        type=int,
+        default=DEFAULT_PAGE_BUDGET,
+        help="max pages per paginated source in one run",
+    )
+    args = parser.parse_args()
 
+    try:
+        run_scrape(
+            output_path="audubon_events.json",
+            incremental=args.incremental,
+            page_budget=args.page_budget,
+        )
     except Exception as e:
         print("[ERROR]", str(e))
@@ -0,0 +1,322 @@
+"""
+Record/replay benchmark for the scrapers.
+
+`record` runs every source once against the live site with Playwright's HAR
+recorder on, saving everything the pages load (HTML, JS, the YMCA XHRs) to
+fixtures/scrape/<source>.har. `run` replays those files through
+context.route_from_har(), so nothing goes to the network, and times each
+source's page scraper (the same ones scrape_runner.py uses):
+
+    per page     load_ms (goto + readiness wait), extract_ms (card
+                 extraction and event building), cards, requests, blocked
+                 requests and response bytes
+    per source   wall_ms (median of --repeat runs), cards_per_sec, and the
+                 peak memory allocated by Python while it ran
+    overall      max RSS of this process and of Chromium
+
+Pages are loaded with their page profile (page_profile.py) unless
+--no-profile is given; comparing the two runs shows the load time and bytes a
+profile saves per page. Recording is always done without profiles, so the
+fixtures have everything a page asks for.
+
+Geocoding isn't part of the page scrapers and isn't timed. Results are saved
+as JSON named after the commit, so two runs can be compared:
+
+    python scrape_bench.py record
+    python scrape_bench.py run --repeat 5
+    python scrape_bench.py run --no-profile
+    python scrape_bench.py compare bench_results/OLD.json bench_results/NEW.json
+"""
+
+import asyncio
+import json
+import os
+import platform
+import re
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+from playwright.async_api import async_playwright
+
+from bench_util import RESULTS_DIR, git_commit
+from page_profile import CONTEXT_OPTIONS, LAUNCH_ARGS, NO_BLOCKING, apply_profile
+from scrape_runner import SOURCES
+
+FIXTURES_DIR = os.path.join("fixtures", "scrape")
+DEFAULT_REPEAT = 3
+
+
+def har_path(source, fixtures_dir=FIXTURES_DIR):
+    slug = re.sub(r"[^a-z0-9]+", "_", source["name"].lower()).strip("_")
+    return os.path.join(fixtures_dir, f"{slug}.har")
+
+
+class _TimedPage:
+    """
+    Passes everything through to a Playwright page, noting when the scraper
+    starts extracting: its first locator() call (the readiness waits don't
+    use locators).
+    """
+
+    def __init__(self, page):
+        self._page = page
+        self.extract_started = None
+
+    def __getattr__(self, name):
+        return getattr(self._page, name)
+
+    def locator(self, *args, **kwargs):
+        if self.extract_started is None:
+            self.extract_started = time.perf_counter()
+        return self._page.locator(*args, **kwargs)
+
+
+async def record_fixtures(sources=None, fixtures_dir=FIXTURES_DIR):
+    """
+    Scrapes every source's pages live, saving one HAR file per source.
+    """
+    sources = SOURCES if sources is None else sources
+    os.makedirs(fixtures_dir, exist_ok=True)
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            for source in sources:
+                path = har_path(source, fixtures_dir)
+                context = await browser.new_context(
+                    record_har_path=path, record_har_content="embed"
+                )
+                cards = 0
+                try:
+                    for page_num in range(1, source["pages"] + 1):
+                        page = await context.new_page()
+                        try:
+                            cards += len(await source["scrape_page"](page, page_num))
+                        finally:
+                            await page.close()
+                finally:
+                    await context.close()  # Writes the HAR
+                print(
+                    f"[DEBUG] Recorded {source['name']}: {source['pages']} page(s), "
+                    f"{cards} cards, {os.path.getsize(path) / 1024:.0f} KiB -> {path}"
+                )
+        finally:
+            await browser.close()
+
+
+async def _replay_source(browser, source, fixtures_dir, profile=True):
+    """
+    One replayed run of a source, pages one after another.
+    """
+    context = await browser.new_context(**(CONTEXT_OPTIONS if profile else {}))
+    # Requests that aren't in the recording fail instead of going online
+    await context.route_from_har(har_path(source, fixtures_dir), not_found="abort")
+    pages = []
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        for page_num in range(1, source["pages"] + 1):
+            page = _TimedPage(await context.new_page())
+            stats = await apply_profile(
+                page._page,
+                source["name"],
+                source["host"],
+                source.get("profile") if profile else NO_BLOCKING,
+                track_bytes=True,
+            )
+            page_started = time.perf_counter()
+            try:
+                events = await source["scrape_page"](page, page_num)
+            finally:
+                finished = time.perf_counter()
+                await stats.settle()
+                await page.close()
+            extract_started = page.extract_started or finished
+            pages.append(
+                {
+                    "page": page_num,
+                    "load_ms": round((extract_started - page_started) * 1000, 1),
+                    "extract_ms": round((finished - extract_started) * 1000, 1),
+                    "cards": len(events),
+                    **stats.as_dict(),
+                }
+            )
+    finally:
+        await context.close()
+    wall = time.perf_counter() - started
+    return {
+        "wall_ms": round(wall * 1000, 1),
+        "cards": sum(p["cards"] for p in pages),
+        "python_peak_kib": round(tracemalloc.get_traced_memory()[1] / 1024),
+        "pages": pages,
+    }
+
+
+async def run_benchmark(
+    sources=None, repeat=DEFAULT_REPEAT, fixtures_dir=FIXTURES_DIR, profile=True
+):
+    """
+    {source name: results}. Every source is replayed `repeat` times; the
+    median run (by wall time) is reported along with all wall times.
+    """
+    sources = SOURCES if sources is None else sources
+    missing = [har_path(s, fixtures_dir) for s in sources]
+    missing = [path for path in missing if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(
+            f"No recording for {', '.join(missing)}; run `python scrape_bench.py record`"
+        )
+
+    results = {}
+    tracemalloc.start()
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+            try:
+                for source in sources:
+                    runs = [
+                        await _replay_source(browser, source, fixtures_dir, profile)
+                        for _ in range(repeat)
+                    ]
+                    runs.sort(key=lambda run: run["wall_ms"])
+                    median = runs[len(runs) // 2]
+                    seconds = median["wall_ms"] / 1000
+                    results[source["name"]] = {
+                        **median,
+                        "cards_per_sec": (
+                            round(median["cards"] / seconds, 1) if seconds else None
+                        ),
+                        "wall_ms_runs": [run["wall_ms"] for run in runs],
+                        "python_peak_kib": max(run["python_peak_kib"] for run in runs),
+                    }
+            finally:
+                await browser.close()
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+def _max_rss_kib(who):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def save_results(sources, repeat, profile=True, out_dir=RESULTS_DIR):
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "profile": profile,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "sources": sources,
+        # Chromium has exited by now, so it is counted under children
+        "max_rss_kib": _max_rss_kib(resource.RUSAGE_SELF),
+        "browser_max_rss_kib": _max_rss_kib(resource.RUSAGE_CHILDREN),
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(
+        out_dir,
+        f"scrape_{commit or 'nogit'}{'' if profile else '_noprofile'}_"
+        f"{time.strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path, report
+
+
+def print_report(report):
+    for name, result in report["sources"].items():
+        pages = result["pages"]
+        print(
+            f"[BENCH] {name}: {result['wall_ms']:.0f} ms, {result['cards']} cards "
+            f"({result['cards_per_sec']} cards/s), load "
+            f"{statistics.mean(p['load_ms'] for p in pages):.0f} ms/page, extract "
+            f"{statistics.mean(p['extract_ms'] for p in pages):.0f} ms/page, "
+            f"{_kib_per_page(result):.0f} KiB/page "
+            f"({sum(p['blocked'] for p in pages)} requests blocked), "
+            f"Python peak {result['python_peak_kib']} KiB"
+        )
+    print(
+        f"[BENCH] max RSS: {report['max_rss_kib']} KiB (Python), "
+        f"{report['browser_max_rss_kib']} KiB (Chromium)"
+    )
+
+
+def _load_ms_per_page(result):
+    return statistics.mean(p["load_ms"] for p in result["pages"])
+
+
+def _kib_per_page(result):
+    # Runs saved before page profiles have no byte counts
+    return statistics.mean(p.get("bytes", 0) for p in result["pages"]) / 1024
+
+
+def compare(old_path, new_path):
+    """
+    Prints the per-source change in wall time, throughput, load time and
+    bytes per page between two saved runs (e.g. --no-profile vs profiled).
+    """
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    label = lambda report: (
+        f"{report['commit']}"
+        + ("" if report.get("profile", False) else " (no profile)")
+    )
+    print(f"[BENCH] {label(old)} -> {label(new)}")
+    for name, result in new["sources"].items():
+        before = old["sources"].get(name)
+        if before is None:
+            print(f"[BENCH] {name}: new source, {result['wall_ms']:.0f} ms")
+            continue
+        change = (result["wall_ms"] - before["wall_ms"]) / before["wall_ms"] * 100
+        print(
+            f"[BENCH] {name}: {before['wall_ms']:.0f} -> {result['wall_ms']:.0f} ms "
+            f"({change:+.1f}%), {before['cards_per_sec']} -> "
+            f"{result['cards_per_sec']} cards/s, load "
+            f"{_load_ms_per_page(before):.0f} -> {_load_ms_per_page(result):.0f} "
+            f"ms/page, {_kib_per_page(before):.0f} -> {_kib_per_page(result):.0f} "
+            f"KiB/page"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Scraper record/replay benchmark.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="record HAR fixtures live")
+    run_parser = commands.add_parser("run", help="benchmark against the fixtures")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument(
+        "--no-profile", action="store_true", help="load everything (the baseline)"
+    )
+    for sub in (record_parser, run_parser):
+        sub.add_argument("--fixtures", default=FIXTURES_DIR)
+        sub.add_argument(
+            "--source", action="append", help="only this source (repeatable)"
+        )
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        selected = [s for s in SOURCES if not args.source or s["name"] in args.source]
+        if args.command == "record":
+            asyncio.run(record_fixtures(selected, args.fixtures))
+        else:
+            profile = not args.no_profile
+            results = asyncio.run(
+                run_benchmark(selected, args.repeat, args.fixtures, profile)
+            )
+            path, report = save_results(results, args.repeat, profile)
+            print_report(report)
+            print(f"[BENCH] Saved {path}")
@@ -0,0 +1,544 @@
+"""
+Runs all the event sources concurrently instead of one after another.
+
+One Chromium is launched and shared; every source gets its own browser context,
+its pages are fetched in parallel (bounded per host), and every source has its
+own timeout. A source that fails or times out only loses its own (remaining)
+pages - everything already scraped from the other sources is kept.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from playwright.async_api import async_playwright
+
+from event_store import EVENT_STORE_PATH, EVENTS_JSON_PATH, SNAPSHOT_PATH, EventStore
+from extract import async_extract_cards, check_row
+from metrics import count, span
+from page_profile import CONTEXT_OPTIONS, LAUNCH_ARGS, apply_profile
+from rate_limit import async_acquire
+from readiness import NETWORK_IDLE_TIMEOUT_MS, async_wait_until_ready
+from scrape_state import (
+    SCRAPE_STATE_PATH,
+    default_event_key,
+    event_fingerprint,
+    load_scrape_state,
+    save_scrape_state,
+    source_state,
+)
+from scr import (
+    BASE_MASS,
+    BASE_NATL,
+    MASS_CARD_SCHEMA,
+    MASS_CARD_SELECTOR,
+    NATL_CARD_SCHEMA,
+    NATL_CARD_SELECTOR,
+    YMCA_ROW_SCHEMA,
+    YMCA_ROW_SELECTOR,
+    YMCA_SPINNER_SELECTOR,
+    YMCA_TABLE_SELECTOR,
+    YMCA_URL,
+    build_mass_audubon_event,
+    build_national_audubon_event,
+    build_ymca_event,
+    get_lat_lon_for_national_audubon_event,
+    mass_audubon_page_url,
+    national_audubon_page_url,
+)
+
+# Max pages open at once against the same host (be polite to the sites)
+HOST_CONCURRENCY = {
+    "www.massaudubon.org": 3,
+    "www.audubon.org": 3,
+    "community.ymcaboston.org": 1,
+}
+DEFAULT_HOST_CONCURRENCY = 2
+
+# Geocoding is blocking, so it runs off the event loop. rate_limit.py holds
+# Nominatim to 1 request/second however many lookups run at once, and lookups
+# answered by the cache or gazetteer don't queue behind the ones waiting on it.
+_geocode_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="geocode")
+
+
+# --- Per-page scrapers (async versions of the fetch_* functions in scr.py) ---
+
+
+class PageFailed(Exception):
+    """
+    A listing page didn't load or none of its cards could be read. Unlike a
+    page that loaded with no cards, this doesn't mean the source has run out
+    of events.
+    """
+
+
+async def _wait_for_cards(page, response, label, selector):
+    """
+    Waits for the cards of a listing page. Returns quietly when they show up,
+    or when the page finished loading (network idle) with none; raises
+    PageFailed when the request failed or the page is still loading.
+    """
+    if response is not None and not response.ok:
+        raise PageFailed(f"{label}: HTTP {response.status}")
+    if await async_wait_until_ready(page, label, selector):
+        return
+    try:
+        await page.wait_for_load_state("networkidle", timeout=NETWORK_IDLE_TIMEOUT_MS)
+    except Exception as e:
+        raise PageFailed(f"{label}: no cards and the page is still loading") from e
+    if await page.query_selector(selector) is None:
+        print(f"[DEBUG] {label} loaded with no cards.")
+
+
+async def scrape_mass_audubon_page(page, page_num):
+    url = mass_audubon_page_url(page_num)
+    print(f"[DEBUG] Navigating to {url}")
+    with span("scrape.navigate", source="Mass Audubon"):
+        response = await page.goto(url, timeout=60000)
+    with span("scrape.ready", source="Mass Audubon"):
+        await _wait_for_cards(
+            page, response, f"Mass Audubon page {page_num}", MASS_CARD_SELECTOR
+        )
+
+    with span("scrape.extract", source="Mass Audubon"):
+        rows = await async_extract_cards(
+            page.locator(MASS_CARD_SELECTOR), MASS_CARD_SCHEMA
+        )
+    print(f"[DEBUG] Found {len(rows)} Mass Audubon events on page {page_num}.")
+    count("scrape.cards", len(rows), source="Mass Audubon")
+
+    events = []
+    for i, row in enumerate(rows):
+        try:
+            events.append(build_mass_audubon_event(check_row(row)))
+        except Exception as e:
+            count("scrape.card_errors", source="Mass Audubon")
+            print(
+                f"[WARN] Error parsing Mass Audubon card {i + 1} on page {page_num}: {e}"
+            )
+    if rows and not events:
+        raise PageFailed(f"none of the {len(rows)} cards on page {page_num} parsed")
+    return events
+
+
+async def scrape_national_audubon_page(page, page_num):
+    url = national_audubon_page_url(page_num)
+    print(f"[DEBUG] Navigating to {url}")
+    with span("scrape.navigate", source="National Audubon"):
+        response = await page.goto(url, timeout=60000)
+    with span("scrape.ready", source="National Audubon"):
+        await _wait_for_cards(
+            page, response, f"National Audubon page {page_num}", NATL_CARD_SELECTOR
+        )
+
+    with span("scrape.extract", source="National Audubon"):
+        rows = await async_extract_cards(
+            page.locator(NATL_CARD_SELECTOR), NATL_CARD_SCHEMA
+        )
+    print(f"[DEBUG] Found {len(rows)} National Audubon events on page {page_num}.")
+    count("scrape.cards", len(rows), source="National Audubon")
+
+    events = []
+    for i, row in enumerate(rows):
+        try:
+            # Coordinates are filled in later by _fill_coordinates()
+            events.append(build_national_audubon_event(check_row(row)))
+        except Exception as e:
+            count("scrape.card_errors", source="National Audubon")
+            print(
+                f"[WARN] Error parsing National Audubon card {i + 1} on page {page_num}: {e}"
+            )
+    if rows and not events:
+        raise PageFailed(f"none of the {len(rows)} cards on page {page_num} parsed")
+    return events
+
+
+async def scrape_ymca_boston_page(page, page_num):
+    url = YMCA_URL
+    print(f"[DEBUG] Navigating to {url}")
+    with span("scrape.navigate", source="YMCA Boston"):
+        await page.goto(url, timeout=60000)
+
+    with span("scrape.ready", source="YMCA Boston"):
+        try:
+            await page.wait_for_selector(
+                YMCA_TABLE_SELECTOR, state="visible", timeout=20000
+            )
+        except Exception as e:
+            raise PageFailed(f"YMCA table did not become visible: {e}") from e
+        if not await async_wait_until_ready(
+            page,
+            "YMCA Boston",
+            YMCA_ROW_SELECTOR,
+            hidden_selector=YMCA_SPINNER_SELECTOR,
+        ):
+            raise PageFailed(
+                "YMCA table content not found or page did not load as expected"
+            )
+
+    with span("scrape.extract", source="YMCA Boston"):
+        rows = await async_extract_cards(
+            page.locator(YMCA_ROW_SELECTOR), YMCA_ROW_SCHEMA
+        )
+    print(f"[DEBUG] Found {len(rows)} YMCA entries")
+    count("scrape.cards", len(rows), source="YMCA Boston")
+
+    events = []
+    for i, row in enumerate(rows):
+        try:
+            event = build_ymca_event(check_row(row))
+            if event:
+                events.append(event)
+        except Exception as e:
+            count("scrape.card_errors", source="YMCA Boston")
+            print(f"[WARN] Error parsing YMCA row {i + 1}: {e}")
+    return events
+
+
+# --- Source table ---
+# "pages" is how many listing pages a non-paginated source has (and how many
+# scrape_bench.py records), "timeout" is the wall-clock budget (seconds) for
+# the whole source. "paginated" sources are crawled page by page until they
+# run out of events (see _crawl_paginated); "geocode" sources get coordinates
+# from the location text. "profile" replaces the source's page profile from
+# page_profile.py. The list order is the order of the output file.
+SOURCES = [
+    {
+        "name": "Mass Audubon",
+        "host": urlparse(BASE_MASS).netloc,
+        "pages": 3,
+        "timeout": 180,
+        "paginated": True,
+        "scrape_page": scrape_mass_audubon_page,
+    },
+    {
+        "name": "National Audubon",
+        "host": urlparse(BASE_NATL).netloc,
+        "pages": 3,
+        "timeout": 600,  # Includes (rate limited) geocoding
+        "paginated": True,
+        "geocode": True,
+        "scrape_page": scrape_national_audubon_page,
+    },
+    {
+        "name": "YMCA Boston",
+        "host": urlparse(YMCA_URL).netloc,
+        "pages": 1,
+        "timeout": 120,
+        "paginated": False,
+        "scrape_page": scrape_ymca_boston_page,
+        # Every row links to the same registration page
+        "event_key": lambda e: f"{e['url']}#{e['title']}#{e['date']}",
+    },
+]
+
+# Paginated sources are crawled until a page has no events (or, in incremental
+# runs, only known ones), but never past this many pages in a single run.
+DEFAULT_PAGE_BUDGET = 20
+# Events kept from unfetched pages may have been cancelled, so an incremental
+# run crawls the whole source (and drops what's gone) once this much time has
+# passed since the last complete crawl.
+FULL_CRAWL_INTERVAL = 24 * 3600
+
+
+async def _fill_coordinates(source, events, known):
+    """
+    Geocodes events of "geocode" sources, reusing the coordinates from the last
+    run for events whose content hasn't changed.
+    """
+    if not source.get("geocode"):
+        return
+    event_key = source.get("event_key", default_event_key)
+    loop = asyncio.get_running_loop()
+    for event in events:
+        previous = known.get(event_key(event))
+        if (
+            previous
+            and previous["fingerprint"] == event_fingerprint(event)
+            and previous["event"].get("latitude") is not None
+        ):
+            event["latitude"] = previous["event"]["latitude"]
+            event["longitude"] = previous["event"]["longitude"]
+            continue
+        event["latitude"], event["longitude"] = await loop.run_in_executor(
+            _geocode_executor, get_lat_lon_for_national_audubon_event, event["location"]
+        )
+
+
+async def _scrape_one_page(context, source, page_num, host_limit, results, known):
+    async with host_limit:
+        await async_acquire(source["host"])  # Pages per second, on top of the limit
+        page = await context.new_page()
+        try:
+            # Images, fonts, trackers... are aborted (see page_profile.py)
+            await apply_profile(
+                page, source["name"], source["host"], source.get("profile")
+            )
+            with span("scrape.page", source=source["name"]):
+                events = await source["scrape_page"](page, page_num)
+        except Exception as e:
+            print(f"[WARN] {source['name']} page {page_num} failed: {e}")
+            count("scrape.page_failures", source=source["name"])
+            return
+        finally:
+            await page.close()
+    await _fill_coordinates(source, events, known)
+    results[page_num] = events
+
+
+async def _crawl_all_pages(context, source, host_limit, results, known):
+    await asyncio.gather(
+        *[
+            _scrape_one_page(context, source, page_num, host_limit, results, known)
+            for page_num in range(1, source["pages"] + 1)
+        ]
+    )
+
+
+async def _crawl_paginated(
+    context,
+    source,
+    host_limit,
+    window,
+    results,
+    known,
+    page_budget,
+    crawl,
+    stop_at_known,
+):
+    """
+    Fetches pages `window` at a time until a page is empty (source exhausted)
+    or failed, or `page_budget` pages have been fetched. With `stop_at_known`
+    (incremental runs) it also stops at the first page that only has events
+    we already know about.
+    """
+    event_key = source.get("event_key", default_event_key)
+    next_page = 1
+    while next_page <= page_budget:
+        batch = range(next_page, min(next_page + window, page_budget + 1))
+        await asyncio.gather(
+            *[
+                _scrape_one_page(context, source, page_num, host_limit, results, known)
+                for page_num in batch
+            ]
+        )
+        for page_num in batch:
+            events = results.get(page_num)
+            if events is None:
+                crawl["stop"] = f"page {page_num} failed"
+                return
+            if not events:
+                crawl["stop"] = f"page {page_num} is empty"
+                crawl["exhausted"] = True
+                return
+            if stop_at_known and all(
+                known.get(event_key(e), {}).get("fingerprint") == event_fingerprint(e)
+                for e in events
+            ):
+                crawl["stop"] = f"page {page_num} is all known events"
+                return
+        next_page += window
+    crawl["stop"] = f"page budget ({page_budget}) reached"
+
+
+def _merge_with_known(source, results, state, crawl):
+    """
+    Builds the source's event list and updates its saved state. Known events
+    that weren't seen this run (they live on pages an incremental crawl
+    didn't need to fetch, or that failed) are kept unless the crawl reached
+    the last page.
+    """
+    event_key = source.get("event_key", default_event_key)
+    saved = source_state(state, source["name"])
+    known = saved["events"]
+
+    events = [event for page_num in sorted(results) for event in results[page_num]]
+    new = changed = 0
+    seen = {}
+    for event in events:
+        key = event_key(event)
+        fingerprint = event_fingerprint(event)
+        if key not in known:
+            new += 1
+        elif known[key]["fingerprint"] != fingerprint:
+            changed += 1
+        seen[key] = {"fingerprint": fingerprint, "event": event}
+
+    if crawl.get("exhausted"):
+        saved["complete_at"] = time.time()
+    else:
+        for key, entry in known.items():
+            if key not in seen:
+                seen[key] = entry
+                events.append(entry["event"])
+
+    saved["events"] = seen
+    print(
+        f"[DEBUG] {source['name']}: {len(events)} events "
+        f"({new} new, {changed} changed, {len(results)} page(s) fetched"
+        + (f", stopped: {crawl['stop']}" if crawl.get("stop") else "")
+        + ")."
+    )
+    return events
+
+
+async def scrape_source(context, source, host_limits, state, incremental, page_budget):
+    """
+    Scrapes one source with pages from `context`. Returns (events, complete):
+    whatever was collected before a failure or the source timeout, and
+    whether the crawl saw everything (the source's last page, or every page
+    of a non-paginated source), so that events missing from the list are
+    really gone.
+    """
+    results = {}  # page_num -> events, filled in as pages finish
+    crawl = {}
+    host_limit, window = host_limits[source["host"]]
+    saved = source_state(state, source["name"])
+    known = saved["events"]
+    if incremental and time.time() - (saved["complete_at"] or 0) > FULL_CRAWL_INTERVAL:
+        print(
+            f"[DEBUG] {source['name']}: last complete crawl is too old, crawling all."
+        )
+        incremental = False
+    try:
+        if source.get("paginated"):
+            crawl_task = _crawl_paginated(
+                context,
+                source,
+                host_limit,
+                window,
+                results,
+                known,
+                page_budget,
+                crawl,
+                stop_at_known=incremental,
+            )
+        else:
+            crawl_task = _crawl_all_pages(context, source, host_limit, results, known)
+        await asyncio.wait_for(crawl_task, timeout=source["timeout"])
+        if not source.get("paginated") and len(results) == source["pages"]:
+            crawl["exhausted"] = True  # Every page loaded
+    except asyncio.TimeoutError:
+        print(
+            f"[WARN] {source['name']} timed out after {source['timeout']}s, "
+            f"keeping {len(results)} finished page(s)."
+        )
+        count("scrape.source_timeouts", source=source["name"])
+        crawl["stop"] = "timeout"
+    except Exception as e:
+        print(f"[ERROR] {source['name']} failed: {e}")
+        count("scrape.source_failures", source=source["name"])
+        crawl["stop"] = "error"
+
+    events = _merge_with_known(source, results, state, crawl)
+    return events, bool(crawl.get("exhausted"))
+
+
+async def _run_source(browser, source, host_limits, state, incremental, page_budget):
+    """
+    scrape_source() in a browser context of its own.
+    """
+    context = await browser.new_context(**CONTEXT_OPTIONS)
+    try:
+        return await scrape_source(
+            context, source, host_limits, state, incremental, page_budget
+        )
+    finally:
+        await context.close()
+
+
+def host_limits_for(sources, host_concurrency=None):
+    """
+    {host: (semaphore, window)} bounding the pages open at once per host.
+    """
+    limits = dict(HOST_CONCURRENCY)
+    limits.update(host_concurrency or {})
+    host_limits = {}
+    for source in sources:
+        n = limits.get(source["host"], DEFAULT_HOST_CONCURRENCY)
+        host_limits.setdefault(source["host"], (asyncio.Semaphore(n), n))
+    return host_limits
+
+
+def store_source(store, source, events, complete):
+    """
+    Upserts a source's current event list. Stored events missing from it are
+    only removed when the crawl was `complete` (see scrape_source); after a
+    timeout or failed page they may just be on a page we didn't get.
+    """
+    stats = store.upsert(
+        source["name"],
+        events,
+        source.get("event_key", default_event_key),
+        remove_missing=complete and bool(events),
+    )
+    print(f"[DEBUG] {source['name']} stored: {stats}")
+    return stats
+
+
+async def scrape_all(
+    sources=None,
+    host_concurrency=None,
+    state=None,
+    incremental=False,
+    page_budget=DEFAULT_PAGE_BUDGET,
+):
+    """
+    Scrapes all sources concurrently and returns {source name: (events,
+    complete)} (see scrape_source).
+    `state` (see scrape_state.py) is updated in place.
+    """
+    sources = SOURCES if sources is None else sources
+    state = {} if state is None else state
+    host_limits = host_limits_for(sources, host_concurrency)
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        try:
+            results = await asyncio.gather(
+                *[
+                    _run_source(
+                        browser, source, host_limits, state, incremental, page_budget
+                    )
+                    for source in sources
+                ]
+            )
+        finally:
+            await browser.close()
+    return {source["name"]: events for source, events in zip(sources, results)}
+
+
+def run_scrape(
+    output_path=EVENTS_JSON_PATH,
+    sources=None,
+    host_concurrency=None,
+    incremental=False,
+    page_budget=DEFAULT_PAGE_BUDGET,
+    state_path=SCRAPE_STATE_PATH,
+    store_path=EVENT_STORE_PATH,
+    snapshot_path=SNAPSHOT_PATH,
+):
+    print(
+        "[DEBUG] Starting combined scrape"
+        + (" (incremental)..." if incremental else "...")
+    )
+    sources = SOURCES if sources is None else sources
+    state = load_scrape_state(state_path)
+    by_source = asyncio.run(
+        scrape_all(sources, host_concurrency, state, incremental, page_budget)
+    )
+
+    store = EventStore(store_path)
+    for source in sources:
+        store_source(store, source, *by_source[source["name"]])
+    all_events = store.publish(output_path, snapshot_path)
+    store.close()
+    save_scrape_state(state, state_path)
+
+    print(f"[DEBUG] Saved {len(all_events)} total events to {output_path}")
+    return all_events
+
+
+if __name__ == "__main__":
+    run_scrape()
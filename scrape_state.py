@@ -0,0 +1,63 @@
+"""
+What the scrapers saw last time, for incremental runs.
+
+For every source we remember each event (keyed by a stable event key) together
+with a fingerprint of its content, and when the source was last crawled to its
+end. An incremental run can then stop paginating as soon as it reaches a page
+whose events are all already known, and skip geocoding events that didn't
+change.
+
+Stored as JSON in scrape_state.json:
+
+    {
+        "National Audubon": {
+            "complete_at": <time of the last complete crawl>,
+            "events": {"<event key>": {"fingerprint": "...", "event": {...}}, ...}
+        },
+        ...
+    }
+"""
+
+import hashlib
+import json
+import os
+
+SCRAPE_STATE_PATH = "scrape_state.json"
+
+# Fields that describe the event itself (coordinates are derived from location)
+_FINGERPRINT_FIELDS = ("title", "date", "ages", "location", "url")
+
+
+def default_event_key(event):
+    return event["url"]
+
+
+def event_fingerprint(event):
+    content = "\x1f".join(str(event.get(field) or "") for field in _FINGERPRINT_FIELDS)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def load_scrape_state(path=SCRAPE_STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Could not read {path}, starting a full crawl: {e}")
+        return {}
+
+
+def save_scrape_state(state, path=SCRAPE_STATE_PATH):
+    # Write to a temp file first so a crash never leaves a half-written state
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def source_state(state, source_name):
+    saved = state.setdefault(source_name, {"complete_at": None, "events": {}})
+    saved.pop("pages", None)  # Page fingerprints of older versions, unused
+    saved.setdefault("complete_at", None)
+    return saved
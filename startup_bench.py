@@ -0,0 +1,203 @@
+"""
+Startup time of the cli.py commands.
+
+Scheduled jobs start a new interpreter on every run, so whatever is imported
+before a job does anything is paid again every time. For every command this
+runs `python cli.py --startup-only COMMAND` (parse the arguments, do the
+command's imports, exit) and records:
+
+    wall_ms      median wall time of the process over --repeat runs
+    import_ms    time spent importing, from one run under -X importtime
+                 (the interpreter's own startup imports left out)
+    heaviest     the slowest imports made by cli.py and its command
+    heavy        which of HEAVY_MODULES the command loaded
+
+The bare interpreter (`python -c pass`) is measured the same way, as the
+floor. Results are saved as JSON named after the commit, so runs can be
+compared:
+
+    python startup_bench.py run --repeat 10
+    python startup_bench.py compare bench_results/OLD.json bench_results/NEW.json
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from bench_util import RESULTS_DIR, git_commit
+from cli import COMMANDS
+
+DEFAULT_REPEAT = 5
+HEAVIEST = 5
+
+# Libraries that each cost tens to hundreds of milliseconds to import
+HEAVY_MODULES = (
+    "playwright",
+    "google.genai",
+    "googleapiclient",
+    "google_auth_oauthlib",
+    "google.auth",
+    "geopy",
+    "pydantic",
+    "numpy",
+    "bs4",
+)
+
+_CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+
+
+def _argv(command):
+    if command is None:
+        return [sys.executable, "-c", "pass"]
+    return [sys.executable, _CLI, "--startup-only", command]
+
+
+def _wall_ms(argv):
+    start = time.perf_counter()
+    subprocess.run(argv, check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def _import_times(argv):
+    """
+    {module: (self_us, cumulative_us, depth)} from one run under -X importtime.
+    """
+    result = subprocess.run(
+        argv[:1] + ["-X", "importtime"] + argv[1:],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        # Names are indented two spaces per level of nesting
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return times
+
+
+def measure(command, repeat=DEFAULT_REPEAT, baseline=None):
+    """
+    The startup numbers of one command (None for the bare interpreter).
+    `baseline` is the interpreter's import times, left out of import_ms.
+    """
+    argv = _argv(command)
+    _wall_ms(argv)  # Warm the OS file cache and __pycache__
+    walls = [_wall_ms(argv) for _ in range(repeat)]
+    times = _import_times(argv)
+    own = {
+        name: value
+        for name, value in times.items()
+        if value[2] == 0 and name not in (baseline or {})
+    }
+    heaviest = sorted(own.items(), key=lambda item: item[1][1], reverse=True)
+    return {
+        "wall_ms": round(statistics.median(walls), 1),
+        "wall_ms_min": round(min(walls), 1),
+        "import_ms": round(sum(value[1] for value in own.values()) / 1000, 1),
+        "heaviest": {
+            name: round(value[1] / 1000, 1) for name, value in heaviest[:HEAVIEST]
+        },
+        "heavy": sorted(module for module in HEAVY_MODULES if module in times),
+    }, times
+
+
+def run_benchmark(commands=COMMANDS, repeat=DEFAULT_REPEAT):
+    python, baseline = measure(None, repeat)
+    results = {"python": python}
+    for command in commands:
+        results[command], _ = measure(command, repeat, baseline)
+    return results
+
+
+def save_results(results, repeat, out_dir=RESULTS_DIR):
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "commands": results,
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(
+        out_dir, f"startup_{commit or 'nogit'}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path, report
+
+
+def print_report(report):
+    for command, result in report["commands"].items():
+        heaviest = ", ".join(
+            f"{name} {ms:.0f} ms" for name, ms in result["heaviest"].items()
+        )
+        print(
+            f"[BENCH] {command}: {result['wall_ms']:.0f} ms "
+            f"(min {result['wall_ms_min']:.0f}), imports {result['import_ms']:.0f} ms"
+            + (f" [{heaviest}]" if heaviest else "")
+            + (f", loads {' '.join(result['heavy'])}" if result["heavy"] else "")
+        )
+
+
+def compare(old_path, new_path):
+    """
+    Prints the change in startup time, and in the heavy libraries loaded,
+    of every command between two saved runs.
+    """
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"[BENCH] {old['commit']} -> {new['commit']}")
+    for command, result in new["commands"].items():
+        before = old["commands"].get(command)
+        if before is None:
+            print(f"[BENCH] {command}: new command, {result['wall_ms']:.0f} ms")
+            continue
+        change = (result["wall_ms"] - before["wall_ms"]) / before["wall_ms"] * 100
+        dropped = sorted(set(before["heavy"]) - set(result["heavy"]))
+        added = sorted(set(result["heavy"]) - set(before["heavy"]))
+        print(
+            f"[BENCH] {command}: {before['wall_ms']:.0f} -> {result['wall_ms']:.0f} ms "
+            f"({change:+.1f}%), imports {before['import_ms']:.0f} -> "
+            f"{result['import_ms']:.0f} ms"
+            + (f", no longer loads {' '.join(dropped)}" if dropped else "")
+            + (f", now loads {' '.join(added)}" if added else "")
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="cli.py startup benchmark.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="time every command's startup")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument(
+        "--cli-command",
+        action="append",
+        choices=COMMANDS,
+        help="only this command (repeatable)",
+    )
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(args.old, args.new)
+    else:
+        results = run_benchmark(args.cli_command or COMMANDS, args.repeat)
+        path, report = save_results(results, args.repeat)
+        print_report(report)
+        print(f"[BENCH] Saved {path}")
@@ -0,0 +1,80 @@
+"""
+Offline stand-in for genai.Client(), for running and timing the newsletter
+pipeline without a network or API key.
+
+It answers generate_content() with a response whose .text is JSON like the
+real structured output: one event per link placeholder (<LINKn>) found in the
+prompt. Packed prompts ("=== MESSAGE <id> ===" sections) get events tagged
+with the message_id. `latency` and `per_token_latency` simulate model time,
+`failure_rate` makes some calls fail with a 429 so retries get exercised.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+
+_MESSAGE_HEADER_RE = re.compile(r"^=== MESSAGE (\S+) ===$", re.MULTILINE)
+_LINK_RE = re.compile(r"<LINK\d+>")
+
+
+class StubRateLimitError(Exception):
+    def __init__(self):
+        super().__init__("429 RESOURCE_EXHAUSTED (stub)")
+        self.code = 429
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+def _events_for(text, message_id=None):
+    events = []
+    for n, link in enumerate(dict.fromkeys(_LINK_RE.findall(text)), start=1):
+        event = {
+            "event_name": f"Stub event {n}",
+            "rating": "3-6",
+            "event_link": link,
+            "event_location": "Somewhere, MA",
+            "event_description": f"Stub description of event {n}.",
+        }
+        if message_id is not None:
+            event["message_id"] = message_id
+        events.append(event)
+    return events
+
+
+class _Models:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        client = self._client
+        with client._lock:
+            client.calls += 1
+            fail = client._rng.random() < client.failure_rate
+        time.sleep(client.latency + client.per_token_latency * len(contents) / 4)
+        if fail:
+            raise StubRateLimitError()
+
+        headers = list(_MESSAGE_HEADER_RE.finditer(contents))
+        if not headers:
+            return _Response(json.dumps(_events_for(contents)))
+        events = []
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(contents)
+            events.extend(_events_for(contents[header.end() : end], header.group(1)))
+        return _Response(json.dumps(events))
+
+
+class StubGenaiClient:
+    def __init__(self, latency=0.5, per_token_latency=0.0005, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.models = _Models(self)
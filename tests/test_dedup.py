@@ -0,0 +1,171 @@
+from dedup import canonical_url, dedupe_events
+
+BOSTON = {"latitude": "42.3601", "longitude": "-71.0589"}
+
+
+def event(source, title, start="2025-07-26T10:00", end="2025-07-26T12:00", **fields):
+    return {
+        "source": source,
+        "title": title,
+        "url": "",
+        "start": start,
+        "end": end,
+        **BOSTON,
+        **fields,
+    }
+
+
+def titles(merged):
+    return sorted(e["title"] for e in merged)
+
+
+def test_canonical_url_ignores_tracking_and_cosmetics():
+    assert canonical_url(
+        "http://www.Audubon.org/events/walk/?utm_source=x&b=2&a=1#top"
+    ) == canonical_url("https://audubon.org/events/walk?a=1&b=2&fbclid=y")
+    assert canonical_url("") == ""
+
+
+def test_same_program_from_two_sources_is_merged():
+    merged = dedupe_events(
+        [
+            event("Mass Audubon", "Family Bird Walk at Drumlin Farm"),
+            event(
+                "Newsletters",
+                "Family Bird Walk - Drumlin Farm",
+                description="Bring binoculars",
+            ),
+        ]
+    )
+    assert len(merged) == 1
+    assert [s["source"] for s in merged[0]["sources"]] == [
+        "Mass Audubon",
+        "Newsletters",
+    ]
+    # Missing fields are filled in from the other member
+    assert merged[0]["description"] == "Bring binoculars"
+
+
+def test_same_url_is_merged_across_blocks():
+    url = "https://www.massaudubon.org/programs/drumlin/12345"
+    merged = dedupe_events(
+        [
+            event("Mass Audubon", "Owl Prowl", url=url),
+            event(
+                "Newsletters", "Night hike for families", url=url + "?utm_source=mail"
+            ),
+        ]
+    )
+    assert len(merged) == 1
+
+
+def test_sessions_of_one_source_are_not_merged():
+    merged = dedupe_events(
+        [
+            event(
+                "YMCA Boston",
+                "Swim Lessons Level 1",
+                "2025-07-26T09:00",
+                "2025-07-26T09:45",
+            ),
+            event(
+                "YMCA Boston",
+                "Swim Lessons Level 1",
+                "2025-07-26T11:00",
+                "2025-07-26T11:45",
+            ),
+        ]
+    )
+    assert len(merged) == 2
+
+
+def test_shared_listing_url_of_one_source_is_not_an_identity():
+    url = "https://community.ymcaboston.org/s/registration"
+    merged = dedupe_events(
+        [
+            event("YMCA Boston", "Swim Lessons Level 1", url=url),
+            event("YMCA Boston", "Youth Basketball", url=url),
+        ]
+    )
+    assert len(merged) == 2
+
+
+def test_different_times_or_titles_are_not_merged():
+    merged = dedupe_events(
+        [
+            event("Mass Audubon", "Family Bird Walk", "2025-07-26T10:00"),
+            event(
+                "Newsletters",
+                "Family Bird Walk",
+                "2025-07-26T14:00",
+                "2025-07-26T15:00",
+            ),
+            event("National Audubon", "Pottery for Teens"),
+        ]
+    )
+    assert titles(merged) == [
+        "Family Bird Walk",
+        "Family Bird Walk",
+        "Pottery for Teens",
+    ]
+
+
+def test_different_days_or_places_are_not_merged():
+    merged = dedupe_events(
+        [
+            event("Mass Audubon", "Family Bird Walk"),
+            event(
+                "Newsletters",
+                "Family Bird Walk",
+                "2025-07-27T10:00",
+                "2025-07-27T12:00",
+            ),
+            event(
+                "National Audubon",
+                "Family Bird Walk",
+                latitude="40.7128",
+                longitude="-74.0060",
+            ),
+        ]
+    )
+    assert len(merged) == 3
+
+
+def test_matches_do_not_chain_through_a_source():
+    # Each newsletter session matches the Mass Audubon listing's title, but
+    # the 9am and 11am sessions must not end up in one group through it
+    merged = dedupe_events(
+        [
+            event(
+                "Newsletters",
+                "Summer Nature Camp",
+                "2025-07-26T09:00",
+                "2025-07-26T10:00",
+            ),
+            event(
+                "Newsletters",
+                "Summer Nature Camp",
+                "2025-07-26T11:00",
+                "2025-07-26T12:00",
+            ),
+            event(
+                "Mass Audubon",
+                "Summer Nature Camp",
+                "2025-07-26T09:30",
+                "2025-07-26T10:30",
+            ),
+        ]
+    )
+    assert len(merged) == 2
+    assert sorted(len(e["sources"]) for e in merged) == [1, 2]
+
+
+def test_undated_events_only_merge_on_an_identical_title():
+    merged = dedupe_events(
+        [
+            event("Mass Audubon", "Pond Exploration", None, None),
+            event("Newsletters", "Pond Exploration", None, None),
+            event("National Audubon", "Pond Exploration Club", None, None),
+        ]
+    )
+    assert titles(merged) == ["Pond Exploration", "Pond Exploration Club"]
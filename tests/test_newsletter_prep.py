@@ -0,0 +1,30 @@
+from newsletter_prep import estimate_tokens, prepare_newsletter, split_chunks
+
+
+def test_blocks_are_packed_into_chunks():
+    text = "\n\n".join(f"Event {i}: Saturday 10am, ages 4-10" for i in range(5))
+    assert split_chunks(text, max_tokens=1500) == [text]
+    chunks = split_chunks(text, max_tokens=20)
+    assert len(chunks) > 1
+    assert "\n\n".join(chunks) == text
+
+
+def test_newsletter_without_blank_lines_is_split():
+    text = "\n".join(f"Bird walk {i} - Sat Jul 26, 10am, ages 5+" for i in range(200))
+    chunks = split_chunks(text, max_tokens=100)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    assert "\n".join(chunks).split() == text.split()
+
+
+def test_long_line_is_cut_between_words():
+    text = " ".join(["<LINK12>"] * 500)  # One line, no newlines at all
+    chunks = split_chunks(text, max_tokens=50)
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+    assert all(word == "<LINK12>" for chunk in chunks for word in chunk.split())
+
+
+def test_prepare_keeps_every_chunk_under_the_limit():
+    body = "Upcoming camps " + "x" * 20000
+    prepared = prepare_newsletter(body, max_chunk_tokens=300)
+    assert all(estimate_tokens(chunk) <= 300 for chunk in prepared["chunks"])
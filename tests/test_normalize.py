@@ -0,0 +1,99 @@
+from datetime import date
+
+import pytest
+
+from normalize import (
+    MAX_AGE,
+    from_minutes,
+    normalize_event,
+    parse_age_range,
+    parse_date_range,
+    to_minutes,
+)
+
+TODAY = date(2025, 7, 1)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        (
+            "Thursday, July 24\n\n1:00-3:00pm",
+            ("2025-07-24T13:00", "2025-07-24T15:00"),
+        ),
+        ("JUL 23 — 7:00 pm - 9:00 pm", ("2025-07-23T19:00", "2025-07-23T21:00")),
+        ("Jul 26, 10:00-11:30am", ("2025-07-26T10:00", "2025-07-26T11:30")),
+        ("Jul 26, 11:00-1:00pm", ("2025-07-26T11:00", "2025-07-26T13:00")),
+        ("7/26/2025 10am", ("2025-07-26T10:00", "2025-07-26T10:00")),
+        ("2025-08-02", ("2025-08-02T00:00", "2025-08-02T23:59")),
+        ("Jul 28 - Aug 1, 9am-3pm", ("2025-07-28T09:00", "2025-08-01T15:00")),
+    ],
+)
+def test_parse_date_range(text, expected):
+    assert parse_date_range(text, TODAY) == expected
+
+
+def test_listing_without_a_year_long_past_is_next_year():
+    assert parse_date_range("Jan 10", TODAY)[0] == "2026-01-10T00:00"
+    # Recently past dates stay in this year
+    assert parse_date_range("Jun 20", TODAY)[0] == "2025-06-20T00:00"
+
+
+@pytest.mark.parametrize("text", [None, "", "Varies", "Ongoing", "TBD"])
+def test_unparseable_dates_are_none(text):
+    assert parse_date_range(text, TODAY) == (None, None)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Families - children 2 - 16 years", (2, 16)),
+        ("3-6", (3, 6)),
+        ("Ages 4 to 10", (4, 10)),
+        ("18 months - 3 years", (1, 3)),
+        ("Kids 6+", (6, MAX_AGE)),
+        ("8 and up", (8, MAX_AGE)),
+        ("Under 5", (0, 5)),
+        ("All ages", (0, MAX_AGE)),
+        ("Adults", (18, MAX_AGE)),
+        ("Varies", (None, None)),
+        (None, (None, None)),
+    ],
+)
+def test_parse_age_range(text, expected):
+    assert parse_age_range(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Grades 3-5", (8, 10)),
+        ("Grades K-5", (5, 10)),
+        ("3rd-5th grade", (8, 10)),
+        ("K-2", (5, 7)),
+        ("Grade 2", (7, 7)),
+        # Ages win over grades when both are given
+        ("Ages 5-12 (grades K-6)", (5, 12)),
+        ("Grades 3-5, ages 8+", (8, MAX_AGE)),
+    ],
+)
+def test_grades_are_read_as_school_ages(text, expected):
+    assert parse_age_range(text) == expected
+
+
+def test_minutes_round_trip():
+    assert from_minutes(to_minutes("2025-07-24T13:00")) == "2025-07-24T13:00"
+    assert to_minutes("1970-01-02") == 24 * 60
+
+
+def test_normalize_event_keeps_the_original_strings():
+    event = {"date": "Jul 26, 10am", "ages": "Grades 3-5"}
+    normalize_event(event, TODAY)
+    assert event == {
+        "date": "Jul 26, 10am",
+        "ages": "Grades 3-5",
+        "start": "2025-07-26T10:00",
+        "end": "2025-07-26T10:00",
+        "age_min": 8,
+        "age_max": 10,
+    }
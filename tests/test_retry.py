@@ -0,0 +1,49 @@
+import gmail_sync
+import imap
+from rate_limit import count_failure
+
+
+def test_count_failure_gives_up_at_max_attempts():
+    retry = {}
+    for _ in range(2):
+        assert count_failure(retry, [1, 2], 3) == []
+    assert retry == {"1": 2, "2": 2}
+    assert count_failure(retry, [1], 3) == ["1"]
+    assert retry == {"2": 2}
+
+
+def test_count_failure_key_type():
+    retry = {}
+    count_failure(retry, [1], 3, key=int)
+    assert retry == {1: 1}
+
+
+def test_gmail_message_is_given_up_on_after_max_retries():
+    state = gmail_sync._empty_state()
+    for attempt in range(1, gmail_sync.MAX_RETRIES):
+        gmail_sync.keep_for_retry(state, ["m1"])
+        assert state["retry"] == {"m1": attempt}
+        assert state["processed"] == []
+    gmail_sync.keep_for_retry(state, ["m1"])
+    assert state["retry"] == {}
+    assert state["processed"] == ["m1"]  # Not offered again
+
+
+def test_gmail_processed_message_leaves_retry():
+    state = gmail_sync._empty_state()
+    gmail_sync.keep_for_retry(state, ["m1", "m2"])
+    gmail_sync.mark_processed(state, ["m1"])
+    assert state["retry"] == {"m2": 1}
+
+
+def test_imap_newsletter_is_given_up_on_after_max_retries(tmp_path):
+    state = imap.load_imap_state(str(tmp_path / "missing.json"))
+    for attempt in range(1, imap.MAX_RETRIES):
+        imap.keep_for_retry(state, [42])
+        assert state["retry"] == {"42": attempt}
+    # The count survives saving: UIDs are stored as strings, like JSON keys
+    path = str(tmp_path / "imap_state.json")
+    imap.save_imap_state(state, path)
+    state = imap.load_imap_state(path)
+    imap.keep_for_retry(state, [42])
+    assert state["retry"] == {}
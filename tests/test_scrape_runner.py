@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("playwright")
+
+import scrape_runner  # noqa: E402
+from scrape_runner import _crawl_paginated, _merge_with_known  # noqa: E402
+from scrape_state import event_fingerprint  # noqa: E402
+
+SOURCE = {"name": "Mass Audubon", "paginated": True}
+
+
+def event(n, title=None):
+    return {"title": title or f"Program {n}", "date": "Jul 26", "url": f"/p/{n}"}
+
+
+def known_state(*events):
+    return {
+        SOURCE["name"]: {
+            "complete_at": 1.0,
+            "events": {
+                e["url"]: {"fingerprint": event_fingerprint(e), "event": e}
+                for e in events
+            },
+        }
+    }
+
+
+def test_partial_crawl_keeps_known_events_it_did_not_see():
+    state = known_state(event(1), event(2), event(9))
+    results = {1: [event(1, "Program 1 (moved)"), event(3)]}
+    events = _merge_with_known(SOURCE, results, state, {"stop": "page 2 failed"})
+
+    assert [e["url"] for e in events] == ["/p/1", "/p/3", "/p/2", "/p/9"]
+    assert events[0]["title"] == "Program 1 (moved)"
+    saved = state[SOURCE["name"]]
+    assert set(saved["events"]) == {"/p/1", "/p/2", "/p/3", "/p/9"}
+    assert saved["events"]["/p/1"]["fingerprint"] == event_fingerprint(events[0])
+    assert saved["complete_at"] == 1.0
+
+
+def test_exhausted_crawl_drops_events_that_are_gone():
+    state = known_state(event(1), event(2), event(9))
+    results = {1: [event(1)], 2: [event(3)], 3: []}
+    crawl = {"stop": "page 3 is empty", "exhausted": True}
+    events = _merge_with_known(SOURCE, results, state, crawl)
+
+    assert [e["url"] for e in events] == ["/p/1", "/p/3"]
+    saved = state[SOURCE["name"]]
+    assert set(saved["events"]) == {"/p/1", "/p/3"}
+    assert saved["complete_at"] > 1.0
+
+
+def crawl_pages(monkeypatch, pages, stop_at_known, known=None, page_budget=20):
+    """
+    Runs _crawl_paginated over `pages` ({page_num: events or None for a
+    failed page}; pages past the last ones are empty).
+    """
+
+    async def scrape_one_page(context, source, page_num, host_limit, results, known):
+        events = pages.get(page_num, [])
+        if events is not None:
+            results[page_num] = events
+
+    monkeypatch.setattr(scrape_runner, "_scrape_one_page", scrape_one_page)
+    results, crawl = {}, {}
+    asyncio.run(
+        _crawl_paginated(
+            None,
+            SOURCE,
+            None,
+            2,
+            results,
+            known or {},
+            page_budget,
+            crawl,
+            stop_at_known,
+        )
+    )
+    return results, crawl
+
+
+def test_full_crawl_goes_past_known_pages_until_an_empty_page(monkeypatch):
+    pages = {n: [event(n)] for n in range(1, 6)}
+    known = known_state(*[event(n) for n in range(1, 6)])[SOURCE["name"]]["events"]
+    results, crawl = crawl_pages(monkeypatch, pages, False, known)
+    assert sorted(results) == [1, 2, 3, 4, 5, 6]
+    assert crawl == {"stop": "page 6 is empty", "exhausted": True}
+
+
+def test_incremental_crawl_stops_at_a_known_page(monkeypatch):
+    pages = {n: [event(n)] for n in range(1, 6)}
+    known = known_state(event(2))[SOURCE["name"]]["events"]
+    results, crawl = crawl_pages(monkeypatch, pages, True, known)
+    assert crawl == {"stop": "page 2 is all known events"}
+
+
+def test_failed_page_or_budget_is_not_exhausted(monkeypatch):
+    pages = {n: [event(n)] for n in range(1, 6)}
+    _, crawl = crawl_pages(monkeypatch, {**pages, 3: None}, False)
+    assert crawl == {"stop": "page 3 failed"}
+    _, crawl = crawl_pages(monkeypatch, pages, False, page_budget=4)
+    assert crawl == {"stop": "page budget (4) reached"}
@@ -0,0 +1,69 @@
+from text_index import TextIndex, document_id, tokenize
+
+EVENTS = [
+    {"url": "a", "title": "Family Bird Walk", "location": "Drumlin Farm, Lincoln"},
+    {"url": "b", "title": "Pond Exploration", "location": "Broadmoor, Natick"},
+    {"url": "c", "title": "Night Hike", "location": "Lincoln", "description": "Birds"},
+]
+
+
+def synced(events):
+    index = TextIndex()
+    doc_ids = [document_id(event) for event in events]
+    index.sync(doc_ids, events)
+    return index, doc_ids
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("The Bird-Walk at Drumlin!") == ["bird", "walk", "drumlin"]
+
+
+def test_every_word_must_match_and_title_counts_more():
+    index, ids = synced(EVENTS)
+    assert set(index.search("lincoln")) == {ids[0], ids[2]}
+    assert set(index.search("bird walk")) == {ids[0]}
+    assert index.search("bird walk natick") == {}
+    # "bird" is in event 0's title, "birds" only in event 2's description
+    scores = index.search("bird")
+    assert scores[ids[0]] > scores[ids[2]]
+
+
+def test_last_word_matches_as_prefix():
+    index, ids = synced(EVENTS)
+    assert set(index.search("bir")) == {ids[0], ids[2]}
+    assert index.search("bir", prefix=False) == {}
+
+
+def test_search_can_be_limited_to_some_documents():
+    index, ids = synced(EVENTS)
+    assert set(index.search("lincoln", doc_ids=[ids[2]])) == {ids[2]}
+
+
+def test_sync_only_adds_new_and_removes_gone_events():
+    index, ids = synced(EVENTS)
+    changed = dict(EVENTS[1], title="Pond Exploration Club")
+    events = [EVENTS[0], changed, {"url": "d", "title": "Story Time"}]
+    new_ids = [document_id(event) for event in events]
+    assert new_ids[0] == ids[0] and new_ids[1] != ids[1]
+
+    # Unchanged events aren't read again
+    lazy = [None, changed, events[2]]
+    assert index.sync(new_ids, lazy) == (2, 2)
+    assert len(index) == 3
+    assert index.search("night") == {}
+    assert set(index.search("club")) == {new_ids[1]}
+    assert set(index.search("story")) == {new_ids[2]}
+    assert set(index.search("bird walk")) == {ids[0]}
+    assert index.sync(new_ids, lazy) == (0, 0)
+
+
+def test_removing_the_last_document_of_a_term_drops_the_term():
+    index, ids = synced(EVENTS)
+    index.remove(ids[1])
+    assert index.search("pon") == {}
+    assert index.search("natick") == {}
+    index.remove(ids[1])  # Already gone
+    assert len(index) == 2
+    index.sync([], [])
+    assert len(index) == 0
+    assert index.search("bird") == {}
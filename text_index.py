@@ -0,0 +1,183 @@
+"""
+Keyword search over events: an in-memory inverted index with BM25 ranking.
+
+Title, location and (for newsletter events) the description extracted by
+parseStuff are tokenized into one posting list per term; a title match counts
+more than a match elsewhere (FIELD_WEIGHTS). Every query word must match. The
+last word is also matched as a prefix ("bir" -> bird, birding, birds), so
+results can update as the user types.
+
+The index is kept up to date with sync(), which only tokenizes events that
+are new or changed since the last sync and drops the ones that are gone.
+"""
+
+import bisect
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+
+# BM25 parameters (the usual defaults)
+K1 = 1.2
+B = 0.75
+FIELD_WEIGHTS = {"title": 3, "location": 1, "description": 1}
+MAX_PREFIX_TERMS = 50  # Expansions of the last query word that are scored
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and at by for from in of on or the to with".split()
+)  # fmt: skip
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def document_id(event):
+    """
+    Identifies an event's indexed content: a changed event gets a new id.
+    """
+    content = "\x1f".join(
+        str(event.get(field) or "") for field in ("url", "start", *FIELD_WEIGHTS)
+    )
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class TextIndex:
+    def __init__(self):
+        self._postings = {}  # term -> {doc number: weighted term frequency}
+        self._terms = []  # Sorted vocabulary, for prefix lookups
+        self._lengths = {}  # doc number -> weighted length
+        self._doc_terms = {}  # doc number -> its terms, for remove()
+        self._total_length = 0
+        self._numbers = {}  # document id -> doc number
+        self._ids = {}  # doc number -> document id
+        self._next_number = 0
+        self._lock = threading.RLock()  # sync() may run while others search
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id, event):
+        if doc_id in self._numbers:
+            return
+        number = self._next_number
+        self._next_number += 1
+        self._numbers[doc_id] = number
+        self._ids[number] = doc_id
+
+        frequencies = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(event.get(field)):
+                frequencies[token] += weight
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[number] = frequency
+        length = sum(frequencies.values())
+        self._lengths[number] = length
+        self._total_length += length
+        self._doc_terms[number] = list(frequencies)
+
+    def remove(self, doc_id):
+        number = self._numbers.pop(doc_id, None)
+        if number is None:
+            return
+        del self._ids[number]
+        for term in self._doc_terms.pop(number):
+            postings = self._postings[term]
+            del postings[number]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        self._total_length -= self._lengths.pop(number)
+
+    def sync(self, doc_ids, events):
+        """
+        Makes the index hold exactly these events. Returns (added, removed).
+        `events` is indexed like doc_ids and only read for new ids.
+        """
+        with self._lock:
+            wanted = set(doc_ids)
+            stale = [doc_id for doc_id in self._numbers if doc_id not in wanted]
+            for doc_id in stale:
+                self.remove(doc_id)
+            added = 0
+            for i, doc_id in enumerate(doc_ids):
+                if doc_id not in self._numbers:
+                    self.add(doc_id, events[i])
+                    added += 1
+        return added, len(stale)
+
+    def _expand(self, word, prefix):
+        if not prefix:
+            return [word] if word in self._postings else []
+        start = bisect.bisect_left(self._terms, word)
+        end = bisect.bisect_left(self._terms, word + "\uffff")
+        terms = self._terms[start:end]
+        if len(terms) > MAX_PREFIX_TERMS:
+            # Keep the most common completions
+            terms = sorted(terms, key=lambda t: -len(self._postings[t]))
+            terms = terms[:MAX_PREFIX_TERMS]
+        return terms
+
+    def search(self, query, prefix=True, doc_ids=None):
+        """
+        {document id: BM25 score} for events matching every query word.
+        With prefix, the last word also matches as a prefix. `doc_ids` limits
+        the search to those documents (e.g. the events inside a radius), so a
+        common word costs what the radius holds rather than its posting list.
+        """
+        words = tokenize(query)
+        with self._lock:
+            if not words or not self._lengths:
+                return {}
+            allowed = None
+            if doc_ids is not None:
+                allowed = {self._numbers[d] for d in doc_ids if d in self._numbers}
+            n_docs = len(self._lengths)
+            avg_length = self._total_length / n_docs
+            expanded = [
+                self._expand(word, prefix and i == len(words) - 1)
+                for i, word in enumerate(words)
+            ]
+            # Rarest word first: later words only need to look at its matches
+            expanded.sort(key=lambda terms: sum(len(self._postings[t]) for t in terms))
+
+            scores = None
+            for terms in expanded:
+                candidates = allowed if scores is None else scores
+                word_scores = {}
+                for term in terms:
+                    postings = self._postings[term]
+                    idf = math.log(
+                        1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5)
+                    )
+                    if candidates is None or len(postings) <= len(candidates):
+                        matches = postings.items()
+                    else:
+                        matches = (
+                            (n, postings[n]) for n in candidates if n in postings
+                        )
+                    for number, tf in matches:
+                        norm = K1 * (1 - B + B * self._lengths[number] / avg_length)
+                        score = idf * tf * (K1 + 1) / (tf + norm)
+                        # A prefix match counts as its best-scoring completion
+                        if score > word_scores.get(number, 0):
+                            word_scores[number] = score
+                if scores is None:
+                    scores = word_scores
+                    if allowed is not None:
+                        scores = {n: v for n, v in scores.items() if n in allowed}
+                else:
+                    scores = {
+                        number: scores[number] + score
+                        for number, score in word_scores.items()
+                        if number in scores
+                    }
+                if not scores:
+                    return {}
+            return {self._ids[number]: score for number, score in scores.items()}
@@ -0,0 +1,466 @@
+"""
+Local newsletter triage: decides which mail is worth a model call.
+
+A message is scored from its headers (sender, List-Id, List-Unsubscribe,
+subject) and, once it has been downloaded, the start of its body. The score is
+a sum of log-odds from three places:
+
+- rules: one compiled regex matches every keyword and pattern in a single
+  pass; event words ("camp", "workshop", "story time") and schedule-like text
+  ("10am", "Saturday", "ages 4-10") count for, transactional words
+  ("receipt", "password", "Re:") against, list headers a little for
+- a naive Bayes model over hashed features (subject words, sender, domain,
+  List-Id, matched patterns), trained online from what the model found: a
+  newsletter that gave events is a positive example, one that gave none a
+  negative one
+- per-sender memory: senders whose newsletters never have events sink, ones
+  that had events rise
+
+Only what passed triage is learned from, so a list sender that sank would
+stay blocked even once its newsletters have events again. Every
+EXPLORE_EVERY-th rejected message from a list sender triage has learned about
+is let through anyway, so the model gets to look at it and the sender can
+rise again.
+
+Both learned parts (and the rejections counted towards exploring) are saved
+to triage_model.json. Scoring a message takes a
+few microseconds, so it can run on every header fetch.
+
+    triage = get_triage()
+    if triage.is_newsletter(headers):              # headers only
+        ...
+        if triage.is_newsletter(headers, body):    # body fetched
+            events = parseStuff(body)
+            triage.learn(headers, body, bool(events))
+    triage.save()
+
+    python triage.py --bench 2000
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from email.utils import parseaddr
+from functools import lru_cache
+
+from metrics import count
+
+TRIAGE_MODEL_PATH = "triage_model.json"
+MODEL_VERSION = 1
+HASH_BUCKETS = 1 << 16
+MAX_SENDERS = 5000  # Oldest senders are forgotten beyond this
+BODY_SCAN_CHARS = 2000  # Only the start of the body is looked at
+
+NEWSLETTER_THRESHOLD = 1.5
+MIN_CLASS_EXAMPLES = 5  # Naive Bayes stays out until both classes have this many
+
+# (weight per distinct match, max distinct matches counted)
+RULE_WEIGHTS = {
+    "event": (1.0, 3),
+    "schedule": (0.5, 4),
+    "transactional": (-2.0, 2),
+}
+LIST_UNSUBSCRIBE_WEIGHT = 0.5
+LIST_ID_WEIGHT = 0.5
+NO_SCHEDULE_WEIGHT = -1.5  # A fetched body without any date, time or age in it
+SENDER_WEIGHT = 1.0
+EXPLORE_EVERY = 10  # Rejected messages of a known list sender per one let through
+# How long the message let through waits for its body check; if it never comes
+# (the fetch failed), the sender goes back to being triaged normally
+EXPLORE_PENDING_SECONDS = 3600
+
+_PATTERNS = {
+    "event": [
+        r"newsletters?",
+        r"weekly",
+        r"monthly",
+        r"digest",
+        r"highlights",
+        r"events?",
+        r"programs?",
+        r"programming",
+        r"camps?",
+        r"workshops?",
+        r"classes",
+        r"story ?time",
+        r"festivals?",
+        r"calendar",
+        r"upcoming",
+        r"this (?:week|weekend|month)",
+        r"field trips?",
+        r"famil(?:y|ies)",
+        r"kids",
+        r"children",
+        r"teens?",
+        r"walks?",
+        r"hikes?",
+        r"open house",
+        r"vacation week",
+    ],
+    "schedule": [
+        r"\d{1,2}(?::\d\d)? ?(?:am|pm)",
+        r"(?:mon|tues|wednes|thurs|fri|satur|sun)days?",
+        r"(?:jan|feb|mar|apr|jun|jul|aug|sept?|oct|nov|dec)[a-z]* \d{1,2}",
+        r"\d{1,2}/\d{1,2}",
+        r"ages? \d+",
+        r"grades? (?:k|\d+)",
+        r"register(?:ation)?",
+        r"sign up",
+        r"rsvp",
+        r"tickets?",
+    ],
+    "transactional": [
+        r"receipts?",
+        r"invoices?",
+        r"orders?",
+        r"payments?",
+        r"shipp(?:ed|ing)",
+        r"delivered",
+        r"password",
+        r"security alert",
+        r"verif(?:y|ication)",
+        r"sign-?in",
+        r"statements?",
+        r"privacy policy",
+        r"terms of service",
+        r"re:",
+        r"fwd?:",
+    ],
+}
+# One alternation, one pass over lower-cased text: m.lastgroup is the
+# category of each match
+_MATCHER = re.compile(
+    r"\b(?:"
+    + "|".join(
+        f"(?P<{category}>{'|'.join(patterns)})"
+        for category, patterns in _PATTERNS.items()
+    )
+    + r")(?!\w)"
+)
+_WORD_RE = re.compile(r"[a-z0-9']{2,}")
+
+
+def _bucket(feature):
+    # crc32, unlike hash(), is the same in every process
+    return zlib.crc32(feature.encode("utf-8")) & (HASH_BUCKETS - 1)
+
+
+@lru_cache(maxsize=4096)
+def _address(from_header):
+    return parseaddr(from_header)[1].lower()
+
+
+def _sender(headers):
+    return _address(headers.get("From") or "")
+
+
+def _matches(text):
+    """
+    {category: set of matched strings}.
+    """
+    found = {}
+    for m in _MATCHER.finditer(text.lower()):
+        found.setdefault(m.lastgroup, set()).add(m.group())
+    return found
+
+
+def _rule_score(matches):
+    score = 0.0
+    for category, hits in matches.items():
+        weight, cap = RULE_WEIGHTS[category]
+        score += weight * min(len(hits), cap)
+    return score
+
+
+class Triage:
+    def __init__(self, counts=None, docs=None, senders=None, rejected=None):
+        # bucket -> [count in negatives, count in positives]
+        self.counts = counts or {}
+        self.docs = docs or [0, 0]  # Examples without / with events
+        self.senders = senders or {}  # address -> [without events, with events]
+        self.rejected = rejected or {}  # address -> rejections since one let through
+        self._exploring = {}  # Sender -> when a message was let through
+        self._totals = [0, 0]
+        for neg, pos in self.counts.values():
+            self._totals[0] += neg
+            self._totals[1] += pos
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=TRIAGE_MODEL_PATH):
+        """
+        The saved model, or an untrained one (rules only).
+        """
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Could not read {path}, starting untrained: {e}")
+            return cls()
+        if data.get("version") != MODEL_VERSION or data.get("buckets") != HASH_BUCKETS:
+            print(f"[WARN] {path} is from another model version, starting untrained")
+            return cls()
+        return cls(
+            {int(k): v for k, v in data["counts"].items()},
+            data["docs"],
+            data["senders"],
+            data.get("rejected"),
+        )
+
+    def save(self, path=TRIAGE_MODEL_PATH):
+        with self._lock:
+            data = {
+                "version": MODEL_VERSION,
+                "buckets": HASH_BUCKETS,
+                "docs": list(self.docs),
+                "counts": {str(k): v for k, v in self.counts.items()},
+                "senders": dict(self.senders),
+                "rejected": dict(self.rejected),
+            }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _examine(self, headers, body):
+        """
+        (features, matches by category) of a message.
+        """
+        subject = (headers.get("Subject") or "").lower()
+        sender = _sender(headers)
+        features = [f"w:{word}" for word in _WORD_RE.findall(subject)]
+        if sender:
+            features.append(f"from:{sender}")
+            features.append(f"domain:{sender.rpartition('@')[2]}")
+        list_id = (headers.get("List-Id") or "").strip()
+        if list_id:
+            features.append(f"list:{list_id.lower()}")
+        if headers.get("List-Unsubscribe"):
+            features.append("unsubscribe")
+
+        matches = _matches(subject)
+        if body is not None:
+            body_matches = _matches(body[:BODY_SCAN_CHARS])
+            features.extend(
+                f"body:{category}:{hit}"
+                for category, hits in body_matches.items()
+                for hit in hits
+            )
+            for category, hits in body_matches.items():
+                matches.setdefault(category, set()).update(hits)
+        return features, matches
+
+    def _bayes(self, features):
+        """
+        Naive Bayes log-odds of "has events", or 0 until it has seen enough
+        of both classes.
+        """
+        neg_docs, pos_docs = self.docs
+        if min(neg_docs, pos_docs) < MIN_CLASS_EXAMPLES:
+            return 0.0
+        neg_total = self._totals[0] + HASH_BUCKETS
+        pos_total = self._totals[1] + HASH_BUCKETS
+        score = math.log(pos_docs / neg_docs)
+        for feature in features:
+            neg, pos = self.counts.get(_bucket(feature), (0, 0))
+            score += math.log((pos + 1) / pos_total) - math.log((neg + 1) / neg_total)
+        return score
+
+    def _sender_score(self, sender):
+        without, with_events = self.senders.get(sender, (0, 0))
+        if not without and not with_events:
+            return 0.0
+        return SENDER_WEIGHT * math.log((with_events + 0.5) / (without + 0.5))
+
+    def score(self, headers, body=None):
+        """
+        Log-odds that the message is a newsletter with events in it.
+        `headers` maps Subject, From, List-Id and List-Unsubscribe to their
+        values; `body` (text) adds the body features.
+        """
+        features, matches = self._examine(headers, body)
+        score = _rule_score(matches)
+        if headers.get("List-Unsubscribe"):
+            score += LIST_UNSUBSCRIBE_WEIGHT
+        if headers.get("List-Id"):
+            score += LIST_ID_WEIGHT
+        if body is not None and "schedule" not in matches:
+            score += NO_SCHEDULE_WEIGHT
+        return score + self._bayes(features) + self._sender_score(_sender(headers))
+
+    def is_newsletter(self, headers, body=None):
+        if self.score(headers, body) >= NEWSLETTER_THRESHOLD:
+            return True
+        return self._explore(headers, body)
+
+    def _explore(self, headers, body=None):
+        """
+        True for every EXPLORE_EVERY-th rejected message of a list sender with
+        sender memory, and for that message's body check after its header
+        check let it through. Only one message of a sender is let through at a
+        time.
+        """
+        sender = _sender(headers)
+        if sender not in self.senders:
+            return False
+        if not (headers.get("List-Id") or headers.get("List-Unsubscribe")):
+            return False
+        with self._lock:
+            started = self._exploring.get(sender)
+            if started is not None:
+                if body is not None:
+                    del self._exploring[sender]  # The body check: done exploring
+                    return True
+                if time.monotonic() - started < EXPLORE_PENDING_SECONDS:
+                    return False
+                del self._exploring[sender]
+            rejected = self.rejected.get(sender, 0) + 1
+            if rejected < EXPLORE_EVERY:
+                self.rejected[sender] = rejected
+                return False
+            self.rejected.pop(sender, None)
+            if body is None:
+                self._exploring[sender] = time.monotonic()
+        count("triage.explored")
+        return True
+
+    def learn(self, headers, body, has_events):
+        """
+        Records what the model found in a newsletter that passed triage (or
+        was let through to explore).
+        """
+        features, _ = self._examine(headers, body)
+        label = 1 if has_events else 0
+        sender = _sender(headers)
+        with self._lock:
+            self.docs[label] += 1
+            for feature in features:
+                bucket = _bucket(feature)
+                counts = self.counts.get(bucket)
+                if counts is None:
+                    counts = self.counts[bucket] = [0, 0]
+                counts[label] += 1
+                self._totals[label] += 1
+            if sender:
+                # Re-inserted so the least recently seen senders are dropped first
+                memory = self.senders.pop(sender, [0, 0])
+                memory[label] += 1
+                self.senders[sender] = memory
+                self._exploring.pop(sender, None)
+                while len(self.senders) > MAX_SENDERS:
+                    forgotten = next(iter(self.senders))
+                    del self.senders[forgotten]
+                    self.rejected.pop(forgotten, None)
+
+
+_triage = None
+_triage_lock = threading.Lock()
+
+
+def get_triage(path=TRIAGE_MODEL_PATH):
+    """
+    The shared Triage, loaded from `path` on first use.
+    """
+    global _triage
+    with _triage_lock:
+        if _triage is None:
+            _triage = Triage.load(path)
+        return _triage
+
+
+_BULK_UPDATES = [
+    ("Important update to our privacy policy", "Legal <legal@example.com>"),
+    ("Product update: 5 new features", "Team <news@example.com>"),
+    ("Your account update", "Service <no-reply@example.com>"),
+    ("Weekly update from your bank", "Bank <alerts@example.com>"),
+]
+
+
+def _benchmark(messages):
+    """
+    Triage on fake_gmail's sample mailbox, with a quarter of bulk mail added
+    that has no events (policy and product updates). Compares how many
+    messages the subject words of the old determineEmailType() and triage
+    pass on to the model, and times scoring.
+    """
+    import random
+    import time
+
+    from fake_gmail import SAMPLE_SUBJECTS, FakeGmailService, make_message
+    from gmail_fetch import triage_headers
+    from quickstart import get_message_body
+
+    old_words = ("weekly", "monthly", "update", "newsletter", "digest", "highlights")
+    rng = random.Random(0)
+    service = FakeGmailService.with_sample_mailbox(messages)
+    for n in range(messages // 4):
+        subject, sender = rng.choice(_BULK_UPDATES)
+        service.add_message(
+            make_message(
+                f"u{n:06d}",
+                subject,
+                sender,
+                "We updated our terms. No action is needed.",
+                {"List-Unsubscribe": "<https://example.com/unsubscribe>"},
+            )
+        )
+    msgs = [
+        service.users().messages().get(userId="me", id=msg_id).execute()
+        for msg_id in service.order
+    ]
+    headers = [triage_headers(msg) for msg in msgs]
+    with_events = {subject for subject, newsletter in SAMPLE_SUBJECTS if newsletter}
+    triage = Triage()
+
+    started = time.perf_counter()
+    passed = [triage.is_newsletter(h) for h in headers]
+    per_message = (time.perf_counter() - started) / len(headers) * 1e6
+    # The pipeline only fetches the bodies of what passed the headers
+    started = time.perf_counter()
+    with_body = [
+        ok and triage.is_newsletter(h, get_message_body(msg["payload"]))
+        for h, msg, ok in zip(headers, msgs, passed)
+    ]
+    per_body = (time.perf_counter() - started) / max(sum(passed), 1) * 1e6
+    old = [any(w in h["Subject"].lower() for w in old_words) for h in headers]
+    for name, verdicts in (
+        ("subject words", old),
+        ("triage, headers", passed),
+        ("triage, headers + body", with_body),
+    ):
+        missed = sum(
+            h["Subject"] in with_events and not v for h, v in zip(headers, verdicts)
+        )
+        print(
+            f"[BENCH] {name}: {sum(verdicts)} of {len(headers)} messages go to the "
+            f"model, {missed} newsletters with events missed"
+        )
+    print(
+        f"[BENCH] triage: {per_message:.1f} µs/message on headers, "
+        f"{per_body:.1f} µs/message with the body"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local newsletter triage.")
+    parser.add_argument("--bench", type=int, metavar="MESSAGES")
+    parser.add_argument("--model", default=TRIAGE_MODEL_PATH)
+    args = parser.parse_args()
+
+    if args.bench:
+        _benchmark(args.bench)
+    else:
+        triage = Triage.load(args.model)
+        print(
+            f"[DEBUG] {args.model}: {triage.docs[1]} examples with events, "
+            f"{triage.docs[0]} without, {len(triage.counts)} features, "
+            f"{len(triage.senders)} senders"
+        )